@@ -36,8 +36,20 @@ def downloadstatsbomb(ctx, zipfile: str):
 @click.option('--pgurl', required=False, default=os.environ.get('PGURL', None), help='Postgresql db url.')
 @click.option('--matchpath', required=False, default=None, help='StatsBomb match id (competition/match).')
 @click.option('--quiet', is_flag=True, default=False, required=False, help='No prompting, assume Yes.')
+@click.option('--cachedir', required=False, default=os.environ.get('CACHEDIR', None), help='Directory for parser caches.')
+@click.option('--cachesize', required=False, type=int, default=int(os.environ.get('CACHESIZE', 1024)), help='Max size of the parse cache in MB.')
+@click.option('--rowbudget', required=False, type=int, default=None, help='Max rows and relations per parser kept in memory, the rest is spilled to disk.')
+@click.option('--flattenarrays', required=False, type=int, default=0, help='Store numeric arrays up to this length, like locations, as columns.')
+@click.option('--include', required=False, multiple=True, help='Key path pattern to keep, like events.tactics.*, the rest of that file is skipped. Repeatable.')
+@click.option('--exclude', required=False, multiple=True, help='Key path pattern to skip, like events.tactics.lineup. Repeatable.')
+@click.option('--eventtype', required=False, multiple=True, help='Only import events of this type, like Shot. Repeatable.')
+@click.option('--rowencoding', required=False, type=click.Choice(['json', 'binary']), default='json', help='Row encoding for the row hashes. Changing it changes all row ids.')
+@click.option('--references', is_flag=True, default=False, required=False, help='Store {id, name} objects, like teams and players, once per id with foreign key columns instead of relation tables.')
+@click.option('--naturalkeys', is_flag=True, default=False, required=False, help='Use match ids and event uuids as row ids instead of content hashes.')
+@click.option('--parseworkers', required=False, type=int, default=1, help='Worker processes that split the parsing of each large file, when files are parsed one at a time.')
+@click.option('--sessionsize', required=False, type=int, default=10, help='Matches that are parsed, reported and persisted together, which bounds the memory used.')
 @click.pass_context
-def importstatsbomb(ctx, zipfile: str, sqlitefile: str, pgurl: str, matchpath: str, quiet: bool):
+def importstatsbomb(ctx, zipfile: str, sqlitefile: str, pgurl: str, matchpath: str, quiet: bool, cachedir: str, cachesize: int, rowbudget: int, flattenarrays: int, rowencoding: str, include: tuple, exclude: tuple, eventtype: tuple, references: bool, naturalkeys: bool, parseworkers: int, sessionsize: int):
     ctx.obj.update({
         'sciptname': os.path.abspath(__file__),
         'zipfile': zipfile,
@@ -45,6 +57,18 @@ def importstatsbomb(ctx, zipfile: str, sqlitefile: str, pgurl: str, matchpath: s
         'pgurl': pgurl,
         'matchpath': matchpath,
         'quiet': quiet,
+        'cachedir': cachedir,
+        'cachesize': cachesize,
+        'rowbudget': rowbudget,
+        'flattenarrays': flattenarrays,
+        'rowencoding': rowencoding,
+        'include': list(include),
+        'exclude': list(exclude),
+        'eventtype': list(eventtype),
+        'references': references,
+        'naturalkeys': naturalkeys,
+        'parseworkers': parseworkers,
+        'sessionsize': sessionsize,
     })
     from runners.importstatsbomb import ImportStatsBombRunner
     runner = ImportStatsBombRunner(ctx.obj)
@@ -0,0 +1,103 @@
+import sys
+import time
+import logging
+
+from .parser import Parser
+from .rowhash import RowEncoder
+from .tokenizers import createTokenizer
+from .tokenizers import getAvailableTokenizers
+
+logger0 = logging.getLogger('Benchmark')
+
+
+def createUnreducedParser(text, rootTableName, config={}):
+    # Parses up to, but not including, reduceRows.
+    parser = Parser({
+        'config': {
+            'rootTableName': rootTableName,
+            'engine': 'tree',
+            'reduce': 'tables',
+            **config,
+        }
+    })
+    parser.parse(text)
+    return parser
+
+
+def clearRowHashes(parser):
+    for tableName, table in parser['tableMap'].items():
+        rowHashName = parser.configee.getRowHashName(tableName)
+        for rowId in table['rows']:
+            parser['rowMap'][rowId].pop(rowHashName, None)
+
+
+def hashRowWise(parser):
+    for tableName, table in parser['tableMap'].items():
+        for rowId in table['rows']:
+            parser.getRowHash(tableName, parser['rowMap'][rowId])
+
+
+def benchmarkRowHashing(text, rootTableName, repeat=3, logger=logger0):
+    # Rows per second for hashing all rows the way reduceRows does, per
+    # row encoding, row by row through getRowHash and in table batches.
+    parser = createUnreducedParser(text, rootTableName)
+    rowCount = sum([len(table['rows']) for table in parser['tableMap'].values()])
+    res = {}
+    for encoding in ('json', 'binary'):
+        parser._rowEncoder = None if encoding == 'json' \
+            else RowEncoder(parser.configee['binaryHasher'])
+        for mode, hasher in (('rows', hashRowWise), ('batch', Parser.hashTables)):
+            best = None
+            for _ in range(repeat):
+                clearRowHashes(parser)
+                start = time.perf_counter()
+                hasher(parser)
+                elapsed = time.perf_counter() - start
+                best = elapsed if best is None else min(best, elapsed)
+            res[(encoding, mode)] = rowCount / best
+            logger.info('%s %s: %d rows/s', encoding, mode, res[(encoding, mode)])
+    return res
+
+
+class EventCounter:
+
+    # A tokenizer listener that only counts the events.
+    def __init__(self):
+        self.count = 0
+
+    def __getattr__(self, name):
+        if not name.startswith('_on_'):
+            raise AttributeError(name)
+        return self.add
+
+    def add(self, *args):
+        self.count += 1
+
+
+def benchmarkTokenizers(text, repeat=3, bufferSize=64 * 1024, logger=logger0):
+    # Events per second for each available tokenizer, fed with chunks the
+    # size of the parser's reads.
+    chunks = [text[i:i + bufferSize] for i in range(0, len(text), bufferSize)]
+    res = {}
+    for name in getAvailableTokenizers():
+        best = None
+        for _ in range(repeat):
+            counter = EventCounter()
+            tokenizer = createTokenizer(name, counter)
+            start = time.perf_counter()
+            for chunk in chunks:
+                tokenizer.consume(chunk)
+            tokenizer.close()
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        res[name] = counter.count / best
+        logger.info('%s: %d events/s', name, res[name])
+    return res
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    with open(sys.argv[1], 'r') as f:
+        text = f.read()
+    benchmarkTokenizers(text)
+    benchmarkRowHashing(text, sys.argv[2] if len(sys.argv) > 2 else 'events')
@@ -0,0 +1,278 @@
+from collections.abc import Mapping
+from collections.abc import Set
+
+import numpy as np
+
+
+missing = object()
+
+
+def createIdPositions(ids):
+    # Object ids, like natural ids next to hashes, need not be sortable,
+    # so they are found through a dict instead of a binary search.
+    if ids.dtype != object:
+        return None
+    return {id: pos for pos, id in reversed(list(enumerate(ids.tolist())))}
+
+
+class ColumnarColumn:
+
+    @classmethod
+    def create(cls, values):
+        present = [v for v in values if v is not missing]
+        for kind, dtype in (('int', np.int64), ('float', np.float64)):
+            pyType = int if kind == 'int' else float
+            if len(present) == 0 \
+               or not all(type(v) is pyType for v in present):
+                continue
+            try:
+                array = np.array(
+                    [pyType(0) if v is missing else v for v in values], dtype=dtype)
+            except OverflowError:
+                break
+            mask = None if len(present) == len(values) else np.array(
+                [v is not missing for v in values], dtype=bool)
+            return ColumnarColumn(kind, array, mask=mask)
+
+        # Everything else (strings, bools, None, mixed or huge ints) is
+        # dictionary encoded, with -1 for rows that lack the column.
+        dictionary = {}
+        codes = np.empty(len(values), dtype=np.int32)
+        for i, v in enumerate(values):
+            if v is missing:
+                codes[i] = -1
+                continue
+            key = (type(v), v)
+            if not key in dictionary:
+                dictionary[key] = len(dictionary)
+            codes[i] = dictionary[key]
+        return ColumnarColumn('dict', codes, dictionary=[key[1] for key in dictionary.keys()])
+
+    def __init__(self, kind, array, mask=None, dictionary=None):
+        self.kind = kind
+        self.array = array
+        self.mask = mask
+        self.dictionary = dictionary
+
+    def has(self, pos):
+        if self.kind == 'dict':
+            return self.array[pos] >= 0
+        return self.mask is None or bool(self.mask[pos])
+
+    def get(self, pos):
+        if self.kind == 'dict':
+            return self.dictionary[self.array[pos]]
+        if self.kind == 'int':
+            return int(self.array[pos])
+        return float(self.array[pos])
+
+    @property
+    def nbytes(self):
+        res = self.array.nbytes
+        res += 0 if self.mask is None else self.mask.nbytes
+        return res
+
+
+class ColumnarTable(Set):
+
+    @classmethod
+    def createIds(cls, ids):
+        if all(type(id) is int and 0 <= id < 2 ** 64 for id in ids):
+            return np.array(ids, dtype=np.uint64)
+        return np.array(ids, dtype=object)
+
+    @classmethod
+    def restore(cls, ids, columns, idColumns):
+        self = cls.__new__(cls)
+        self.ids = ids
+        self.idPositions = createIdPositions(ids)
+        self.columns = columns
+        self.idColumns = list(idColumns)
+        return self
+
+    def __init__(self, rowIds, rowMap, idColumns=()):
+        rowIds = list(rowIds)
+        try:
+            rowIds.sort()
+        except TypeError:
+            pass
+        self.ids = self.createIds(rowIds)
+        self.idPositions = createIdPositions(self.ids)
+
+        rows = [rowMap[id] for id in rowIds]
+        columnNames = {}
+        for row in rows:
+            for column in row.keys():
+                columnNames[column] = True
+
+        # Columns that always repeat the row id (the id and hash columns
+        # after reduceRows) are not stored but read from the id vector.
+        self.idColumns = [
+            column for column in columnNames.keys()
+            if column in idColumns and all(
+                column in row and row[column] == rowIds[i] for i, row in enumerate(rows))
+        ]
+        self.columns = {
+            column: ColumnarColumn.create([
+                row[column] if column in row else missing for row in rows
+            ])
+            for column in columnNames.keys() if not column in self.idColumns
+        }
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __iter__(self):
+        return iter(self.ids.tolist())
+
+    def __contains__(self, rowId):
+        return self.find(rowId) is not None
+
+    def find(self, rowId):
+        if not self.idPositions is None:
+            return self.idPositions.get(rowId)
+        try:
+            pos = int(np.searchsorted(self.ids, rowId))
+        except TypeError:
+            return None
+        if pos < len(self.ids) and self.ids[pos] == rowId:
+            return pos
+        return None
+
+    def getRow(self, pos):
+        id = self.ids[pos]
+        id = int(id) if self.ids.dtype == np.uint64 else id
+        row = {column: id for column in self.idColumns}
+        for name, column in self.columns.items():
+            if column.has(pos):
+                row[name] = column.get(pos)
+        return row
+
+    @property
+    def nbytes(self):
+        return self.ids.nbytes + sum([c.nbytes for c in self.columns.values()])
+
+
+class ColumnarRowMap(Mapping):
+
+    @classmethod
+    def restore(cls, tables, ids, tableIxs, positions):
+        self = cls.__new__(cls)
+        self.tables = list(tables)
+        self.ids = ids
+        self.tableIxs = tableIxs
+        self.positions = positions
+        self.idPositions = createIdPositions(ids)
+        return self
+
+    def __init__(self, tables):
+        self.tables = list(tables)
+        idss = [table.ids for table in self.tables]
+        tableIxs = [
+            np.full(len(table), i, dtype=np.int32) for i, table in enumerate(self.tables)
+        ]
+        positions = [np.arange(len(table), dtype=np.int64)
+                     for table in self.tables]
+        ids = np.concatenate(idss) if len(idss) > 0 else np.array([], dtype=np.uint64)
+        if ids.dtype != np.uint64 and ids.dtype != object:
+            ids = ids.astype(object)
+        if ids.dtype == object:
+            order = np.array(sorted(createIdPositions(ids).values()), dtype=np.int64)
+        else:
+            order = np.argsort(ids, kind='stable')
+        ids = ids[order]
+        keep = np.ones(len(ids), dtype=bool)
+        keep[1:] = ids[1:] != ids[:-1]
+        self.ids = ids[keep]
+        self.tableIxs = np.concatenate(tableIxs)[order][keep] \
+            if len(tableIxs) > 0 else np.array([], dtype=np.int32)
+        self.positions = np.concatenate(positions)[order][keep] \
+            if len(positions) > 0 else np.array([], dtype=np.int64)
+        self.idPositions = createIdPositions(self.ids)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __iter__(self):
+        return iter(self.ids.tolist())
+
+    def __getitem__(self, rowId):
+        if not self.idPositions is None:
+            pos = self.idPositions.get(rowId)
+            if pos is None:
+                raise KeyError(rowId)
+        else:
+            try:
+                pos = int(np.searchsorted(self.ids, rowId))
+            except TypeError:
+                raise KeyError(rowId)
+            if pos >= len(self.ids) or self.ids[pos] != rowId:
+                raise KeyError(rowId)
+        table = self.tables[self.tableIxs[pos]]
+        return table.getRow(int(self.positions[pos]))
+
+    @property
+    def nbytes(self):
+        return self.ids.nbytes + self.tableIxs.nbytes + self.positions.nbytes \
+            + sum([table.nbytes for table in self.tables])
+
+
+class ColumnarIndexees:
+
+    @classmethod
+    def restore(cls, parentChildPair, parentIds, childIds):
+        self = cls.__new__(cls)
+        self.parentChildPair = tuple(parentChildPair)
+        self.parentIds = parentIds
+        self.childIds = childIds
+        self.order = None
+        self.sortedParentIds = None
+        return self
+
+    def __init__(self, parentChildPair, relations):
+        self.parentChildPair = tuple(parentChildPair)
+        parentIds = []
+        childIds = []
+        for relation in relations:
+            parentIds.append(relation[self.parentChildPair[0]])
+            childIds.append(relation[self.parentChildPair[1]])
+        self.parentIds = ColumnarTable.createIds(parentIds)
+        self.childIds = ColumnarTable.createIds(childIds)
+        self.order = None
+        self.sortedParentIds = None
+
+    def __len__(self):
+        return len(self.parentIds)
+
+    def __iter__(self):
+        parentName, childName = self.parentChildPair
+        for parentId, childId in zip(self.parentIds.tolist(), self.childIds.tolist()):
+            yield {
+                parentName: parentId,
+                childName: childId,
+            }
+
+    def getChildIds(self, parentId):
+        # Parent ids are sorted once. Ids of mixed types, e.g. natural ids
+        # among hashes, cannot be sorted and are scanned instead.
+        if self.order is None:
+            try:
+                self.order = np.argsort(self.parentIds, kind='stable')
+                self.sortedParentIds = self.parentIds[self.order]
+            except TypeError:
+                self.order = False
+        if self.order is False:
+            return [
+                childId for pId, childId in zip(self.parentIds.tolist(), self.childIds.tolist())
+                if pId == parentId
+            ]
+        try:
+            start = int(np.searchsorted(self.sortedParentIds, parentId, side='left'))
+            end = int(np.searchsorted(self.sortedParentIds, parentId, side='right'))
+        except TypeError:
+            return []
+        return self.childIds[self.order[start:end]].tolist()
+
+    @property
+    def nbytes(self):
+        return self.parentIds.nbytes + self.childIds.nbytes
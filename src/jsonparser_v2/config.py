@@ -3,6 +3,8 @@ import xxhash
 from contrib.pyas.src.pyas_v3 import As
 from contrib.pyas.src.pyas_v3 import Leaf
 
+from .stringpool import stringPool
+
 
 class ConfigMixin(Leaf):
 
@@ -15,7 +17,29 @@ class ConfigMixin(Leaf):
                 'rowValueNameGetter': None,
                 'hashIdNameGetter': None,
                 'hasher': lambda val: xxhash.xxh64(val).intdigest(),
+                'rowEncoding': 'json',
+                'binaryHasher': xxhash.xxh3_64_intdigest,
+                'stringPool': stringPool,
+                'input': 'json',
                 'encoding': None,
+                'bufferSize': 64 * 1024,
+                'engine': 'stream',
+                'tokenizer': None,
+                'workers': 1,
+                'storage': 'dict',
+                'reduce': 'rows',
+                'schemaPlanDir': None,
+                'rowStore': 'memory',
+                'rowStoreBudget': 200 * 1000,
+                'rowStoreDir': None,
+                'sink': None,
+                'flattenArrayLength': 0,
+                'includeKeyPaths': None,
+                'excludeKeyPaths': None,
+                'elementFilter': None,
+                'referenceColumns': None,
+                'referenceIdName': 'id',
+                'naturalKeys': None,
                 'fileName': '',
                 'rootTableName': 'root',
             },
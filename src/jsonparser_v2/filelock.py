@@ -0,0 +1,23 @@
+import os
+import fcntl
+
+
+class FileLock:
+
+    # An exclusive advisory lock on a file next to the locked one, held by
+    # one process at a time, e.g. while a shared cache file is read, merged
+    # and rewritten.
+    def __init__(self, path):
+        self.path = path
+        self.fd = None
+
+    def __enter__(self):
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        self.fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        fcntl.flock(self.fd, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *args):
+        fcntl.flock(self.fd, fcntl.LOCK_UN)
+        os.close(self.fd)
+        self.fd = None
@@ -0,0 +1,153 @@
+import os
+import math
+import struct
+import tempfile
+import ujson
+import xxhash
+
+import numpy as np
+
+from .filelock import FileLock
+
+
+class RowHashFilter:
+
+    # A Bloom filter over row ids. Ids are content hashes after reduceRows,
+    # so a hit means the row is most likely stored already, while a miss
+    # means it certainly is not.
+    magic = b'P4HF'
+    formatVersion = 1
+    preamble = struct.Struct('<4sIQQQQ')
+    # Filters cannot grow, and filters of one database are merged, so they
+    # are created with one configured capacity. Hits are confirmed in the
+    # database, so the error rate only decides how many rows are looked up
+    # in vain.
+    defaultCapacity = 1000 * 1000
+
+    @classmethod
+    def create(cls, capacity=defaultCapacity, errorRate=1e-4):
+        bitCount = math.ceil(-capacity * math.log(errorRate) / math.log(2) ** 2)
+        bitCount += (-bitCount) % 64
+        hashCount = max(1, round(bitCount / capacity * math.log(2)))
+        return RowHashFilter(bitCount, hashCount)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, 'rb') as f:
+            magic, formatVersion, bitCount, hashCount, count, headerLength = \
+                cls.preamble.unpack(f.read(cls.preamble.size))
+            if magic != cls.magic or formatVersion != cls.formatVersion:
+                raise ValueError('Unknown row hash filter format in {}.'.format(path))
+            header = ujson.loads(f.read(headerLength))
+            bits = np.fromfile(f, dtype=np.uint8, count=bitCount // 8)
+        return RowHashFilter(bitCount, hashCount, bits=bits, count=count,
+                             tableNames=header['tableNames'])
+
+    @classmethod
+    def createKeys(cls, ids):
+        keys = np.empty(len(ids), dtype=np.uint64)
+        for i, id in enumerate(ids):
+            keys[i] = id if type(id) is int and 0 <= id < 2 ** 64 \
+                else xxhash.xxh64(str(id)).intdigest()
+        return keys
+
+    @classmethod
+    def mix(cls, keys):
+        # splitmix64 finalizer, which spreads the bits of sequential or
+        # otherwise structured keys.
+        keys = keys ^ (keys >> np.uint64(30))
+        keys = keys * np.uint64(0xbf58476d1ce4e5b9)
+        keys = keys ^ (keys >> np.uint64(27))
+        keys = keys * np.uint64(0x94d049bb133111eb)
+        return keys ^ (keys >> np.uint64(31))
+
+    def __init__(self, bitCount, hashCount, bits=None, count=0, tableNames=()):
+        self.bitCount = bitCount
+        self.hashCount = hashCount
+        self.bits = np.zeros(bitCount // 8, dtype=np.uint8) if bits is None else bits
+        self.count = count
+        self.tableNames = list(tableNames)
+        # Ids added since the filter was loaded or saved.
+        self.added = []
+
+    def __len__(self):
+        return self.count
+
+    def isCompatible(self, other):
+        return self.bitCount == other.bitCount and self.hashCount == other.hashCount
+
+    def merge(self, other):
+        # The union of two filters of the same size. Rows in both are
+        # counted once, since the count is estimated from the set bits.
+        if not self.isCompatible(other):
+            raise ValueError('Cannot merge row hash filters of different sizes.')
+        np.bitwise_or(self.bits, other.bits, out=self.bits)
+        setCount = int(np.unpackbits(self.bits).sum())
+        self.count = 0 if setCount == 0 else round(
+            -self.bitCount / self.hashCount * math.log(1 - min(setCount, self.bitCount - 1) / self.bitCount))
+        self.tableNames += [name for name in other.tableNames if not name in self.tableNames]
+
+    def getPositions(self, ids):
+        with np.errstate(over='ignore'):
+            h1 = self.mix(self.createKeys(ids))
+            h2 = self.mix(h1 ^ np.uint64(0x9e3779b97f4a7c15)) | np.uint64(1)
+            return [
+                (h1 + np.uint64(i) * h2) % np.uint64(self.bitCount)
+                for i in range(self.hashCount)
+            ]
+
+    def add(self, ids, tableName=None):
+        if not tableName is None and not tableName in self.tableNames:
+            self.tableNames.append(tableName)
+        self.added.append((ids, tableName))
+        if len(ids) < 1:
+            return
+        for positions in self.getPositions(ids):
+            np.bitwise_or.at(self.bits, positions >> np.uint64(3),
+                             np.left_shift(1, positions & np.uint64(7)).astype(np.uint8))
+        self.count += len(ids)
+
+    def contains(self, ids):
+        res = np.ones(len(ids), dtype=bool)
+        if len(ids) < 1:
+            return res
+        for positions in self.getPositions(ids):
+            res &= (self.bits[positions >> np.uint64(3)]
+                    >> (positions & np.uint64(7)).astype(np.uint8)) & 1 == 1
+        return res
+
+    def saveMerged(self, path):
+        # Files persisted in parallel share the filter on disk, so the
+        # stored bits are added under a lock instead of overwritten. A
+        # stored filter of another size, e.g. of another capacity, gets the
+        # ids added here instead. Returns the filter that was saved.
+        res = self
+        with FileLock(path + '.lock'):
+            if os.path.exists(path):
+                stored = self.load(path)
+                if self.isCompatible(stored):
+                    self.merge(stored)
+                else:
+                    for ids, tableName in self.added:
+                        stored.add(ids, tableName=tableName)
+                    res = stored
+            res.save(path)
+        self.added = []
+        return res
+
+    def save(self, path):
+        dirPath = os.path.dirname(os.path.abspath(path))
+        header = ujson.dumps({'tableNames': self.tableNames}).encode('utf-8')
+        fd, tmpPath = tempfile.mkstemp(dir=dirPath, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(self.preamble.pack(self.magic, self.formatVersion, self.bitCount,
+                                           self.hashCount, self.count, len(header)))
+                f.write(header)
+                self.bits.tofile(f)
+            os.replace(tmpPath, path)
+            self.added = []
+        except BaseException:
+            if os.path.exists(tmpPath):
+                os.remove(tmpPath)
+            raise
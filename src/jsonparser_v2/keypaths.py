@@ -0,0 +1,143 @@
+from fnmatch import fnmatchcase
+
+
+class KeyPathFilter:
+
+    # Key paths are the keys from the root table down to a key, joined by
+    # dots, e.g. events.tactics.lineup, since arrays do not add to a path.
+    # Patterns match segment by segment, with fnmatch wildcards in each
+    # segment. Excluded keys are dropped with everything below them. With
+    # include patterns, only the included keys, everything below them and
+    # the keys leading to them are kept. Include patterns only apply to the
+    # root tables they name, so one list can serve all files.
+
+    @classmethod
+    def create(cls, rootTableName, include=None, exclude=None):
+        include = None if include is None else [
+            pattern for pattern in cls.splitAll(include)
+            if fnmatchcase(rootTableName, pattern[0])
+        ]
+        exclude = [] if exclude is None else cls.splitAll(exclude)
+        if (include is None or len(include) == 0) and len(exclude) == 0:
+            return None
+        return KeyPathFilter(include if include else None, exclude)
+
+    @classmethod
+    def splitAll(cls, patterns):
+        if isinstance(patterns, str):
+            patterns = [patterns]
+        return [tuple(pattern.split('.')) for pattern in patterns]
+
+    @classmethod
+    def matches(cls, path, pattern):
+        return len(path) == len(pattern) and all(
+            fnmatchcase(key, part) for key, part in zip(path, pattern))
+
+    def __init__(self, include, exclude):
+        self.include = include
+        self.exclude = exclude
+        self.decisions = {}
+
+    def isIncluded(self, path):
+        for pattern in self.include:
+            n = min(len(path), len(pattern))
+            if self.matches(path[:n], pattern[:n]):
+                return True
+        return False
+
+    def keep(self, path):
+        if path in self.decisions:
+            return self.decisions[path]
+        res = not any(self.matches(path, pattern) for pattern in self.exclude) \
+            and (self.include is None or self.isIncluded(path))
+        self.decisions[path] = res
+        return res
+
+
+class ElementFilter:
+
+    # Keeps the top level elements of the root array where every field, a
+    # key path within the element like type.name, has an accepted value.
+    # A field accepts the values in a collection or, given a function, the
+    # values it returns True for. Missing fields have the value None.
+    # Arrays do not add to a path, and the first value that is not None
+    # wins, for the tree engine (lookup) and the stream engine
+    # (ElementMatcher) alike.
+
+    @classmethod
+    def create(cls, fields):
+        if not fields:
+            return None
+        return ElementFilter(fields)
+
+    def __init__(self, fields):
+        self.fields = {
+            tuple(path.split('.')): accept for path, accept in fields.items()
+        }
+
+    def accepts(self, path, val):
+        accept = self.fields[path]
+        return accept(val) if callable(accept) else val in accept
+
+    def lookup(self, node, path):
+        if isinstance(node, list) and len(path) > 0:
+            for item in node:
+                val = self.lookup(item, path)
+                if not val is None:
+                    return val
+            return None
+        if len(path) == 0:
+            return None if isinstance(node, (dict, list)) else node
+        if not isinstance(node, dict) or not path[0] in node:
+            return None
+        return self.lookup(node[path[0]], path[1:])
+
+    def keep(self, element, transform=lambda val: val):
+        return all(
+            self.accepts(path, transform(self.lookup(element, path)))
+            for path in self.fields
+        )
+
+
+class ElementMatcher:
+
+    # Follows the stream events of one element until its fields decide on
+    # it. The events are kept, so a kept element can be replayed.
+    def __init__(self, elementFilter):
+        self.filter = elementFilter
+        self.events = []
+        self.path = []
+        self.containers = []
+        self.values = {}
+
+    @property
+    def depth(self):
+        return len(self.containers)
+
+    def add(self, event, *args):
+        self.events.append((event, args))
+        if event == 'key':
+            self.path.append(args[0])
+        elif event == 'value':
+            path = tuple(self.path)
+            if path in self.filter.fields and not path in self.values \
+               and not args[0] is None:
+                self.values[path] = args[0]
+                if not self.filter.accepts(path, args[0]):
+                    return False
+            self.path.pop()
+        elif event in ('object_start', 'array_start'):
+            self.containers.append(event)
+        elif event in ('object_end', 'array_end'):
+            self.containers.pop()
+            if len(self.containers) > 0 and self.containers[-1] == 'object_start':
+                self.path.pop()
+
+        if len(self.values) == len(self.filter.fields):
+            return True
+        if len(self.containers) == 0:
+            return all(
+                self.filter.accepts(path, self.values.get(path))
+                for path in self.filter.fields
+            )
+        return None
@@ -0,0 +1,288 @@
+import pickle
+import multiprocessing as mp
+from itertools import count
+
+import numpy as np
+import ujson
+
+from .threesixty import ThreeSixtyEngine
+
+
+def parseRange(task):
+    # Parses some elements of the root array, in a worker process, into
+    # the unreduced rows and relations of the generic parser, or into the
+    # rows of the three-sixty engine.
+    from .parser import Parser
+
+    config, data, firstRowId, isThreeSixty = task
+    parser = Parser({'config': config})
+    if isThreeSixty:
+        doc = ujson.loads(data)
+        engine = ThreeSixtyEngine(parser)
+        if not engine.load(doc):
+            return None
+        firstKey = next(iter(doc[0]))
+        lastKeys = set([key for key, val in doc[-1].items() if engine.isScalar(val)])
+        return {
+            'tableMap': parser['tableMap'],
+            'rowMap': parser['rowMap'],
+            'indexed': {},
+            'naturalIds': {},
+            'scanned': engine.scanned,
+            'firstKey': firstKey,
+            'lastKeys': lastKeys,
+        }
+
+    parser._rowIds = count(firstRowId)
+    parser.parse(data)
+
+    # Root rows are added to the row map in the order of their elements.
+    rootTable = parser['tableMap'].get(config['rootTableName'])
+    rootRows = set([]) if rootTable is None else rootTable['rows']
+    rowMap = parser['rowMap']
+    firstRow = next((rowMap[rowId] for rowId in rowMap if rowId in rootRows), None)
+    lastRow = next((rowMap[rowId] for rowId in reversed(rowMap) if rowId in rootRows), None)
+    return {
+        'tableMap': parser['tableMap'],
+        'rowMap': rowMap,
+        'indexed': {
+            pair: list(indexees) for pair, indexees in parser['indexed'].items()
+        },
+        'naturalIds': parser._naturalIds,
+        'scanned': None,
+        'firstKey': None if firstRow is None else next(iter(firstRow)),
+        'lastKeys': None if lastRow is None else set(lastRow.keys()),
+    }
+
+
+class ParallelEngine:
+
+    # Splits a top level array into ranges of whole elements, found from
+    # the brackets outside of strings, and parses the ranges in a pool of
+    # worker processes. The partial tables, rows and relations are joined
+    # in element order and reduced as one, so the result is the one of a
+    # sequential parse. Whenever that cannot be guaranteed, e.g. for other
+    # documents, load returns False and the parser carries on by itself.
+    encodings = (None, 'utf-8', 'utf8', 'ascii')
+    blockSize = 16 * 1024 * 1024
+    minRangeSize = 256 * 1024
+    rangesPerWorker = 4
+    # Row ids of each range start at a multiple of rangeIdStep, so they do
+    # not clash.
+    rangeIdStep = 2 ** 40
+    separators = b' \t\r\n,'
+
+    def __init__(self, parser):
+        self.parser = parser
+        self.configee = parser.configee
+        self.workers = self.configee['workers']
+
+    def isSupported(self):
+        # Worker processes cannot be started from a pool worker, which is
+        # where the runner parses when it imports several files at once.
+        return self.workers > 1 \
+            and self.configee['input'] == 'json' \
+            and self.configee['sink'] is None \
+            and self.configee['rowStore'] == 'memory' \
+            and self.configee['encoding'] in self.encodings \
+            and not mp.current_process().daemon
+
+    def read(self, file):
+        if isinstance(file, str):
+            return file.encode('utf-8')
+        if isinstance(file, bytes):
+            return file
+        if hasattr(file, 'read'):
+            if hasattr(file, 'name'):
+                self.configee['fileName'] = file.name
+            data = file.read()
+        else:
+            chunks = list(file)
+            data = ''.join(chunks) if len(chunks) > 0 and isinstance(chunks[0], str) \
+                else b''.join(chunks)
+        return data.encode('utf-8') if isinstance(data, str) else data
+
+    def findUnescapedQuotes(self, arr, quotes):
+        # A quote is escaped by an odd number of backslashes before it,
+        # which only the few quotes after a backslash are checked for.
+        candidates = quotes[arr[np.maximum(quotes - 1, 0)] == 92]
+        escaped = []
+        for pos in candidates.tolist():
+            i = pos - 1
+            while i >= 0 and arr[i] == 92:
+                i -= 1
+            if (pos - 1 - i) % 2 == 1:
+                escaped.append(pos)
+        if len(escaped) == 0:
+            return quotes
+        return np.setdiff1d(quotes, escaped, assume_unique=True)
+
+    def findElements(self, data):
+        # Returns the start and end offsets of the elements of the root
+        # array, or None if the document is not an array of objects and
+        # arrays.
+        arr = np.frombuffer(data, dtype=np.uint8)
+        rootStart = len(data) - len(data.lstrip(b'\xef\xbb\xbf \t\r\n'))
+        if rootStart >= len(arr) or arr[rootStart] != ord('['):
+            return None
+
+        starts = []
+        ends = []
+        rootEnds = []
+        depth = 0
+        inString = 0
+        for blockStart in range(0, len(arr), self.blockSize):
+            block = arr[blockStart:blockStart + self.blockSize]
+            quotes = self.findUnescapedQuotes(arr, np.flatnonzero(block == 34) + blockStart)
+            toggles = np.zeros(len(block), dtype=np.int32)
+            toggles[quotes - blockStart] = 1
+            isOutside = (np.cumsum(toggles) + inString) % 2 == 0
+            isOpen = ((block == 91) | (block == 123)) & isOutside
+            isClose = ((block == 93) | (block == 125)) & isOutside
+            depths = depth + np.cumsum(isOpen.astype(np.int32) - isClose)
+            if len(depths) > 0 and depths.min() < 0:
+                return None
+            starts.extend((np.flatnonzero(isOpen & (depths == 2)) + blockStart).tolist())
+            ends.extend((np.flatnonzero(isClose & (depths == 1)) + blockStart + 1).tolist())
+            rootEnds.extend((np.flatnonzero(isClose & (depths == 0)) + blockStart).tolist())
+            depth = int(depths[-1])
+            inString = int(not isOutside[-1])
+
+        if len(rootEnds) != 1 or len(starts) == 0 or len(starts) != len(ends) \
+           or len(data[rootEnds[0] + 1:].strip()) > 0:
+            return None
+        # Anything but separators between the elements is a scalar element.
+        gaps = zip([rootStart + 1] + ends, starts + rootEnds)
+        if any(len(data[start:end].strip(self.separators)) > 0 for start, end in gaps):
+            return None
+        return list(zip(starts, ends))
+
+    def splitRanges(self, elements, size):
+        rangeCount = min(self.workers * self.rangesPerWorker, size // self.minRangeSize)
+        if rangeCount < 2:
+            return None
+        rangeSize = size / rangeCount
+        ranges = []
+        first = 0
+        for i, (start, end) in enumerate(elements):
+            if end - elements[first][0] >= rangeSize or i == len(elements) - 1:
+                ranges.append((elements[first][0], end))
+                first = i + 1
+        return ranges if len(ranges) > 1 else None
+
+    def isRowPerElement(self, results):
+        # The generic parser starts a new row when a key repeats in the
+        # last one, so the first row of a range has to open with a key of
+        # the last row before it, just like within a range.
+        rowIdName = self.configee.getRowIdName()
+        lastKeys = None
+        for res in results:
+            if res['firstKey'] is None:
+                continue
+            if not lastKeys is None and (
+                    res['firstKey'] == rowIdName or not res['firstKey'] in lastKeys):
+                return False
+            lastKeys = res['lastKeys']
+        return True
+
+    def join(self, results):
+        parser = self.parser
+        parser['tableMap'] = {}
+        rowMap = parser['rowMap'] = parser.createRowMap()
+        relations = {}
+        for res in results:
+            for tableName, table in res['tableMap'].items():
+                joined = parser.getTable(tableName)
+                joined['rows'].update(table['rows'])
+                joined['columns'].update(table['columns'])
+                joined['children'].update(table['children'])
+                if not table['parent'] is None:
+                    joined['parent'] = table['parent']
+            # Reference rows are stored once, by the first range.
+            for rowId in res['naturalIds']:
+                if rowId in rowMap:
+                    del res['rowMap'][rowId]
+            rowMap.update(res['rowMap'])
+            parser._naturalIds.update(res['naturalIds'])
+            for pair, pairRelations in res['indexed'].items():
+                relations.setdefault(pair, []).extend(pairRelations)
+        parser['indexed'] = {
+            pair: parser.createIndexees(pair, pairRelations)
+            for pair, pairRelations in relations.items()
+        }
+
+    def joinReduced(self, results):
+        # The three-sixty engine gives final rows, where the first of equal
+        # ids wins.
+        parser = self.parser
+        rowMap = parser.createRowMap()
+        columns = set([])
+        for res in results:
+            for rowId, row in res['rowMap'].items():
+                if not rowId in rowMap:
+                    rowMap[rowId] = row
+            for table in res['tableMap'].values():
+                columns.update(table['columns'])
+        tableName = self.configee['rootTableName']
+        parser['tableMap'] = {
+            tableName: {
+                'name': tableName,
+                'rows': set(rowMap.keys()),
+                'columns': columns,
+                'parent': None,
+                'children': set([]),
+            }
+        }
+        parser['rowMap'] = rowMap
+        parser['indexed'] = {}
+
+    def createTasks(self, data, ranges, isThreeSixty):
+        config = {
+            **self.parser['config'],
+            'workers': 1,
+            'schemaPlanDir': None,
+            'storage': 'dict',
+            'reduce': None,
+            'fileName': self.configee['fileName'],
+        }
+        try:
+            pickle.dumps(config)
+        except (pickle.PicklingError, AttributeError, TypeError):
+            return None
+        return [
+            (config, b''.join([b'[', data[start:end], b']']),
+             (i + 1) * self.rangeIdStep + 1, isThreeSixty)
+            for i, (start, end) in enumerate(ranges)
+        ]
+
+    def load(self, data):
+        elements = self.findElements(data)
+        if elements is None:
+            return False
+        ranges = self.splitRanges(elements, len(data))
+        if ranges is None:
+            return False
+        isThreeSixty = self.parser.isThreeSixty()
+        tasks = self.createTasks(data, ranges, isThreeSixty)
+        if tasks is None:
+            return False
+
+        with mp.Pool(processes=min(self.workers, len(tasks))) as pool:
+            results = pool.map(parseRange, tasks)
+
+        if any(res is None for res in results) or not self.isRowPerElement(results):
+            return False
+        if isThreeSixty:
+            # Packed columns and hashes depend on the child tables and
+            # flags of the whole file.
+            if any(res['scanned'] != results[0]['scanned'] for res in results):
+                return False
+            self.joinReduced(results)
+            self.parser.reduce(isReduced=True)
+            return True
+
+        self.join(results)
+        self.parser._rowIds = count((len(tasks) + 1) * self.rangeIdStep + 1)
+        self.parser._childTableNames = {}
+        self.parser.reduce()
+        return True
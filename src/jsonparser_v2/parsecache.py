@@ -0,0 +1,259 @@
+import os
+import mmap
+import struct
+import logging
+import tempfile
+import ujson
+import xxhash
+
+import numpy as np
+
+from .parser import parserVersion
+from .columnar import ColumnarColumn
+from .columnar import ColumnarTable
+from .columnar import ColumnarRowMap
+from .columnar import ColumnarIndexees
+
+logger0 = logging.getLogger('ParseCache')
+
+
+class ArrayWriter:
+
+    alignment = 8
+
+    def __init__(self):
+        self.arrays = []
+        self.size = 0
+
+    def add(self, array):
+        if array is None:
+            return None
+        if array.dtype == object:
+            raise ValueError('Cannot cache arrays of Python objects.')
+        array = np.ascontiguousarray(array)
+        ref = {
+            'dtype': array.dtype.str,
+            'offset': self.size,
+            'length': len(array),
+        }
+        self.arrays.append(array)
+        self.size += self.pad(array.nbytes)
+        return ref
+
+    def pad(self, size):
+        return size + (-size) % self.alignment
+
+    def write(self, f):
+        for array in self.arrays:
+            f.write(array.tobytes())
+            f.write(b'\0' * ((-array.nbytes) % self.alignment))
+
+
+class ParseCache:
+
+    # File layout: a fixed preamble (magic, format version, header length),
+    # a JSON header describing tables and columns and then the raw,
+    # 8 byte aligned numpy arrays, which are mapped back without copying.
+    magic = b'P4PC'
+    formatVersion = 1
+    preamble = struct.Struct('<4sIQ')
+    suffix = '.parsed'
+
+    def __init__(self, dirPath, maxBytes=1024 * 1024 * 1024, logger=logger0):
+        self.dirPath = dirPath
+        self.maxBytes = maxBytes
+        self.logger = logger
+        os.makedirs(dirPath, exist_ok=True)
+
+    def getKey(self, rootTableName, crc, size, options={}):
+        # Options are the Config values that change the parse output.
+        key = '{}-{:08x}-{}-{}.{}'.format(
+            rootTableName, crc, size, parserVersion, self.formatVersion)
+        if len(options) > 0:
+            key += '-{}'.format(xxhash.xxh64(
+                ujson.dumps(options, sort_keys=True)).hexdigest())
+        return key
+
+    def getPath(self, key):
+        return os.path.join(self.dirPath, key + self.suffix)
+
+    def dumpIds(self, ids, writer):
+        # Natural ids, e.g. strings, are kept as a list in the header.
+        if ids.dtype == object:
+            return {'values': ids.tolist()}
+        return writer.add(ids)
+
+    def dumpColumn(self, column, writer):
+        return {
+            'kind': column.kind,
+            'array': writer.add(column.array),
+            'mask': writer.add(column.mask),
+            'dictionary': column.dictionary,
+        }
+
+    def dump(self, parser):
+        configee = parser.configee
+        writer = ArrayWriter()
+
+        tableNames = []
+        tables = []
+        for name, table in parser['tableMap'].items():
+            rows = table['rows']
+            if not isinstance(rows, ColumnarTable):
+                rows = ColumnarTable(rows, parser['rowMap'], idColumns=(
+                    configee.getRowIdName(),
+                    configee.getRowHashName(name),
+                ))
+            tableNames.append(name)
+            tables.append(rows)
+
+        rowMap = parser['rowMap']
+        if not isinstance(rowMap, ColumnarRowMap):
+            rowMap = ColumnarRowMap(tables)
+
+        header = {
+            'tables': [
+                {
+                    'name': name,
+                    'columns': list(parser['tableMap'][name]['columns']),
+                    'parent': parser['tableMap'][name]['parent'],
+                    'children': list(parser['tableMap'][name]['children']),
+                    'ids': self.dumpIds(rows.ids, writer),
+                    'idColumns': rows.idColumns,
+                    'data': {
+                        columnName: self.dumpColumn(column, writer)
+                        for columnName, column in rows.columns.items()
+                    },
+                } for name, rows in zip(tableNames, tables)
+            ],
+            'rowMap': {
+                'ids': self.dumpIds(rowMap.ids, writer),
+                'tableIxs': writer.add(rowMap.tableIxs),
+                'positions': writer.add(rowMap.positions),
+            },
+            'indexed': [],
+        }
+        for parentChildPair, indexees in parser['indexed'].items():
+            if not isinstance(indexees, ColumnarIndexees):
+                indexees = ColumnarIndexees(parentChildPair, indexees)
+            header['indexed'].append({
+                'pair': list(parentChildPair),
+                'parentIds': self.dumpIds(indexees.parentIds, writer),
+                'childIds': self.dumpIds(indexees.childIds, writer),
+            })
+        return ujson.dumps(header).encode('utf-8'), writer
+
+    def store(self, key, parser):
+        try:
+            header, writer = self.dump(parser)
+        except (ValueError, OverflowError, TypeError) as e:
+            self.logger.info('Not caching %s: %s', key, e)
+            return False
+
+        # Written next to the target and moved into place, so concurrent
+        # importers never map a partially written file.
+        fd, tmpPath = tempfile.mkstemp(dir=self.dirPath, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(self.preamble.pack(
+                    self.magic, self.formatVersion, len(header)))
+                f.write(header)
+                f.write(b'\0' * ((-f.tell()) % ArrayWriter.alignment))
+                writer.write(f)
+            os.replace(tmpPath, self.getPath(key))
+        except BaseException:
+            if os.path.exists(tmpPath):
+                os.remove(tmpPath)
+            raise
+
+        self.evict()
+        return True
+
+    def load(self, key, parser):
+        path = self.getPath(key)
+        try:
+            with open(path, 'rb') as f:
+                buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            os.utime(path)
+        except FileNotFoundError:
+            return False
+
+        try:
+            magic, formatVersion, headerLength = self.preamble.unpack_from(buffer)
+            if magic != self.magic or formatVersion != self.formatVersion:
+                raise ValueError('Unknown cache format.')
+            start = self.preamble.size
+            header = ujson.loads(buffer[start:start + headerLength])
+            dataOffset = ArrayWriter().pad(start + headerLength)
+
+            def read(ref):
+                if ref is None:
+                    return None
+                if 'values' in ref:
+                    return np.array(ref['values'], dtype=object)
+                return np.frombuffer(buffer, dtype=np.dtype(ref['dtype']), count=ref['length'],
+                                     offset=dataOffset + ref['offset'])
+
+            tableMap = {}
+            tables = []
+            for table in header['tables']:
+                rows = ColumnarTable.restore(read(table['ids']), {
+                    columnName: ColumnarColumn(column['kind'], read(column['array']),
+                                               mask=read(column['mask']),
+                                               dictionary=column['dictionary'])
+                    for columnName, column in table['data'].items()
+                }, table['idColumns'])
+                tables.append(rows)
+                tableMap[table['name']] = {
+                    'name': table['name'],
+                    'rows': rows,
+                    'columns': set(table['columns']),
+                    'parent': table['parent'],
+                    'children': set(table['children']),
+                }
+            rowMap = ColumnarRowMap.restore(tables, read(header['rowMap']['ids']),
+                                            read(header['rowMap']['tableIxs']),
+                                            read(header['rowMap']['positions']))
+            indexed = {
+                tuple(indexees['pair']): ColumnarIndexees.restore(
+                    indexees['pair'], read(indexees['parentIds']), read(indexees['childIds']))
+                for indexees in header['indexed']
+            }
+        except (ValueError, KeyError, TypeError, struct.error) as e:
+            self.logger.warning('Dropping unreadable cache entry %s: %s', key, e)
+            self.remove(path)
+            return False
+
+        parser['tableMap'] = tableMap
+        parser['rowMap'] = rowMap
+        parser['indexed'] = indexed
+        return True
+
+    def remove(self, path):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    def evict(self):
+        # Least recently used entries go first, load touches the files so
+        # their modification time is the time of last use.
+        entries = []
+        for name in os.listdir(self.dirPath):
+            if not name.endswith(self.suffix):
+                continue
+            path = os.path.join(self.dirPath, name)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+        entries.sort()
+
+        size = sum([entry[1] for entry in entries])
+        for _, entrySize, path in entries:
+            if size <= self.maxBytes:
+                break
+            self.remove(path)
+            size -= entrySize
+        return size
@@ -1,16 +1,32 @@
+import codecs
 import ujson
 import logging
-import jsonstreamer as jss
-import ramda as R
-from uuid import uuid4
+from itertools import count
+from collections.abc import Iterator
 
 from contrib.pyas.src.pyas_v3 import As
 from contrib.pyas.src.pyas_v3 import Leaf
 
 from .config import Config
+from .schemaplan import SchemaPlan
+from .columnar import ColumnarTable
+from .columnar import ColumnarRowMap
+from .columnar import ColumnarIndexees
+from .rowstore import SpillStore
+from .rowhash import RowEncoder
+from .threesixty import ThreeSixtyEngine
+from .parallel import ParallelEngine
+from .keypaths import KeyPathFilter
+from .keypaths import ElementFilter
+from .keypaths import ElementMatcher
+from .tokenizers import createTokenizer
 
 logger0 = logging.getLogger('Parser')
 
+# Bumped whenever the parse output for the same input changes, which
+# invalidates cached parse results.
+parserVersion = 1
+
 
 def groupsCreator(groups: dict):
 
@@ -53,9 +69,30 @@ class Indexees:
     def getIndexId(cls, parentChildPair):
         return (parentChildPair[0], parentChildPair[1])
 
-    def __init__(self, parentChildPair, rows):
-        self.models = rows
+    def __init__(self, parentChildPair, rows=None):
         self.parentChildPair = tuple(parentChildPair)
+        # Relations are keyed by identity, which gives O(1) removal while
+        # keeping insertion order. The same relations are also grouped per
+        # parent row id so a row's children are found without a scan.
+        self.models = {}
+        self.parentModels = {}
+        for row in rows or ():
+            self.add(row)
+
+    def __len__(self):
+        return len(self.models)
+
+    def __iter__(self):
+        return iter(self.models.values())
+
+    def add(self, relation):
+        parentId = relation[self.parentChildPair[0]]
+        key = id(relation)
+        self.models[key] = relation
+        if not parentId in self.parentModels:
+            self.parentModels[parentId] = {}
+        self.parentModels[parentId][key] = relation
+        return relation
 
     def index(self, parentChildeIdPair):
         parentChildPair = self.parentChildPair
@@ -63,9 +100,50 @@ class Indexees:
             self.parentChildPair[0]: parentChildeIdPair[0],
             self.parentChildPair[1]: parentChildeIdPair[1],
         }
-        self.models.append(relation)
+        self.add(relation)
         return parentChildPair
 
+    def remove(self, relation):
+        key = id(relation)
+        if not key in self.models:
+            raise IndexedError(
+                'Cannot unindex {}, since it is not indexed in {}.'
+                .format(str(relation), str(self.parentChildPair)))
+        del self.models[key]
+        parentId = relation[self.parentChildPair[0]]
+        parentModels = self.parentModels[parentId]
+        del parentModels[key]
+        if len(parentModels) == 0:
+            del self.parentModels[parentId]
+        return relation
+
+    def getChildIds(self, parentId):
+        if not parentId in self.parentModels:
+            return []
+        childName = self.parentChildPair[1]
+        return [
+            relation[childName]
+            for relation in self.parentModels[parentId].values()
+        ]
+
+
+class ParserState:
+
+    __slots__ = ('key', 'index', 'rows', 'columns',
+                 'isIndexd', 'isTable', 'isKey')
+
+    def __init__(self, key, index=None):
+        self.key = key
+        self.index = index
+        self.rows = None
+        self.columns = None
+        self.isIndexd = None
+        self.isTable = not key in (':array', ':object')
+        self.isKey = key[:1] != ':'
+
+    def __repr__(self):
+        return 'ParserState({})'.format(repr(self.key))
+
 
 class ParserMixin(Leaf):
 
@@ -81,14 +159,55 @@ class ParserMixin(Leaf):
                 'rowMap': {},
                 'indexed': {},
                 'stateStack': [],
+                'schemaPlan': None,
             },
             **self.row
         }
 
         self._configee = Config(self['config'])
-        self.jss = jss.JSONStreamer()  # same for JSONStreamer
+        self._spillStore = None
+        if self.configee['rowStore'] == 'spill':
+            self._spillStore = SpillStore(self.configee['rowStoreBudget'],
+                                          dirPath=self.configee['rowStoreDir'])
+            self['rowMap'] = self.createRowMap()
+        self._rowEncoder = None
+        if self.configee['rowEncoding'] == 'binary':
+            self._rowEncoder = RowEncoder(self.configee['binaryHasher'])
+        # Keys and short string values are shared through the pool of the
+        # process, so equal strings are stored once across all rows.
+        self._stringPool = self.configee['stringPool']
+        self.internString = (lambda val: val) if self._stringPool is None \
+            else self._stringPool.intern
+        self._referenceColumns = None if self.configee['referenceColumns'] is None \
+            else frozenset(self.configee['referenceColumns'])
+        # Row ids of rows that keep their natural ids instead of content
+        # hashes, mapped to the natural ids.
+        self._naturalIds = {}
+        self._keyPathFilter = KeyPathFilter.create(
+            self.configee['rootTableName'],
+            include=self.configee['includeKeyPaths'],
+            exclude=self.configee['excludeKeyPaths'])
+        self._elementFilter = ElementFilter.create(self.configee['elementFilter'])
+        self._matchElements = False
+        self._elementMatcher = None
+        # Stream events go to _divert instead, while it is set, e.g. to skip
+        # an excluded subtree or to hold back an element until the element
+        # filter decides on it.
+        self._divert = None
+        self._skipDepth = 0
+        self._childTableNames = {}
+        self._tablePairs = {}
+        # The schema plan of earlier parses of the same kind of file. Table
+        # pairs that it lacks are discovered and make the plan rewritten.
+        if not self.configee['schemaPlanDir'] is None:
+            self['schemaPlan'] = SchemaPlan.load(
+                self.configee['schemaPlanDir'], self.configee['rootTableName'])
+        self._rowIds = count(1)
+        self._tableStates = []
+        self._keyStates = []
         self.logger = self['logger']
-        self.jss.auto_listen(self)
+        self._debug = self.logger.isEnabledFor(logging.DEBUG)
+        self._sink = self.configee['sink']
 
     @property
     def configee(self):
@@ -96,7 +215,7 @@ class ParserMixin(Leaf):
 
     @property
     def keyStack(self):
-        return [s['key'] for s in self['stateStack']]
+        return [s.key for s in self['stateStack']]
 
     @property
     def currentState(self):
@@ -104,40 +223,39 @@ class ParserMixin(Leaf):
 
     @property
     def tableStates(self):
-        return [
-            self['stateStack'][i]
-            for i in range(0, len(self['stateStack']) - 1) \
-            # if 'rows' in self['stateStack'][i]
-            if not self['stateStack'][i]['key'] in [':array', ':object']
-        ]
+        return self._tableStates[:-1] \
+            if self['stateStack'][-1].isTable \
+            else list(self._tableStates)
 
     @property
     def tableStateKeys(self):
-        return [s['key'] for s in self.tableStates]
+        return [s.key for s in self.tableStates]
 
     @property
     def currentTableState(self):
-        return self.tableStates[-1]
+        # The table and key states are kept in their own stacks by pushState
+        # and popState, so the current ones are found without a scan.
+        return self._tableStates[-2] \
+            if self['stateStack'][-1].isTable \
+            else self._tableStates[-1]
 
     @property
     def keyStates(self):
-        return [
-            s for s in self['stateStack'] if s['key'][0] != ':'
-        ]
+        return list(self._keyStates)
 
     @property
     def keyStatesKeys(self):
         return [
-            s['key'] for s in self.keyStates
+            s.key for s in self._keyStates
         ]
 
     @property
     def currentKeyState(self):
-        return self.keyStates[-1]
+        return self._keyStates[-1]
 
     @property
     def currentColumn(self):
-        return self['stateStack'][-1]['key']
+        return self['stateStack'][-1].key
 
     def getUniqueRowCount(self, tableName, skipCols=None):
         table = self['tableMap'][tableName]
@@ -146,6 +264,17 @@ class ParserMixin(Leaf):
             uniqs.add(self.getRowHash(tableName, self['rowMap'][rowId]))
         return len(uniqs)
 
+    def getChildTableNames(self, tableName):
+        if tableName in self._childTableNames:
+            return self._childTableNames[tableName]
+        children = self['tableMap'][tableName]['children']
+        res = [
+            pair[1] for pair in self['indexed'].keys()
+            if pair[0] == tableName and pair[1] in children
+        ]
+        self._childTableNames[tableName] = res
+        return res
+
     def getRowHash(self, tableName, row, skipCols=None, skipTables=set([])):
         rowIdName = self.configee.getRowIdName()
         rowHashName = self.configee.getRowHashName(tableName)
@@ -159,45 +288,149 @@ class ParserMixin(Leaf):
         skipCols = (rowIdName, rowHashName) \
             if skipCols is None else skipCols
         rowId = row[rowIdName]
-        table = self['tableMap'][tableName]
 
-        sortedKeys = list(row.keys())
-        sortedKeys.sort()
-        hashBasis = [{key: row[key]
-                      for key in sortedKeys if key not in skipCols}]
-
-        indexeds = R.pipe(
-            R.to_pairs,
-            R.filter(
-                lambda pair: pair[0][0] == tableName and pair[0][1] in table['children']),
-            R.sort(lambda pairA, pairB: pairA[0][1] < pairB[0][1]),
-            R.from_pairs,
-        )(self['indexed'])
-        for parentChildPair, indexees in indexeds.items():
-            childName = parentChildPair[1]
+        # Children are looked up through the per parent groups of indexed,
+        # so each row is hashed once, bottom-up, from the cached hashes of
+        # its children.
+        childSums = []
+        for childName in self.getChildTableNames(tableName):
 
             sum = 0
-            for indexee in indexees:
-                if indexee[tableName] != rowId:
-                    continue
-                ch = self.getRowHash(childName, self['rowMap'][indexee[childName]],
+            indexees = self['indexed'][(tableName, childName)]
+            for childId in indexees.getChildIds(rowId):
+                ch = self.getRowHash(childName, self['rowMap'][childId],
                                      skipTables=skipTables.union([tableName]))
                 sum += ch
-            # print('sum', sum)
-            hashBasis.append({childName: str(sum)})
+            childSums.append((childName, sum))
 
-            # hashes = [
-            #    self.getRowHash(childName, self['rowMap'][indexee[childName]],
-            #                    skipTables=skipTables.union([tableName])) \
-            #    for indexee in indexees \
-            # ]
-            # hashBasis.append({childName: hashes})
+        rowHash = self.createRowHash(row, childSums, skipCols)
+        row[rowHashName] = rowHash
+        # Hashing the children may have moved this row out of a spilling
+        # row store, so the cached hash is written back.
+        self['rowMap'][rowId] = row
+        return rowHash
 
+    def createRowHash(self, row, childSums, skipCols=()):
+        # childSums are the sums of the child row hashes per child table.
+        if not self._rowEncoder is None:
+            return self._rowEncoder.hash(row, childSums, skipCols)
+        hashBasis = [{key: row[key] for key in sorted(row.keys()) if key not in skipCols}]
+        for childName, childSum in childSums:
+            hashBasis.append({childName: str(childSum)})
         rowHash = ujson.dumps(hashBasis)
-        rowHash = rowHash if self.configee['hasher'] is None else self.configee['hasher'](
+        return rowHash if self.configee['hasher'] is None else self.configee['hasher'](
             rowHash)
-        row[rowHashName] = rowHash
-        return rowHash
+
+    def getNaturalKey(self, tableName):
+        naturalKeys = self.configee['naturalKeys']
+        return None if naturalKeys is None else naturalKeys.get(tableName)
+
+    def isContentHashed(self, tableName):
+        # Rows of natural keys and references keep their ids when their
+        # contents change, so only other rows with equal ids are equal.
+        return self.getNaturalKey(tableName) is None and self._referenceColumns is None
+
+    def createNaturalRowHash(self, keyName, val):
+        return self.createRowHash({keyName: val}, ())
+
+    def hashNaturalKeys(self):
+        # Rows of tables with a natural key column are identified by it, so
+        # they are hashed from that column alone and keep it as row id.
+        naturalKeys = self.configee['naturalKeys']
+        if naturalKeys is None:
+            return
+        rowMap = self['rowMap']
+        for tableName, keyName in naturalKeys.items():
+            if not tableName in self['tableMap']:
+                continue
+            rowHashName = self.configee.getRowHashName(tableName)
+            for rowId in self['tableMap'][tableName]['rows']:
+                row = rowMap[rowId]
+                val = row.get(keyName)
+                if val is None or rowId in self._naturalIds:
+                    continue
+                row[rowHashName] = self.createNaturalRowHash(keyName, val)
+                rowMap[rowId] = row
+                self._naturalIds[rowId] = val
+
+    def createRowHashes(self, rows, childNames, childSums, skipCols=()):
+        # Batch version of createRowHash, with childSums holding the sums
+        # per child table in childNames for every row.
+        if not self._rowEncoder is None:
+            return self._rowEncoder.hashBatch(rows, childNames, childSums, skipCols)
+        return [
+            self.createRowHash(row, list(zip(childNames, sums)), skipCols)
+            for row, sums in zip(rows, childSums)
+        ]
+
+    def hashTable(self, tableName):
+        # Hashes all rows of a table in one batch. The child sums come from
+        # a single pass over the relations, so the child tables should be
+        # hashed before.
+        if not tableName in self['tableMap']:
+            return
+        rowIdName = self.configee.getRowIdName()
+        rowHashName = self.configee.getRowHashName(tableName)
+        rowMap = self['rowMap']
+        rowIds = [
+            rowId for rowId in self['tableMap'][tableName]['rows']
+            if not rowHashName in rowMap[rowId]
+        ]
+        if len(rowIds) < 1:
+            return
+
+        childNames = self.getChildTableNames(tableName)
+        childSums = []
+        for childName in childNames:
+            childHashName = self.configee.getRowHashName(childName)
+            sums = {}
+            for relation in self['indexed'][(tableName, childName)]:
+                childRow = rowMap[relation[childName]]
+                childHash = childRow[childHashName] if childHashName in childRow \
+                    else self.getRowHash(childName, childRow, skipTables=set([tableName]))
+                parentId = relation[tableName]
+                sums[parentId] = sums.get(parentId, 0) + childHash
+            childSums.append(sums)
+
+        rowHashes = self.createRowHashes(
+            [rowMap[rowId] for rowId in rowIds], childNames,
+            [[sums.get(rowId, 0) for sums in childSums] for rowId in rowIds],
+            (rowIdName, rowHashName))
+        for rowId, rowHash in zip(rowIds, rowHashes):
+            row = rowMap[rowId]
+            row[rowHashName] = rowHash
+            rowMap[rowId] = row
+
+    def hashTables(self):
+        hashed = set([])
+
+        def visit(tableName, path):
+            if tableName in hashed or tableName in path:
+                return
+            for childName in self.getChildTableNames(tableName):
+                visit(childName, path | set([tableName]))
+            self.hashTable(tableName)
+            hashed.add(tableName)
+
+        for tableName in list(self['tableMap'].keys()):
+            visit(tableName, set([]))
+
+    def createRowMap(self):
+        # Beyond the budget, a spill store keeps rows and relations in a
+        # local SQLite file.
+        if self._spillStore is None:
+            return {}
+        return self._spillStore.createRowMap()
+
+    def createIndexees(self, parentChildPair, rows=None):
+        if self._spillStore is None:
+            return Indexees(parentChildPair, rows)
+        return self._spillStore.createIndexees(parentChildPair, rows)
+
+    def createRowId(self):
+        # Rows are keyed by dense integers until reduceRows replaces them
+        # with their content hashes.
+        return next(self._rowIds)
 
     def getTable(self, tableName):
         if not tableName in self['tableMap']:
@@ -211,40 +444,43 @@ class ParserMixin(Leaf):
         return self['tableMap'][tableName]
 
     def startRow(self, state, key, isIndexd):
-        state['rows'] = state['rows'] if 'rows' in state else []
-        state['columns'] = state['columns'] if 'columns' in state else set([])
-        state['isIndexd'] = state['isIndexd'] if 'isIndexd' in state else isIndexd
-        assert state['isIndexd'] == isIndexd
+        if state.rows is None:
+            state.rows = []
+            state.columns = set([])
+            state.isIndexd = isIndexd
+        assert state.isIndexd == isIndexd
 
-        if len(state['rows']) < 1 \
-           or (key is not None and key in state['rows'][-1]):
-            state['rows'].append({})
+        rows = state.rows
+        if len(rows) < 1 \
+           or (key is not None and key in rows[-1]):
+            rows.append({})
 
-        return len('rows') - 1
+        return len(rows) - 1
 
     def addValue(self, val, isIndexd):
-        assert self.currentKeyState == self.currentState
-        key = self.currentKeyState['key']
-        state = self.currentTableState
-        self.startRow(self.currentTableState, key, isIndexd)
-        assert 'rows' in state
-        # if len(state['rows']) < 1:
-        #    state['rows'].append({})
-        row = state['rows'][-1]
+        state = self['stateStack'][-1]
+        assert self._keyStates[-1] is state
+        key = state.key
+        tableState = self.currentTableState
+        self.startRow(tableState, key, isIndexd)
+        row = tableState.rows[-1]
         assert key not in row
-        row[key] = val
-        state['columns'] = state['columns'].union(set([key]))
+        row[key] = self.internString(val) if type(val) is str else val
+        tableState.columns.add(key)
 
-    def pushState(self, p):
-        return self['stateStack'].append(p)
+    def pushState(self, state):
+        if state.isTable:
+            self._tableStates.append(state)
+        if state.isKey:
+            self._keyStates.append(state)
+        return self['stateStack'].append(state)
 
     def index(self, parentChildPair, rowIdPair):
         key = Indexees.getIndexId(parentChildPair)
-        self['indexed'][key] = self['indexed'][key] \
-            if key in self['indexed'] \
-            else []
-        indexees = Indexees(key, self['indexed'][key])
-        return indexees.index(rowIdPair)
+        if not key in self['indexed']:
+            self['indexed'][key] = self.createIndexees(key)
+            self._childTableNames.pop(key[0], None)
+        return self['indexed'][key].index(rowIdPair)
 
     def unindex(self, parentChildPair, indexee):
         if not parentChildPair in self['indexed']:
@@ -256,43 +492,57 @@ class ParserMixin(Leaf):
         return self['indexed'][parentChildPair].remove(indexee)
 
     def unindexAll(self, key):
+        self._childTableNames.pop(key[0], None)
         return self['indexed'].pop(key)
 
+    def getTablePair(self, parentTableName, tableName):
+        # Table and parent table lookups are cached per parent/child pair,
+        # so rows of known tables skip the table discovery.
+        key = (parentTableName, tableName)
+        if key in self._tablePairs:
+            return self._tablePairs[key]
+        table = self.getTable(tableName)
+        parentTable = self.getTable(parentTableName)
+        children = parentTable['children']
+        if not tableName in children:
+            self._childTableNames.pop(parentTableName, None)
+        children.add(tableName)
+        self._tablePairs[key] = (table, parentTable)
+        return self._tablePairs[key]
+
     def appendRows(self, state):
 
+        colName = self.configee.getRowIdName()
+
         def ensureId(row, table):
-            colName = self.configee.getRowIdName()
             id = row[colName] \
-                if colName in row else str(uuid4())
+                if colName in row else self.createRowId()
             row[colName] = id
             table['columns'].add(colName)
             return id, colName
 
-        if not 'rows' in state:
+        if state.rows is None:
             return
 
-        tableName = state['key']
-        table = self.getTable(tableName)
+        tableName = state.key
 
         hasParent = tableName != self.configee['rootTableName']
         if hasParent:
             parentTableState = self.currentTableState
-            parentTableName = parentTableState['key']
+            parentTableName = parentTableState.key
+            table, parentTable = self.getTablePair(parentTableName, tableName)
             table['parent'] = parentTableName
-            parentTable = self.getTable(parentTableName)
-            children = parentTable['children']
-            children.add(tableName)
-            parentTable['children'] = children
-        for row in state['rows']:
+        else:
+            table = self.getTable(tableName)
+        for row in state.rows:
             if len(row) == 0:
                 continue
 
             id, idCol = ensureId(row, table)
 
             if hasParent:
-                parentIdColumn = self.configee.getRowIdName(parentTableName)
                 self.startRow(parentTableState, None, False)
-                parentRow = parentTableState['rows'][-1]
+                parentRow = parentTableState.rows[-1]
                 parentId, _ = ensureId(parentRow, parentTable)
                 self.index([parentTableName, tableName],
                            [parentId, id]
@@ -301,102 +551,451 @@ class ParserMixin(Leaf):
             self['rowMap'][id] = row
             table['rows'].add(id)
 
-        table['columns'] = set(table['columns']).union(set(state['columns']))
+        table['columns'].update(state.columns)
 
-    def popState(self):
+    def popState(self, append=True):
 
-        # tableName = '_'.join([s['key'] for s in self.tableStates])
+        # tableName = '_'.join([s.key for s in self.tableStates])
         state = self['stateStack'].pop()
-        self.appendRows(state)
+        if state.isTable:
+            self._tableStates.pop()
+        if state.isKey:
+            self._keyStates.pop()
+        if append:
+            self.appendRows(state)
 
         return state
 
     def _on_doc_start(self, *args):
-        self.pushState({
-            'key': self.configee['rootTableName'],
-        })
-        self.logger.debug('_doc_start' + str(self.keyStack))
+        self.pushState(ParserState(self.configee['rootTableName']))
+        if self._debug:
+            self.logger.debug('_doc_start' + str(self.keyStack))
 
     def _on_doc_end(self, *args):
         assert len(self['stateStack']) == 1
-        self.appendRows(self['stateStack'].pop())
-        self.logger.debug('_doc_end' + str(self.keyStack))
+        self.popState()
+        if self._debug:
+            self.logger.debug('_doc_end' + str(self.keyStack))
+
+    def getKeyPath(self, key):
+        return tuple([state.key for state in self._keyStates]) + (key,)
+
+    def keepKey(self, key):
+        return self._keyPathFilter is None \
+            or self._keyPathFilter.keep(self.getKeyPath(key))
+
+    def startSkipping(self, depth):
+        self._skipDepth = depth
+        self._divert = self.skipEvent
+
+    def skipEvent(self, event, *args):
+        # A skipped subtree ends with its value or with the end of the
+        # container it opened.
+        if event in ('object_start', 'array_start'):
+            self._skipDepth += 1
+        elif event in ('object_end', 'array_end'):
+            self._skipDepth -= 1
+        if self._skipDepth == 0 and event != 'key':
+            self._divert = None
+
+    def isTopLevelElement(self):
+        stateStack = self['stateStack']
+        return len(stateStack) == 2 and stateStack[-1].key == ':array'
+
+    def matchEvent(self, event, *args):
+        matcher = self._elementMatcher
+        keep = matcher.add(event, *args)
+        if keep is None:
+            return
+        self._elementMatcher = None
+        self._divert = None
+        if keep:
+            self._matchElements = False
+            for event, args in matcher.events:
+                getattr(self, '_on_' + event)(*args)
+            self._matchElements = True
+        elif matcher.depth > 0:
+            self.startSkipping(matcher.depth)
 
     def _on_key(self, key, *args):
-        self.pushState({'key': key})
-        self.logger.debug('_on_key' + str(self.keyStack))
+        if self._divert is not None:
+            return self._divert('key', key)
+        if not self.keepKey(key):
+            self.startSkipping(0)
+            return
+        self.pushState(ParserState(self.internString(key)))
+        if self._debug:
+            self.logger.debug('_on_key' + str(self.keyStack))
 
     def _on_value(self, val, *args):
+        if self._divert is not None:
+            return self._divert('value', val)
         # print('_on_value', val, *args)
         self.addValue(val, False)
         self.popState()
-        self.logger.debug('_on_value ' + str(val) + str(self.keyStack))
+        if self._debug:
+            self.logger.debug('_on_value ' + str(val) + str(self.keyStack))
 
     def _on_element(self, val, *args):
+        if self._divert is not None:
+            return self._divert('element', val)
         # print('_on_element', val, *args)
 
         state = self['stateStack'][-1]
 
-        self.pushState(
-            {'key': self.configee.getRowValueName(self.keyStatesKeys[-1])})
+        self.pushState(ParserState(
+            self.configee.getRowValueName(self._keyStates[-1].key)))
         self.addValue(val, True)
         self.popState()
 
-        state['index'] = state['index'] + 1
-        self.logger.debug('_on_element ' + str(val) + str(self.keyStack))
+        state.index = state.index + 1
+        if self._sink is not None:
+            self.emitElement()
+        if self._debug:
+            self.logger.debug('_on_element ' + str(val) + str(self.keyStack))
 
     def _on_array_start(self, *args):
+        if self._divert is not None:
+            return self._divert('array_start')
         # print('_on_array_start', args)
-        self.pushState({
-            'key': ':array',
-            'index': 0,
-        })
-        self.logger.debug('_on_array_start' + str(self.keyStack))
+        self.pushState(ParserState(':array', index=0))
+        if self._debug:
+            self.logger.debug('_on_array_start' + str(self.keyStack))
 
     def _on_array_end(self, *args):
+        if self._divert is not None:
+            return self._divert('array_end')
         # print('_on_array_end', args)
-        self.popState()
-        self.closeArrayOrObject()
-        self.logger.debug('_on_array_end' + str(self.keyStack))
+        arrayState = self.popState()
+        if not self.flattenArray(arrayState):
+            self.closeArrayOrObject()
+        if self._sink is not None:
+            self.emitElement()
+        if self._debug:
+            self.logger.debug('_on_array_end' + str(self.keyStack))
 
     def _on_object_start(self, *args):
-        self.pushState({
-            'key': ':object',
-        })
-        self.logger.debug('_on_object_start' + str(self.keyStack))
+        if self._divert is not None:
+            return self._divert('object_start')
+        if self._matchElements and self.isTopLevelElement():
+            # Nothing of the element reaches the states before it is kept.
+            self._elementMatcher = ElementMatcher(self._elementFilter)
+            self._divert = self.matchEvent
+            return self._divert('object_start')
+        self.pushState(ParserState(':object'))
+        if self._debug:
+            self.logger.debug('_on_object_start' + str(self.keyStack))
 
     def _on_object_end(self, *args):
+        if self._divert is not None:
+            return self._divert('object_end')
         self.popState()
+        if self._referenceColumns is not None:
+            self.extractReference()
         self.closeArrayOrObject()
-        self.logger.debug('_on_object_end' + str(self.keyStack))
+        if self._sink is not None:
+            self.emitElement()
+        if self._debug:
+            self.logger.debug('_on_object_end' + str(self.keyStack))
+
+    def extractReference(self):
+        # An object under a key with only reference columns, like {id, name},
+        # is stored once per natural id in its own table, and the parent row
+        # gets its row id as a foreign key column instead of a relation. Row
+        # ids are qualified by the parent table and key, since e.g. event
+        # types and duel types share both the table and their ids.
+        stateStack = self['stateStack']
+        state = stateStack[-1]
+        if len(stateStack) < 2 or not state.isKey \
+           or state.rows is None or len(state.rows) != 1:
+            return False
+        row = state.rows[0]
+        rowIdName = self.configee.getRowIdName()
+        idName = self.configee['referenceIdName']
+        if not idName in row or rowIdName in row \
+           or not self._referenceColumns.issuperset(row):
+            return False
+
+        tableName = state.key
+        parentTableState = self._tableStates[-2]
+        rowId = '{}.{}:{}'.format(parentTableState.key, tableName, row[idName])
+        rowMap = self['rowMap']
+        if not rowId in self._naturalIds:
+            row[rowIdName] = rowId
+            rowMap[rowId] = row
+            table = self.getTable(tableName)
+            table['rows'].add(rowId)
+            table['columns'].update(row)
+            self._naturalIds[rowId] = rowId
+        elif self._debug and any(
+                rowMap[rowId].get(key) != val for key, val in row.items()):
+            self.logger.debug('Reference %s is also %s.', rowId, row)
+
+        foreignKey = self.configee.getRowIdName(tableName)
+        self.startRow(parentTableState, foreignKey, False)
+        parentTableState.rows[-1][foreignKey] = rowId
+        parentTableState.columns.add(foreignKey)
+        state.rows = None
+        return True
+
+    def emitElement(self):
+        # In streaming mode each element of a top level array is reduced and
+        # handed to the sink as soon as it is complete, after which its rows
+        # are released.
+        stateStack = self['stateStack']
+        if len(stateStack) != 2 or stateStack[-1].key != ':array':
+            return
+        rootState = stateStack[0]
+        if rootState.rows is None:
+            return
+        self.appendRows(rootState)
+        rootState.rows = None
+        rootState.columns = None
+        rootState.isIndexd = None
+        self.emit()
+
+    def emit(self):
+        self._tablePairs = {}
+        self.reduceTables(isStreamed=True)
+        self.reduceRows()
+        self._sink(self)
+        if not self._spillStore is None:
+            self['rowMap'].drop()
+            for indexees in self['indexed'].values():
+                indexees.drop()
+        self['tableMap'] = {}
+        self['rowMap'] = self.createRowMap()
+        self['indexed'] = {}
+        self._childTableNames = {}
+
+    def flattenArray(self, arrayState):
+        # Short arrays of numbers under a key, like a location, are stored
+        # as key_0, key_1, ... columns of the parent row instead of as a
+        # child table. Nested containers add rows without counting as
+        # elements, so arrays that hold any are left alone.
+        maxLength = self.configee['flattenArrayLength']
+        if maxLength < 1:
+            return False
+        stateStack = self['stateStack']
+        state = stateStack[-1]
+        if len(stateStack) < 2 or not state.isKey or state.rows is None:
+            return False
+        rows = state.rows
+        if len(rows) != arrayState.index or len(rows) > maxLength:
+            return False
+        valueName = self.configee.getRowValueName(state.key)
+        for row in rows:
+            if len(row) != 1 or not type(row.get(valueName)) in (int, float):
+                return False
+
+        self.popState(append=False)
+        tableState = self.currentTableState
+        for i, row in enumerate(rows):
+            key = self.internString('{}_{}'.format(state.key, i))
+            self.startRow(tableState, key, False)
+            tableState.rows[-1][key] = row[valueName]
+            tableState.columns.add(key)
+        return True
 
     def closeArrayOrObject(self):
-        if len(self['stateStack']) > 1 and self.currentState['key'] not in [':array', ':object']:
+        if len(self['stateStack']) > 1 and self['stateStack'][-1].isTable:
             self.popState()
 
-    def parse(self, file):
+    def readChunks(self, file):
+
+        def chunks(f):
+            if hasattr(f, 'read'):
+                if hasattr(f, 'name'):
+                    self.configee['fileName'] = f.name
+                bufferSize = self.configee['bufferSize']
+                while True:
+                    chunk = f.read(bufferSize)
+                    if len(chunk) < 1:
+                        return
+                    yield chunk
+            else:
+                yield from f
+
+        if isinstance(file, (str, bytes)):
+            file = [file]
+
+        # Bytes are decoded incrementally so a multi byte character split
+        # between two chunks is kept intact.
+        decoder = codecs.getincrementaldecoder(
+            self.configee['encoding'] or 'utf-8')()
+        for chunk in chunks(file):
+            yield chunk if isinstance(chunk, str) else decoder.decode(chunk)
+        tail = decoder.decode(b'', final=True)
+        if len(tail) > 0:
+            yield tail
+
+    def readDocument(self, file):
+        # The tree engines need the whole document, so files are read at
+        # once instead of being joined from chunks, which would hold the
+        # text twice. UTF-8 bytes are parsed without decoding them first.
+        if hasattr(file, 'read'):
+            if hasattr(file, 'name'):
+                self.configee['fileName'] = file.name
+            file = file.read()
+        elif not isinstance(file, (str, bytes)):
+            return ujson.loads(''.join(self.readChunks(file)))
+        encoding = codecs.lookup(self.configee['encoding'] or 'utf-8').name
+        if isinstance(file, bytes) and encoding != 'utf-8':
+            file = file.decode(encoding)
+        return ujson.loads(file)
+
+    def readLines(self, file):
+        # Each line of newline delimited JSON is parsed on its own, as an
+        # element of the root array, while the file is read lazily.
+        def lines():
+            parts = []
+            for chunk in self.readChunks(file):
+                chunkLines = chunk.split('\n')
+                if len(chunkLines) > 1:
+                    yield ''.join(parts + chunkLines[:1])
+                    yield from chunkLines[1:-1]
+                    parts = []
+                parts.append(chunkLines[-1])
+            yield ''.join(parts)
+
+        for line in lines():
+            if len(line.strip()) > 0:
+                yield ujson.loads(line)
 
-        def read(f):
-            self.configee['fileName'] = f.name
-            if self.configee['encoding']:
-                return f.read().decode(self.configee['encoding'])
+    @classmethod
+    def treeValue(cls, val):
+        # jsonstreamer only keeps digit strings as int, so negative integers
+        # arrive as floats on the stream engine.
+        if type(val) is int and val < 0:
+            return float(val)
+        return val
+
+    def walk(self, doc):
+
+        def enter(node):
+            if isinstance(node, dict):
+                self._on_object_start()
+                stack.append((True, iter(node.items())))
+            else:
+                self._on_array_start()
+                stack.append((False, iter(node)))
+
+        # An iterator, e.g. of lines, is walked as an array.
+        if not isinstance(doc, (dict, list, Iterator)):
+            raise ValueError(
+                'Cannot parse a document of type {}.'.format(type(doc).__name__))
+
+        self._on_doc_start()
+        end = object()
+        stack = []
+        enter(doc)
+        while len(stack) > 0:
+            isObject, items = stack[-1]
+            item = next(items, end)
+            if item is end:
+                stack.pop()
+                if isObject:
+                    self._on_object_end()
+                else:
+                    self._on_array_end()
+                continue
+
+            if isObject:
+                key, val = item
+                # Excluded subtrees are not walked at all.
+                if not self.keepKey(key):
+                    continue
+                self._on_key(key)
+                if isinstance(val, (dict, list)):
+                    enter(val)
+                else:
+                    self._on_value(self.treeValue(val))
+            elif isinstance(item, (dict, list)):
+                if len(stack) == 1 and not self._elementFilter is None \
+                   and isinstance(item, dict) \
+                   and not self._elementFilter.keep(item, self.treeValue):
+                    continue
+                enter(item)
             else:
-                return f.read()
+                self._on_element(self.treeValue(item))
 
-        self.jss.consume(
-            file
-            if isinstance(file, str)
-            else read(file)
-        )
+    def isThreeSixty(self):
+        return self.configee['engine'] == 'threesixty' and self._sink is None \
+            and self._keyPathFilter is None and self._elementFilter is None
+
+    def parse(self, file):
+
+        self._debug = self.logger.isEnabledFor(logging.DEBUG)
+        self._sink = self.configee['sink']
+
+        parallelEngine = ParallelEngine(self)
+        if parallelEngine.isSupported():
+            # Documents the workers cannot take are parsed from the bytes
+            # read for them.
+            file = parallelEngine.read(file)
+            if parallelEngine.load(file):
+                return
+
+        engine = self.configee['engine']
+        if self.configee['input'] == 'ndjson':
+            # With a sink, or a spilling row store, memory stays flat
+            # however long the file is.
+            self.walk(self.readLines(file))
+        elif engine in ('tree', 'threesixty'):
+            doc = self.readDocument(file)
+            if self.isThreeSixty() and ThreeSixtyEngine(self).load(doc):
+                self.reduce(isReduced=True)
+                return
+            self.walk(doc)
+        else:
+            self._matchElements = not self._elementFilter is None
+            tokenizer = createTokenizer(self.configee['tokenizer'], self)
+            for chunk in self.readChunks(file):
+                tokenizer.consume(chunk)
+            tokenizer.close()
         self._on_doc_end()
+        self._tablePairs = {}
 
-        self.reduceTables()
-        self.reduceRows()
+        if self._sink is not None:
+            # Documents that are not top level arrays are emitted whole.
+            if len(self['rowMap']) > 0:
+                self.emit()
+            return
 
-    def reduceTables(self):
+        self.reduce()
+
+    def reduce(self, isReduced=False):
+        # Rows of the three-sixty engine are reduced already and only need
+        # the schema plan and compaction. The reduce option stops after the
+        # tables ('tables') or before them (None), e.g. for workers whose
+        # rows are reduced with those of the other workers.
+        reduction = self.configee['reduce']
+        if reduction is None:
+            return
+        plan = None if self.configee['schemaPlanDir'] is None \
+            else SchemaPlan.fromParser(self)
+        collapsed = {} if isReduced else self.reduceTables()
+        if not plan is None:
+            self.updateSchemaPlan(plan, collapsed)
+        if reduction == 'tables':
+            return
+        if not isReduced:
+            self.reduceRows()
+        if self.configee['storage'] == 'columnar':
+            self.compact()
+
+    def reduceTables(self, isStreamed=False):
 
         def filterTables():
 
+            # Child tables of the schema plan are collapsed as they were in
+            # the files the plan comes from, so files of a kind get the same
+            # tables, whatever their rows. Only new child tables are decided
+            # from their rows. Rows of collapsed tables are hashed either
+            # way, since the merged rows keep their hashes. Streamed elements
+            # cannot decide for the whole file, so new child tables that may
+            # be collapsed are refused.
+            plan = self['schemaPlan']
             oldNewTableMap = {}
 
             for name, table in self['tableMap'].items():
@@ -415,7 +1014,17 @@ class ParserMixin(Leaf):
 
                 for childName in table['children']:
 
-                    childTable = self['tableMap'][childName]
+                    if not plan is None and childName in plan.tables:
+                        if plan.collapsed.get(childName) == name:
+                            for rowId in self['tableMap'][childName]['rows']:
+                                self.getRowHash(childName, self['rowMap'][rowId])
+                            oldNewTableMap[childName] = name
+                        continue
+                    if isStreamed:
+                        raise ValueError(
+                            'Cannot stream table {} of {}, which may be collapsed. Parse a file '
+                            'of this kind without a sink and with a schema plan first.'.format(
+                                childName, name))
                     if self.getUniqueRowCount(childName) != 1:
                         continue
 
@@ -453,7 +1062,7 @@ class ParserMixin(Leaf):
                     self.logger.debug('MergeRows: %s:%s \n ~ %s:%s',
                                       name, self['rowMap'][oldRowId], childName, self['rowMap'][oldChildRowId])
 
-                    newRow = {**oldChildRow, ** {rowIdName: str(uuid4())}}
+                    newRow = {**oldChildRow, ** {rowIdName: self.createRowId()}}
                     newRowId = newRow[rowIdName]
 
                     newRowsGrouper(name, newRow)
@@ -476,12 +1085,23 @@ class ParserMixin(Leaf):
             orphanIndexeesMap = {}
             orphanIndexeesGrouper = groupsCreator(orphanIndexeesMap)
 
+            affectedTables = set(oldNewTableMap.keys()) \
+                .union(oldNewTableMap.values())
+
             for oldParentChildPair, oldIndexeds in self['indexed'].items():
                 newParentTable = oldNewTableGetter(oldParentChildPair[0])
                 newChildTable = oldNewTableGetter(oldParentChildPair[1])
                 if newParentTable == newChildTable:
                     continue
 
+                # Relations between tables that are not merged keep both
+                # their tables and row ids, so they are left in place and
+                # only take part in the parent assignment below.
+                if len(affectedTables.intersection(oldParentChildPair)) == 0:
+                    if len(oldIndexeds) > 0:
+                        newIndexeesMap[oldParentChildPair] = []
+                    continue
+
                 newParentChildPair = (newParentTable, newChildTable)
 
                 self.logger.debug('processIndexes: %s:%s\n ~ %s:%s',
@@ -505,6 +1125,9 @@ class ParserMixin(Leaf):
 
             return newIndexeesMap, orphanIndexeesMap
 
+        # Natural keys are hashed first, so the hashes that decide on the
+        # collapses are the ones reduceRows uses.
+        self.hashNaturalKeys()
         oldNewTableMap = filterTables()
 
         tableNewRowsMap, tableOrphanRowsMap, oldIdNewIdsMap \
@@ -562,6 +1185,19 @@ class ParserMixin(Leaf):
                 del self['rowMap'][key]
             del self['tableMap'][oldTable]
 
+        return oldNewTableMap
+
+    def updateSchemaPlan(self, plan, collapsed):
+        # Plans are kept per root table, i.e. per kind of file, and only
+        # rewritten when a file shows tables, columns or collapse decisions
+        # that are not in the plan loaded before the parse.
+        plan.collapsed = dict(collapsed)
+        knownPlan = self['schemaPlan']
+        if knownPlan is None or not knownPlan.covers(plan):
+            knownPlan = plan.saveMerged(self.configee['schemaPlanDir'], logger=self.logger)
+        self['schemaPlan'] = knownPlan
+        return knownPlan
+
     def reduceRows(self):
 
         def createIndexHelper(keyIdxMap):
@@ -574,8 +1210,13 @@ class ParserMixin(Leaf):
             return getIndex
 
         oldNewIdMap = {}
+        naturalIdTables = {}
 
-        uniqRows = {}
+        uniqRows = self.createRowMap()
+        self.hashNaturalKeys()
+        # Batches hold whole tables, so spilled rows are hashed row by row.
+        if self._spillStore is None:
+            self.hashTables()
 
         for tableName, table in self['tableMap'].items():
             for id in table['rows']:
@@ -585,12 +1226,23 @@ class ParserMixin(Leaf):
 
                 if id in oldNewIdMap:
                     continue
+                # Rows with natural ids are only deduplicated by them, as
+                # long as no other table uses the same ids.
+                if id in self._naturalIds:
+                    naturalId = self._naturalIds[id]
+                    if naturalIdTables.setdefault(naturalId, tableName) == tableName:
+                        hashVal = naturalId
+                    else:
+                        self.logger.warning('Natural id %s of %s is also used in %s.',
+                                            naturalId, tableName, naturalIdTables[naturalId])
                 oldNewIdMap[id] = hashVal
                 if hashVal in uniqRows:
                     continue
                 row[self.configee.getRowIdName()] = hashVal
                 uniqRows[hashVal] = row
 
+        if not self._spillStore is None:
+            self['rowMap'].drop()
         self['rowMap'] = uniqRows
 
         for _, table in self['tableMap'].items():
@@ -619,9 +1271,142 @@ class ParserMixin(Leaf):
 
                 uniqIndexees[(i, r[parentName], r[childName])] = r
 
-            newIndexed[parentChildNamePair] = uniqIndexees.values()
+            newIndexed[parentChildNamePair] = self.createIndexees(
+                parentChildNamePair, uniqIndexees.values())
 
+        if not self._spillStore is None:
+            for indexees in self['indexed'].values():
+                indexees.drop()
         self['indexed'] = newIndexed
+        self._childTableNames = {}
+        self._naturalIds = {}
+
+    def compact(self):
+        # Columnar storage shrinks the reduced result that is kept until it
+        # is persisted. Rows are still built and reduced as dicts, so the
+        # peak memory of a parse is that of dict storage.
+        tables = []
+        for name, table in self['tableMap'].items():
+            table['rows'] = ColumnarTable(table['rows'], self['rowMap'], idColumns=(
+                self.configee.getRowIdName(),
+                self.configee.getRowHashName(name),
+            ))
+            tables.append(table['rows'])
+        self['rowMap'] = ColumnarRowMap(tables)
+        self['indexed'] = {
+            parentChildPair: ColumnarIndexees(parentChildPair, indexees)
+            for parentChildPair, indexees in self['indexed'].items()
+        }
+
+    def merge(self, other):
+        return self.mergeAll([other])
+
+    def mergeAll(self, others):
+        # Merges the reduced rows of other parsers into this one. Row ids
+        # are content hashes, or natural ids, so rows with equal ids are the
+        # same row and are kept once. Equal parent rows with hash ids have
+        # equal children, so the relations of such a parent row that is here
+        # already are kept as they are, which keeps the order, and thereby
+        # __index, of each parent's children. Rows with natural ids may have
+        # other children in other files, so their new children are added.
+        if isinstance(self['rowMap'], ColumnarRowMap):
+            raise ValueError(
+                'Cannot merge into a compacted parser, compact it after merging.')
+        rowMap = self['rowMap']
+        knownParentIds = {}
+        knownChildIds = {}
+        for other in others:
+            otherRowMap = other['rowMap']
+            for tableName, table in other['tableMap'].items():
+                merged = self.getTable(tableName)
+                merged['columns'].update(table['columns'])
+                merged['children'].update(table['children'])
+                if merged['parent'] is None:
+                    merged['parent'] = table['parent']
+                rows = merged['rows']
+                newRowIds = [rowId for rowId in table['rows'] if not rowId in rows]
+                rows.update(newRowIds)
+                for rowId in newRowIds:
+                    rowMap[rowId] = otherRowMap[rowId]
+
+            for parentChildPair, indexees in other['indexed'].items():
+                parentName, childName = parentChildPair
+                isNatural = not other.getNaturalKey(parentName) is None
+                if not parentChildPair in self['indexed']:
+                    self['indexed'][parentChildPair] = self.createIndexees(parentChildPair)
+                mergedIndexees = self['indexed'][parentChildPair]
+                if not parentChildPair in knownParentIds:
+                    knownParentIds[parentChildPair] = set(mergedIndexees.parentModels.keys()) \
+                        if isinstance(mergedIndexees, Indexees) else set([
+                            relation[parentName] for relation in mergedIndexees
+                        ])
+                known = knownParentIds[parentChildPair]
+                newParentIds = set([])
+                for relation in indexees:
+                    parentId = relation[parentName]
+                    if parentId in known:
+                        if not isNatural:
+                            continue
+                        key = (parentChildPair, parentId)
+                        if not key in knownChildIds:
+                            knownChildIds[key] = set(mergedIndexees.getChildIds(parentId))
+                        if relation[childName] in knownChildIds[key]:
+                            continue
+                        knownChildIds[key].add(relation[childName])
+                    mergedIndexees.add(dict(relation))
+                    newParentIds.add(parentId)
+                known.update(newParentIds)
+        self._childTableNames = {}
+        return self
+
+    def getResult(self):
+        # The reduced tables, rows and relations as plain data, e.g. to hand
+        # them from a worker process to a session. Callables, the string pool
+        # and the schema plan of the config are left out. Compacted results
+        # are handed over as they are.
+        config = {
+            key: val for key, val in self['config'].items()
+            if not key in ('sink', 'stringPool', 'elementFilter', 'hasher', 'binaryHasher',
+                           'schemaPlanDir')
+        }
+        if isinstance(self['rowMap'], ColumnarRowMap):
+            return {
+                'config': config,
+                'tableMap': self['tableMap'],
+                'rowMap': self['rowMap'],
+                'indexed': self['indexed'],
+            }
+        return {
+            'config': config,
+            'tableMap': {
+                name: {**table, 'rows': set(table['rows'])}
+                for name, table in self['tableMap'].items()
+            },
+            'rowMap': dict(self['rowMap']),
+            'indexed': {
+                pair: list(indexees) for pair, indexees in self['indexed'].items()
+            },
+        }
+
+    @classmethod
+    def fromResult(cls, result):
+        parser = Parser({'config': result['config']})
+        parser['tableMap'] = result['tableMap']
+        if isinstance(result['rowMap'], ColumnarRowMap):
+            parser['rowMap'] = result['rowMap']
+            parser['indexed'] = result['indexed']
+            return parser
+        rowMap = parser['rowMap']
+        for rowId, row in result['rowMap'].items():
+            rowMap[rowId] = row
+        parser['indexed'] = {
+            pair: parser.createIndexees(pair, relations)
+            for pair, relations in result['indexed'].items()
+        }
+        return parser
+
+    def getRowFileName(self, rowId):
+        return self.configee['fileName']
 
     def report(self):
         res = []
@@ -12,6 +12,7 @@ from contrib.p4thpydb.db.ts import Ts
 
 from .parser import Parser
 from .parser import mapGetterCreator
+from .hashfilter import RowHashFilter
 
 from contrib.p4thpydb.db.pgsql.differ import QueryFactory as PGSQLQueryFactory
 from contrib.p4thpydb.db.pgsql.db import DB as PGSQLDB
@@ -73,6 +74,7 @@ class PersisterMixin(Leaf):
             'locktype': 'ACCESS EXCLUSIVE',
             'time': time(),
             'realType': 'DOUBLE PRECISION',
+            'paramFormat': '%({})s',
             'logger': logger,
         })
 
@@ -95,12 +97,64 @@ class PersisterMixin(Leaf):
             'locktype': None,
             'time': time(),
             'realType': 'REAL',
+            'paramFormat': ':{}',
             'logger': logger,
         })
 
     @classmethod
     def onNew(cls, self):
+        self.row = {
+            **{
+                'hashFilterPath': None,
+                'hashFilterCapacity': RowHashFilter.defaultCapacity,
+            },
+            **self.row
+        }
         self.logger = self['logger'] if self['logger'] is not None else logger0
+        self._hashFilter = None
+
+    def createHashFilter(self):
+        return RowHashFilter.create(self['hashFilterCapacity'])
+
+    def getHashFilter(self):
+        if self['hashFilterPath'] is None:
+            return None
+        if self._hashFilter is None:
+            self._hashFilter = RowHashFilter.load(self['hashFilterPath']) \
+                if os.path.exists(self['hashFilterPath']) else self.createHashFilter()
+        return self._hashFilter
+
+    def queryStoredRowIds(self, tableName, rowIds, idName='__id', batchSize=500):
+        res = set([])
+        for i in range(0, len(rowIds), batchSize):
+            params = {
+                'id{}'.format(j): str(rowId) for j, rowId in enumerate(rowIds[i:i + batchSize])
+            }
+            q = 'SELECT "{id}" AS "id" FROM "{schema}"."{table}" WHERE "{id}" IN ({params})'.format(
+                id=idName, schema=self['schema'], table=tableName,
+                params=', '.join([self['paramFormat'].format(name) for name in params.keys()]))
+            res.update([row['id'] for row in self['db'].query((q, params))])
+        return res
+
+    def rebuildHashFilter(self, tableNames=None, idName='__id'):
+        # Without table names, the tables the current filter has seen are
+        # read back.
+        hashFilter = self.getHashFilter()
+        tableNames = hashFilter.tableNames if tableNames is None else tableNames
+        tableIds = {}
+        for tableName in tableNames:
+            q = 'SELECT "{id}" AS "id" FROM "{schema}"."{table}"'.format(
+                id=idName, schema=self['schema'], table=tableName)
+            tableIds[tableName] = [
+                int(row['id']) if str(row['id']).isdigit() else row['id']
+                for row in self['db'].query(q)
+            ]
+        hashFilter = self.createHashFilter()
+        for tableName, ids in tableIds.items():
+            hashFilter.add(ids, tableName=tableName)
+        hashFilter.save(self['hashFilterPath'])
+        self._hashFilter = hashFilter
+        return hashFilter
 
     def persist(self, parseree: Parser, t=None, file=None, retries=20):
         _t = t
@@ -112,6 +166,7 @@ class PersisterMixin(Leaf):
         db = self['db']
         orm = self['orm']
         qf = self['queryFactory']
+        hashFilter = self.getHashFilter()
 
         def createIndexes(tbl, cols, depth=1):
             def ixName(tbl, cols): return '{}_{}'.format(tbl, '_'.join(cols))
@@ -224,17 +279,25 @@ class PersisterMixin(Leaf):
 
         def persistTable(table, file=None):
 
+            def getFile(fileName):
+                if not fileName in fileMap:
+                    fileMap[fileName] = os.path.splitext(
+                        os.path.basename(fileName))[0]
+                return fileMap[fileName]
+
             typeMap = {}
             staticRowMap = {}
+            fileMap = {}
             if file is None or file is not False:
                 staticRowMap['file'] = \
-                    os.path.splitext(os.path.basename(parseree.configee['fileName']))[0] \
+                    getFile(parseree.configee['fileName']) \
                     if file is None else file
             staticRowMap['__time'] = _t
             typeMap['__time'] = self['realType']
 
             tableName = table['name']
             columns0 = queryColumns(tableName)
+            isNewTable = len(columns0) == 0
 
             tableSpec = {
                 'name': '{}.{}'.format(self['schema'], tableName),
@@ -259,17 +322,35 @@ class PersisterMixin(Leaf):
                     'transform': T,
                 }
 
+            # Sessions hold rows of several files, each row is stored with
+            # the file it was first seen in.
+            # Rows the filter reports as stored are confirmed with a primary
+            # key lookup, so a false positive never drops a new row. Only
+            # rows with content hashes are equal to stored rows of equal id,
+            # others are upserted.
+            rowIds = list(table['rows'])
+            if not hashFilter is None and not isNewTable and parseree.isContentHashed(tableName):
+                known = hashFilter.contains(rowIds)
+                candidates = [rowId for rowId, isKnown in zip(rowIds, known) if isKnown]
+                stored = self.queryStoredRowIds(
+                    tableName, candidates, idName=configee.getRowIdName())
+                rowIds = [rowId for rowId in rowIds if not str(rowId) in stored]
+                self.logger.info('Skipping %s of %s stored rows in %s.',
+                                 len(table['rows']) - len(rowIds), len(table['rows']), tableName)
+
             rows = [
                 {
                     **staticRowMap,
+                    **({} if not file is None else {'file': getFile(parseree.getRowFileName(rowId))}),
                     **parseree['rowMap'][rowId]
-                } for rowId in table['rows']
+                } for rowId in rowIds
             ]
 
             droppedIxCount = dropIndexes(tableName)
             print('Dropped {} indexed for table {}.'.format(
                 droppedIxCount, tableName))
-            orm.upsert(tableSpec, rows, batchSize=1000)
+            if len(rows) > 0:
+                orm.upsert(tableSpec, rows, batchSize=1000)
             return {}
 
         def indexedTableName(pair):
@@ -401,6 +482,11 @@ class PersisterMixin(Leaf):
                         postExcept=lambda: self['db'].rollback(),
                         delay=lambda r: retries - r)
 
+        if not hashFilter is None:
+            for name, table in parseree['tableMap'].items():
+                hashFilter.add(list(table['rows']), tableName=name)
+            self._hashFilter = hashFilter.saveMerged(self['hashFilterPath'])
+
         return db
 
     def report(self):
@@ -0,0 +1,141 @@
+import struct
+import xxhash
+from operator import itemgetter
+
+
+class LongInt(int):
+
+    # Ints beyond 64 bits are encoded as text, tagged apart from strings.
+    pass
+
+
+class RowEncoder:
+
+    # A canonical binary encoding of a row for hashing: a layout, i.e. the
+    # column names and value types in column order, then the fixed width
+    # values packed little endian, where strings are packed as their byte
+    # lengths, and then the utf-8 bytes of the strings. Child tables follow
+    # as names with the sums of their child row hashes modulo 2^64. Nothing
+    # depends on the Python version, the platform or dict order, so the
+    # hashes are stable. Layouts are cached, since a table has only a few.
+    fixedCodes = {
+        type(None): (b'N', None),
+        bool: (b'T', '?'),
+        int: (b'i', 'q'),
+        float: (b'd', 'd'),
+        str: (b's', 'I'),
+    }
+    count = struct.Struct('<I')
+    hashMask = 2 ** 64 - 1
+
+    def __init__(self, hasher=xxhash.xxh3_64_intdigest):
+        self.hasher = hasher
+        self.layouts = {}
+        self.childLayouts = {}
+
+    def encodeName(self, name):
+        encoded = name.encode('utf-8')
+        return self.count.pack(len(encoded)) + encoded
+
+    def createGetter(self, ixs):
+        if len(ixs) == 0:
+            return lambda vals: ()
+        if len(ixs) == 1:
+            return lambda vals: (vals[ixs[0]],)
+        return itemgetter(*ixs)
+
+    def getLayout(self, keys, types, skipCols):
+        layoutKey = (keys, types, skipCols)
+        if layoutKey in self.layouts:
+            return self.layouts[layoutKey]
+        header = []
+        fmt = '<'
+        ixs = []
+        textIxs = []
+        for i, (key, valType) in enumerate(zip(keys, types)):
+            if key in skipCols:
+                continue
+            # Values of other types, e.g. huge ints, are stored as text.
+            tag, code = self.fixedCodes.get(valType, (b'o', 'I'))
+            header.append(self.encodeName(key))
+            header.append(tag)
+            if code is None:
+                continue
+            if code == 'I':
+                textIxs.append((len(ixs), valType is str))
+            ixs.append(i)
+            fmt += code
+        layout = (
+            self.count.pack(len(header) // 2) + b''.join(header),
+            struct.Struct(fmt),
+            self.createGetter(ixs),
+            tuple(textIxs),
+        )
+        self.layouts[layoutKey] = layout
+        return layout
+
+    def getChildLayout(self, childNames):
+        if childNames in self.childLayouts:
+            return self.childLayouts[childNames]
+        layout = (b''.join([self.count.pack(len(childNames))] + [
+            self.encodeName(childName) for childName in childNames
+        ]), struct.Struct('<' + 'Q' * len(childNames)))
+        self.childLayouts[childNames] = layout
+        return layout
+
+    def encodeTexts(self, args, textIxs):
+        args = list(args)
+        texts = []
+        for i, isStr in textIxs:
+            text = (args[i] if isStr else repr(args[i])).encode('utf-8')
+            texts.append(text)
+            args[i] = len(text)
+        return args, b''.join(texts)
+
+    def encodeLongInts(self, row):
+        return {
+            key: LongInt(val) if type(val) is int and not -2 ** 63 <= val < 2 ** 63 else val
+            for key, val in row.items()
+        }
+
+    def encodeRows(self, rows, childNames=(), childSums=None, skipCols=()):
+        # childSums holds a list of sums, one per child table, for every row.
+        layouts = self.layouts
+        getLayout = self.getLayout
+        childHeader, childPacker = self.getChildLayout(tuple(childNames))
+        hashMask = self.hashMask
+        emptyChildren = childHeader + childPacker.pack(*[0] * len(childNames))
+        for i, row in enumerate(rows):
+            keys = tuple(sorted(row))
+            vals = list(map(row.__getitem__, keys))
+            layoutKey = (keys, tuple(map(type, vals)), skipCols)
+            header, packer, getter, textIxs = layouts[layoutKey] \
+                if layoutKey in layouts else getLayout(*layoutKey)
+
+            args = getter(vals)
+            texts = b''
+            if len(textIxs) > 0:
+                args, texts = self.encodeTexts(args, textIxs)
+            try:
+                body = packer.pack(*args)
+            except struct.error:
+                yield from self.encodeRows([self.encodeLongInts(row)], childNames, None if (
+                    childSums is None) else [childSums[i]], skipCols)
+                continue
+
+            children = emptyChildren if childSums is None \
+                else childHeader + childPacker.pack(*[
+                    childSum & hashMask for childSum in childSums[i]
+                ])
+            yield header + body + texts + children
+
+    def encode(self, row, childSums=(), skipCols=()):
+        return next(self.encodeRows(
+            [row], [childName for childName, _ in childSums],
+            [[childSum for _, childSum in childSums]], skipCols))
+
+    def hash(self, row, childSums=(), skipCols=()):
+        return self.hasher(self.encode(row, childSums, skipCols))
+
+    def hashBatch(self, rows, childNames=(), childSums=None, skipCols=()):
+        return list(map(self.hasher, self.encodeRows(rows, childNames, childSums, skipCols)))
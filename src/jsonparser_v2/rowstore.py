@@ -0,0 +1,266 @@
+import os
+import pickle
+import sqlite3
+import tempfile
+from itertools import count
+from collections import OrderedDict
+from collections.abc import MutableMapping
+
+
+class SpillStore:
+
+    # Row ids are dense integers while parsing and unsigned 64 bit hashes
+    # after reduceRows, which are folded into SQLite's signed integers.
+    intRange = 2 ** 64
+
+    def __init__(self, budget, dirPath=None):
+        self.db = None
+        self.budget = budget
+        self.tableIds = count(1)
+        self.seqs = count(1)
+        # The relation budget is shared by all relation tables, most of
+        # which are small.
+        self.indexees = {}
+        self.relationCount = 0
+        fd, self.path = tempfile.mkstemp(suffix='.rows.sqlite', dir=dirPath)
+        os.close(fd)
+        self.db = sqlite3.connect(self.path, isolation_level=None)
+        self.db.execute('PRAGMA journal_mode = OFF')
+        self.db.execute('PRAGMA synchronous = OFF')
+
+    def encodeKey(self, key):
+        if type(key) is int and key >= self.intRange // 2:
+            return key - self.intRange
+        return key
+
+    def decodeKey(self, key):
+        if type(key) is int and key < 0:
+            return key + self.intRange
+        return key
+
+    def createTableName(self, prefix):
+        return '{}_{}'.format(prefix, next(self.tableIds))
+
+    def createRowMap(self):
+        return SpillRowMap(self)
+
+    def createIndexees(self, parentChildPair, rows=None):
+        indexees = SpillIndexees(parentChildPair, self)
+        self.indexees[indexees.tableName] = indexees
+        for row in rows or ():
+            indexees.add(row)
+        return indexees
+
+    def spillRelations(self):
+        for indexees in sorted(self.indexees.values(), key=lambda i: -len(i.models)):
+            if self.relationCount <= self.budget // 2:
+                return
+            indexees.spill()
+
+    def close(self):
+        if self.db is None:
+            return
+        self.db.close()
+        self.db = None
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def __del__(self):
+        self.close()
+
+
+class SpillRowMap(MutableMapping):
+
+    def __init__(self, store):
+        self.store = store
+        self.budget = store.budget
+        self.batchSize = max(1, self.budget // 10)
+        # Rows in memory, least recently used first. Every row lives either
+        # here or in the database, never in both.
+        self.rows = OrderedDict()
+        self.spilledCount = 0
+        self.tableName = store.createTableName('rows')
+        self.store.db.execute(
+            'CREATE TABLE {} (id PRIMARY KEY, row BLOB NOT NULL)'.format(self.tableName))
+
+    def spill(self):
+        count = max(len(self.rows) - self.budget, self.batchSize)
+        batch = []
+        for _ in range(min(count, len(self.rows))):
+            key, row = self.rows.popitem(last=False)
+            batch.append((self.store.encodeKey(key), pickle.dumps(
+                row, protocol=pickle.HIGHEST_PROTOCOL)))
+        self.store.db.executemany(
+            'INSERT INTO {} (id, row) VALUES (?, ?)'.format(self.tableName), batch)
+        self.spilledCount += len(batch)
+
+    def unspill(self, key):
+        encodedKey = self.store.encodeKey(key)
+        found = self.store.db.execute(
+            'SELECT row FROM {} WHERE id = ?'.format(self.tableName), (encodedKey,)).fetchone()
+        if found is None:
+            return None
+        self.store.db.execute(
+            'DELETE FROM {} WHERE id = ?'.format(self.tableName), (encodedKey,))
+        self.spilledCount -= 1
+        return pickle.loads(found[0])
+
+    def __getitem__(self, key):
+        if key in self.rows:
+            self.rows.move_to_end(key)
+            return self.rows[key]
+        row = None if self.spilledCount < 1 else self.unspill(key)
+        if row is None:
+            raise KeyError(key)
+        self[key] = row
+        return row
+
+    def __setitem__(self, key, row):
+        if key in self.rows:
+            self.rows.move_to_end(key)
+        elif self.spilledCount > 0:
+            self.unspill(key)
+        self.rows[key] = row
+        if len(self.rows) > self.budget:
+            self.spill()
+
+    def __delitem__(self, key):
+        if key in self.rows:
+            del self.rows[key]
+            return
+        if self.spilledCount < 1 or self.unspill(key) is None:
+            raise KeyError(key)
+
+    def __contains__(self, key):
+        if key in self.rows:
+            return True
+        if self.spilledCount < 1:
+            return False
+        return self.store.db.execute(
+            'SELECT 1 FROM {} WHERE id = ?'.format(self.tableName),
+            (self.store.encodeKey(key),)).fetchone() is not None
+
+    def __len__(self):
+        return len(self.rows) + self.spilledCount
+
+    def __iter__(self):
+        keys = list(self.rows.keys())
+        keys += [self.store.decodeKey(found[0]) for found in self.store.db.execute(
+            'SELECT id FROM {}'.format(self.tableName))]
+        return iter(keys)
+
+    def drop(self):
+        self.rows = OrderedDict()
+        self.spilledCount = 0
+        self.store.db.execute('DROP TABLE {}'.format(self.tableName))
+
+
+class SpillRelation(dict):
+
+    __slots__ = ('seq',)
+
+
+class SpillIndexees:
+
+    def __init__(self, parentChildPair, store):
+        self.parentChildPair = tuple(parentChildPair)
+        self.store = store
+        # Relations are keyed by a store wide sequence number, so relations
+        # in the database always precede the ones in memory, which keeps
+        # the insertion order.
+        self.models = {}
+        self.parentModels = {}
+        self.spilledCount = 0
+        self.tableName = store.createTableName('relations')
+        self.store.db.execute(
+            'CREATE TABLE {} (seq INTEGER PRIMARY KEY, parentId, childId)'.format(self.tableName))
+        self.store.db.execute(
+            'CREATE INDEX {0}_parent ON {0} (parentId, seq)'.format(self.tableName))
+
+    def __len__(self):
+        return len(self.models) + self.spilledCount
+
+    def __iter__(self):
+        parentName, childName = self.parentChildPair
+        if self.spilledCount > 0:
+            found = self.store.db.cursor().execute(
+                'SELECT seq, parentId, childId FROM {} ORDER BY seq'.format(self.tableName))
+            for seq, parentId, childId in found:
+                relation = SpillRelation({
+                    parentName: self.store.decodeKey(parentId),
+                    childName: self.store.decodeKey(childId),
+                })
+                relation.seq = seq
+                yield relation
+        yield from list(self.models.values())
+
+    def add(self, relation):
+        if not isinstance(relation, SpillRelation):
+            relation = SpillRelation(relation)
+        relation.seq = next(self.store.seqs)
+        parentId = relation[self.parentChildPair[0]]
+        self.models[relation.seq] = relation
+        if not parentId in self.parentModels:
+            self.parentModels[parentId] = {}
+        self.parentModels[parentId][relation.seq] = relation
+        self.store.relationCount += 1
+        if self.store.relationCount > self.store.budget:
+            self.store.spillRelations()
+        return relation
+
+    def index(self, parentChildeIdPair):
+        self.add({
+            self.parentChildPair[0]: parentChildeIdPair[0],
+            self.parentChildPair[1]: parentChildeIdPair[1],
+        })
+        return self.parentChildPair
+
+    def spill(self):
+        parentName, childName = self.parentChildPair
+        encodeKey = self.store.encodeKey
+        self.store.db.executemany(
+            'INSERT INTO {} (seq, parentId, childId) VALUES (?, ?, ?)'.format(self.tableName), [
+                (seq, encodeKey(relation[parentName]), encodeKey(relation[childName]))
+                for seq, relation in self.models.items()
+            ])
+        self.spilledCount += len(self.models)
+        self.store.relationCount -= len(self.models)
+        self.models = {}
+        self.parentModels = {}
+
+    def remove(self, relation):
+        parentId = relation[self.parentChildPair[0]]
+        if relation.seq in self.models:
+            del self.models[relation.seq]
+            self.store.relationCount -= 1
+            parentModels = self.parentModels[parentId]
+            del parentModels[relation.seq]
+            if len(parentModels) == 0:
+                del self.parentModels[parentId]
+            return relation
+        self.store.db.execute(
+            'DELETE FROM {} WHERE seq = ?'.format(self.tableName), (relation.seq,))
+        self.spilledCount -= 1
+        return relation
+
+    def drop(self):
+        self.store.relationCount -= len(self.models)
+        del self.store.indexees[self.tableName]
+        self.models = {}
+        self.parentModels = {}
+        self.spilledCount = 0
+        self.store.db.execute('DROP TABLE {}'.format(self.tableName))
+
+    def getChildIds(self, parentId):
+        childName = self.parentChildPair[1]
+        res = []
+        if self.spilledCount > 0:
+            res = [self.store.decodeKey(found[0]) for found in self.store.db.execute(
+                'SELECT childId FROM {} WHERE parentId = ? ORDER BY seq'.format(self.tableName),
+                (self.store.encodeKey(parentId),))]
+        if parentId in self.parentModels:
+            res += [
+                relation[childName]
+                for relation in self.parentModels[parentId].values()
+            ]
+        return res
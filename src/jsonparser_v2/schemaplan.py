@@ -0,0 +1,119 @@
+import os
+import logging
+import tempfile
+import ujson
+
+from .filelock import FileLock
+
+logger0 = logging.getLogger('SchemaPlan')
+
+
+class SchemaPlan:
+
+    version = 1
+
+    @classmethod
+    def getPath(cls, dirPath, rootTableName):
+        return os.path.join(dirPath, '{}.plan.json'.format(rootTableName))
+
+    @classmethod
+    def fromParser(cls, parser, collapsed={}):
+        tables = {}
+        for name, table in parser['tableMap'].items():
+            tables[name] = {
+                'parent': table['parent'],
+                'children': parser.getChildTableNames(name),
+                'columns': sorted(table['columns']),
+            }
+        return SchemaPlan(parser.configee['rootTableName'], tables, collapsed)
+
+    @classmethod
+    def fromJSON(cls, data):
+        if data['version'] != cls.version:
+            return None
+        return SchemaPlan(data['rootTableName'], data['tables'], data['collapsed'])
+
+    @classmethod
+    def load(cls, dirPath, rootTableName):
+        path = cls.getPath(dirPath, rootTableName)
+        if not os.path.exists(path):
+            return None
+        with open(path, 'r') as f:
+            return cls.fromJSON(ujson.load(f))
+
+    def __init__(self, rootTableName, tables={}, collapsed={}):
+        self.rootTableName = rootTableName
+        # Table name -> parent, ordered child tables and columns, as found
+        # before reduceTables, plus the child -> table collapse decisions.
+        self.tables = {name: dict(table) for name, table in tables.items()}
+        self.collapsed = dict(collapsed)
+
+    def covers(self, other):
+        for name, table in other.tables.items():
+            known = self.tables.get(name)
+            if known is None \
+               or not set(table['children']).issubset(known['children']) \
+               or not set(table['columns']).issubset(known['columns']):
+                return False
+        return all([
+            self.collapsed.get(childName) == name
+            for childName, name in other.collapsed.items()
+        ])
+
+    def toJSON(self):
+        return {
+            'version': self.version,
+            'rootTableName': self.rootTableName,
+            'tables': self.tables,
+            'collapsed': self.collapsed,
+        }
+
+    def save(self, dirPath):
+        os.makedirs(dirPath, exist_ok=True)
+        # Written next to the target and moved into place, so parallel
+        # workers never read a half written plan.
+        fd, tmpPath = tempfile.mkstemp(dir=dirPath, suffix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            ujson.dump(self.toJSON(), f, indent=1, sort_keys=True)
+        os.replace(tmpPath, self.getPath(dirPath, self.rootTableName))
+
+    def saveMerged(self, dirPath, logger=logger0):
+        # Parallel workers parse files of the same kind, so the plan on disk
+        # is reloaded and merged under a lock instead of overwritten.
+        path = self.getPath(dirPath, self.rootTableName)
+        with FileLock(path + '.lock'):
+            knownPlan = self.load(dirPath, self.rootTableName)
+            if knownPlan is None:
+                self.save(dirPath)
+                return self
+            if knownPlan.update(self, logger=logger):
+                knownPlan.save(dirPath)
+            return knownPlan
+
+    def update(self, other, logger=logger0):
+        changed = False
+        for name, table in other.tables.items():
+            if not name in self.tables:
+                logger.info('New table %s in schema plan for %s.',
+                            name, self.rootTableName)
+                self.tables[name] = dict(table)
+                changed = True
+                continue
+            known = self.tables[name]
+            children = known['children'] + [
+                c for c in table['children'] if not c in known['children']
+            ]
+            columns = sorted(set(known['columns']).union(table['columns']))
+            if children != known['children'] or columns != known['columns']:
+                known['children'] = children
+                known['columns'] = columns
+                changed = True
+
+        for childName, name in other.collapsed.items():
+            if childName in self.collapsed and self.collapsed[childName] != name:
+                logger.warning('Table %s is collapsed into %s instead of %s in %s.',
+                               childName, name, self.collapsed[childName], self.rootTableName)
+            if self.collapsed.get(childName, False) != name:
+                self.collapsed[childName] = name
+                changed = True
+        return changed
@@ -0,0 +1,60 @@
+from contrib.pyas.src.pyas_v3 import As
+from contrib.pyas.src.pyas_v3 import Leaf
+
+from .parser import Parser
+from .parser import ParserMixin
+
+
+class ParseSessionMixin(Leaf):
+
+    # A session is a parser that holds the merged results of other parsers,
+    # with the file names that each row comes from.
+    @classmethod
+    def onNew(cls, self):
+        self.row = {
+            **{
+                'provenance': {},
+                'fileNames': [],
+                'keyedTableNames': set([]),
+            },
+            **self.row
+        }
+
+    def isContentHashed(self, tableName):
+        return not tableName in self['keyedTableNames'] and super().isContentHashed(tableName)
+
+    def getRowFileName(self, rowId):
+        return self['provenance'][rowId][0]
+
+    def parse(self, file, rootTableName=None):
+        parser = Parser({
+            'config': {
+                **self['config'],
+                **({} if rootTableName is None else {'rootTableName': rootTableName}),
+            },
+            'logger': self.logger,
+        })
+        parser.parse(file)
+        return self.add(parser)
+
+    def add(self, parser):
+        # Row ids are content hashes after reduceRows, so a row that is
+        # already in the session is the same row and is only recorded as
+        # also coming from this file.
+        fileName = parser.configee['fileName']
+        self['fileNames'].append(fileName)
+        provenance = self['provenance']
+        for name, table in parser['tableMap'].items():
+            if not parser.isContentHashed(name):
+                self['keyedTableNames'].add(name)
+            for rowId in table['rows']:
+                if rowId in provenance:
+                    if provenance[rowId][-1] != fileName:
+                        provenance[rowId].append(fileName)
+                    continue
+                provenance[rowId] = [fileName]
+        self.mergeAll([parser])
+        return parser
+
+
+ParseSession = As(ParseSessionMixin, ParserMixin)
@@ -0,0 +1,57 @@
+import sys
+
+
+class StringPool:
+
+    # Keeps one str object per distinct short string, so the keys and the
+    # repeated values of all rows share their strings. Long strings, which
+    # are mostly unique ids, are left alone, and the pool stops growing at
+    # maxCount strings, since it lives as long as the process.
+
+    def __init__(self, maxLength=32, maxCount=1000 * 1000):
+        self.maxLength = maxLength
+        self.maxCount = maxCount
+        self.strings = {}
+        self.pooledBytes = 0
+        self.lookups = 0
+        self.hits = 0
+        self.savedBytes = 0
+
+    def __len__(self):
+        return len(self.strings)
+
+    def intern(self, val):
+        if len(val) > self.maxLength:
+            return val
+        self.lookups += 1
+        pooled = self.strings.get(val)
+        if pooled is None:
+            if len(self.strings) < self.maxCount:
+                self.strings[val] = val
+                self.pooledBytes += sys.getsizeof(val)
+            return val
+        if not pooled is val:
+            self.hits += 1
+            self.savedBytes += sys.getsizeof(val)
+        return pooled
+
+    def getStats(self):
+        return {
+            'strings': len(self.strings),
+            'pooledBytes': self.pooledBytes,
+            'lookups': self.lookups,
+            'hits': self.hits,
+            'savedBytes': self.savedBytes,
+        }
+
+    def report(self):
+        return [
+            'String pool with {strings} strings ({pooledBytes} bytes), {hits} of {lookups} '
+            'lookups shared a pooled string instead of keeping {savedBytes} bytes of copies.'.format(**self.getStats())
+        ]
+
+    def clear(self):
+        self.__init__(self.maxLength, self.maxCount)
+
+
+stringPool = StringPool()
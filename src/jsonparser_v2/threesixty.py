@@ -0,0 +1,217 @@
+import base64
+
+import numpy as np
+
+
+def packArray(values, dtype='<f8'):
+    return base64.b64encode(np.asarray(values, dtype=dtype).tobytes()).decode('ascii')
+
+
+def unpackArray(text, dtype='<f8'):
+    return np.frombuffer(base64.b64decode(text), dtype=dtype)
+
+
+class ThreeSixtyEngine:
+
+    # Three-sixty files are top level arrays of frames like
+    #   {event_uuid, visible_area: [x0, y0, x1, y1, ...],
+    #    freeze_frame: [{teammate, actor, keeper, location: [x, y]}, ...]}.
+    # Instead of child tables of single coordinates, every frame becomes one
+    # row with packed coordinate and flag columns (see unpackArray). The row
+    # id is the hash the generic parser gives the frame, so ids do not
+    # depend on the engine. Files of any other shape are left to the
+    # generic parser.
+    areaKey = 'visible_area'
+    playersKey = 'freeze_frame'
+    locationKey = 'location'
+    flagMissing = 2
+    numberTypes = (int, float)
+
+    def __init__(self, parser):
+        self.parser = parser
+        self.configee = parser.configee
+        self.tableName = self.configee['rootTableName']
+        self.flattenArrayLength = self.configee['flattenArrayLength']
+        self.valueHashes = {}
+        self.scanned = None
+
+    def isFlattened(self, values):
+        return 1 <= len(values) <= self.flattenArrayLength
+
+    def isScalar(self, val):
+        return not isinstance(val, (dict, list))
+
+    def isNumbers(self, values):
+        return isinstance(values, list) \
+            and all(type(v) in self.numberTypes for v in values)
+
+    def scanObjects(self, objects, isValid):
+        # The generic parser starts a new row when a key repeats in the
+        # last one, so each object has to open with a scalar key of the
+        # previous object to stay a row of its own.
+        lastKeys = None
+        for obj in objects:
+            if not isinstance(obj, dict) or len(obj) == 0:
+                return False
+            firstKey = next(iter(obj))
+            if not self.isScalar(obj[firstKey]) \
+               or not (lastKeys is None or firstKey in lastKeys):
+                return False
+            if not all(isValid(key, val) for key, val in obj.items()):
+                return False
+            lastKeys = set([key for key, val in obj.items() if self.isScalar(val)])
+        return True
+
+    def scan(self, doc):
+        # Collects the child tables in the order the generic parser would
+        # index them, which is the order their hashes are combined in.
+        if not isinstance(doc, list) or len(doc) == 0:
+            return None
+        frameChildren = []
+        playerChildren = []
+        flagNames = []
+
+        def addChild(children, key, values, isNumbers=True):
+            if len(values) > 0 and not (isNumbers and self.isFlattened(values)) \
+               and not key in children:
+                children.append(key)
+
+        def isValidPlayerItem(key, val):
+            if key == self.locationKey:
+                if not self.isNumbers(val) or len(val) != 2:
+                    return False
+                addChild(playerChildren, key, val)
+                return True
+            if not val is None and not type(val) is bool:
+                return False
+            if not key in flagNames:
+                flagNames.append(key)
+            return True
+
+        def isValidFrameItem(key, val):
+            if key == self.areaKey:
+                if not self.isNumbers(val):
+                    return False
+                addChild(frameChildren, key, val)
+                return True
+            if key == self.playersKey:
+                if not isinstance(val, list) \
+                   or not self.scanObjects(val, isValidPlayerItem) \
+                   or not all(self.locationKey in player for player in val):
+                    return False
+                addChild(frameChildren, key, val, isNumbers=False)
+                return True
+            return self.isScalar(val)
+
+        if not self.scanObjects(doc, isValidFrameItem):
+            return None
+        return frameChildren, playerChildren, flagNames
+
+    def getHash(self, row, children):
+        return self.parser.createRowHash(row, list(children.items()))
+
+    def getValueHash(self, tableName, val):
+        # Coordinates repeat a lot, e.g. on the pitch borders. Zeros are
+        # not cached, since 0.0 == -0.0 while they serialize differently.
+        key = (tableName, type(val), val)
+        if val != 0 and key in self.valueHashes:
+            return self.valueHashes[key]
+        res = self.getHash(
+            {self.configee.getRowValueName(tableName): val}, {})
+        if val != 0:
+            self.valueHashes[key] = res
+        return res
+
+    def addValues(self, row, children, key, values):
+        if len(values) < 1:
+            return
+        if self.isFlattened(values):
+            for i, val in enumerate(values):
+                row['{}_{}'.format(key, i)] = val
+            return
+        children[key] = sum([self.getValueHash(key, val) for val in values])
+
+    def treeValue(self, val):
+        return self.parser.treeValue(val)
+
+    def getPlayerHash(self, player, childNames):
+        row = {}
+        children = {childName: 0 for childName in childNames}
+        for key, val in player.items():
+            if key == self.locationKey:
+                self.addValues(row, children, key,
+                               [self.treeValue(v) for v in val])
+            else:
+                row[key] = val
+        return self.getHash(row, children)
+
+    def createRow(self, frame, scanned):
+        frameChildren, playerChildren, flagNames = scanned
+        # Frames with a natural key are identified by it, so their content
+        # is not hashed.
+        naturalKey = self.parser.getNaturalKey(self.tableName)
+        isNatural = not naturalKey is None and not frame.get(naturalKey) is None
+        hashRow = {}
+        row = {}
+        children = {childName: 0 for childName in frameChildren}
+        for key, val in frame.items():
+            if key == self.areaKey:
+                values = [self.treeValue(v) for v in val]
+                if not isNatural:
+                    self.addValues(hashRow, children, key, values)
+                row[key] = packArray(values)
+            elif key == self.playersKey:
+                if len(val) > 0 and not isNatural:
+                    children[key] = sum([
+                        self.getPlayerHash(player, playerChildren) for player in val
+                    ])
+                locations = np.array([player[self.locationKey] for player in val],
+                                     dtype=np.float64).reshape((len(val), 2))
+                row[key + '_x'] = packArray(locations[:, 0])
+                row[key + '_y'] = packArray(locations[:, 1])
+                for flagName in flagNames:
+                    row['{}_{}'.format(key, flagName)] = packArray([
+                        self.flagMissing if player.get(flagName) is None
+                        else int(player[flagName]) for player in val
+                    ], dtype='<u1')
+            else:
+                hashRow[key] = row[key] = self.treeValue(val)
+
+        if isNatural:
+            id = frame[naturalKey]
+            rowHash = self.parser.createNaturalRowHash(naturalKey, id)
+        else:
+            id = rowHash = self.getHash(hashRow, children)
+        row[self.configee.getRowIdName()] = id
+        row[self.configee.getRowHashName(self.tableName)] = rowHash
+        return id, row
+
+    def load(self, doc):
+        if self.configee['rowEncoding'] == 'json' and self.configee['hasher'] is None:
+            return False
+        scanned = self.scanned = self.scan(doc)
+        if scanned is None:
+            return False
+
+        rowMap = self.parser.createRowMap()
+        columns = set([])
+        for frame in doc:
+            id, row = self.createRow(frame, scanned)
+            if id in rowMap:
+                continue
+            rowMap[id] = row
+            columns.update(row.keys())
+        columns.discard(self.configee.getRowHashName(self.tableName))
+
+        self.parser['tableMap'] = {
+            self.tableName: {
+                'name': self.tableName,
+                'rows': set(rowMap.keys()),
+                'columns': columns,
+                'parent': None,
+                'children': set([]),
+            }
+        }
+        self.parser['rowMap'] = rowMap
+        self.parser['indexed'] = {}
+        return True
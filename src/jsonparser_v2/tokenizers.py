@@ -0,0 +1,269 @@
+import re
+import ujson
+from abc import ABC
+from abc import abstractmethod
+
+try:
+    import jsonstreamer as jss
+except (ImportError, AttributeError):
+    # jsonstreamer needs a yajl build, and its event library does not
+    # import on recent Pythons.
+    jss = None
+
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
+
+class Tokenizer(ABC):
+
+    # Tokenizers are push parsers, which turn chunks of JSON text into the
+    # events of jsonstreamer and call them on a listener, as _on_<event>
+    # methods. Scalars are values in objects and elements in arrays, and
+    # as with jsonstreamer, only numbers made of digits are int, so
+    # negative integers are floats. The doc_end event is left to the
+    # listener.
+    name = None
+    events = ('doc_start', 'doc_end', 'object_start', 'object_end',
+              'array_start', 'array_end', 'key', 'value', 'element')
+
+    @classmethod
+    def isAvailable(cls):
+        return True
+
+    def __init__(self, listener):
+        self.listener = listener
+        self.isStarted = False
+        for event in self.events:
+            setattr(self, 'on' + ''.join(part.title() for part in event.split('_')),
+                    getattr(listener, '_on_' + event, self.ignore))
+
+    def ignore(self, *args):
+        pass
+
+    @abstractmethod
+    def consume(self, chunk):
+        pass
+
+    def close(self):
+        pass
+
+
+class JsonStreamerTokenizer(Tokenizer):
+
+    name = 'jsonstreamer'
+
+    @classmethod
+    def isAvailable(cls):
+        return not jss is None
+
+    def __init__(self, listener):
+        super().__init__(listener)
+        self.streamer = jss.JSONStreamer()
+        self.streamer.auto_listen(listener)
+
+    def consume(self, chunk):
+        self.streamer.consume(chunk)
+
+
+class IjsonTokenizer(Tokenizer):
+
+    # ijson with the fastest of its backends, yajl2_c if it is built. Only
+    # used when configured, since yajl2_c fails on integers beyond 64 bits,
+    # which jsonstreamer parses.
+    name = 'ijson'
+    backendNames = ('yajl2_c', 'yajl2_cffi', 'yajl2', 'python')
+
+    @classmethod
+    def getBackend(cls):
+        if ijson is None:
+            return None
+        for backendName in cls.backendNames:
+            try:
+                return ijson.get_backend(backendName)
+            except ImportError:
+                continue
+        return None
+
+    @classmethod
+    def isAvailable(cls):
+        return not cls.getBackend() is None
+
+    def __init__(self, listener):
+        super().__init__(listener)
+        self.parsed = ijson.sendable_list()
+        self.coro = self.getBackend().basic_parse_coro(self.parsed, use_float=True)
+        self.isObjects = []
+
+    def dispatch(self):
+        isObjects = self.isObjects
+        for event, val in self.parsed:
+            if event == 'map_key':
+                self.onKey(val)
+            elif event == 'start_map':
+                isObjects.append(True)
+                self.onObjectStart()
+            elif event == 'end_map':
+                isObjects.pop()
+                self.onObjectEnd()
+            elif event == 'start_array':
+                isObjects.append(False)
+                self.onArrayStart()
+            elif event == 'end_array':
+                isObjects.pop()
+                self.onArrayEnd()
+            else:
+                if type(val) is int and val < 0:
+                    val = float(val)
+                if isObjects[-1]:
+                    self.onValue(val)
+                else:
+                    self.onElement(val)
+        del self.parsed[:]
+
+    def consume(self, chunk):
+        if not self.isStarted:
+            self.isStarted = True
+            self.onDocStart()
+        self.coro.send(chunk.encode('utf-8') if isinstance(chunk, str) else chunk)
+        self.dispatch()
+
+    def close(self):
+        self.coro.close()
+        self.dispatch()
+
+
+class PythonTokenizer(Tokenizer):
+
+    # A regular expression tokenizer without dependencies. Numbers and
+    # literals at the end of a chunk, and strings cut by it, are kept until
+    # the next chunk. The token that may come next is tracked, so values
+    # without separators, keys without colons and trailing commas are
+    # rejected.
+    name = 'python'
+    tokenPattern = re.compile(
+        r'[ \t\r\n]*(?:([{}\[\]:,])|"([^"\\]*(?:\\.[^"\\]*)*)"|(-?[0-9][-+.0-9eE]*)|(true|false|null))')
+    literals = {'true': True, 'false': False, 'null': None}
+    tokenStarts = frozenset('{}[]:,"-0123456789tfn')
+
+    def __init__(self, listener):
+        super().__init__(listener)
+        self.pending = ''
+        self.isObjects = []
+        # One of value, valueOrClose, key, keyOrClose, colon, commaOrClose
+        # and end.
+        self.expected = 'value'
+
+    def expect(self, expected, token):
+        if not self.expected in expected:
+            raise ValueError('Invalid JSON, expected {} but got {}.'.format(
+                self.expected, repr(token)))
+
+    def endValue(self):
+        self.expected = 'commaOrClose' if len(self.isObjects) > 0 else 'end'
+
+    def scalar(self, val, token):
+        self.expect(('value', 'valueOrClose'), token)
+        if len(self.isObjects) > 0 and self.isObjects[-1]:
+            self.onValue(val)
+        else:
+            self.onElement(val)
+        self.endValue()
+
+    def tokenize(self, text, isFinal):
+        isObjects = self.isObjects
+        match = self.tokenPattern.match
+        pos = 0
+        end = len(text)
+        while True:
+            token = match(text, pos)
+            if token is None or (token.end() == end and not isFinal
+                                 and token.lastindex > 2):
+                break
+            pos = token.end()
+            punctuation, string, number, literal = token.groups()
+            if not punctuation is None:
+                if punctuation == ',':
+                    self.expect(('commaOrClose',), punctuation)
+                    self.expected = 'key' if isObjects[-1] else 'value'
+                elif punctuation == ':':
+                    self.expect(('colon',), punctuation)
+                    self.expected = 'value'
+                elif punctuation == '{':
+                    self.expect(('value', 'valueOrClose'), punctuation)
+                    isObjects.append(True)
+                    self.expected = 'keyOrClose'
+                    self.onObjectStart()
+                elif punctuation == '[':
+                    self.expect(('value', 'valueOrClose'), punctuation)
+                    isObjects.append(False)
+                    self.expected = 'valueOrClose'
+                    self.onArrayStart()
+                elif punctuation == '}':
+                    self.expect(('keyOrClose', 'commaOrClose'), punctuation)
+                    if not isObjects[-1]:
+                        raise ValueError('Invalid JSON, {} closes an array.'.format(repr(punctuation)))
+                    isObjects.pop()
+                    self.onObjectEnd()
+                    self.endValue()
+                else:
+                    self.expect(('valueOrClose', 'commaOrClose'), punctuation)
+                    if isObjects[-1]:
+                        raise ValueError('Invalid JSON, {} closes an object.'.format(repr(punctuation)))
+                    isObjects.pop()
+                    self.onArrayEnd()
+                    self.endValue()
+            elif not string is None:
+                if '\\' in string:
+                    string = ujson.loads('"' + string + '"')
+                if self.expected in ('key', 'keyOrClose'):
+                    self.expected = 'colon'
+                    self.onKey(string)
+                else:
+                    self.scalar(string, token.group())
+            elif not number is None:
+                self.scalar(int(number) if number.isdigit() else float(number), number)
+            else:
+                self.scalar(self.literals[literal], literal)
+
+        rest = text[pos:].lstrip(' \t\r\n')
+        if len(rest) > 0 and (isFinal or not rest[0] in self.tokenStarts):
+            raise ValueError('Invalid JSON at {}.'.format(repr(rest[:20])))
+        return rest
+
+    def consume(self, chunk):
+        if not self.isStarted:
+            self.isStarted = True
+            self.onDocStart()
+        self.pending = self.tokenize(self.pending + chunk, False)
+
+    def close(self):
+        self.pending = self.tokenize(self.pending, True)
+        if self.expected != 'end':
+            raise ValueError('Invalid JSON, the document is incomplete.')
+
+
+tokenizers = {
+    tokenizer.name: tokenizer
+    for tokenizer in (JsonStreamerTokenizer, PythonTokenizer, IjsonTokenizer)
+}
+
+# In order of preference, when no tokenizer is configured. The python
+# tokenizer stands in where jsonstreamer cannot be imported.
+defaultTokenizerNames = ('jsonstreamer', 'python')
+
+
+def getAvailableTokenizers():
+    return [name for name, tokenizer in tokenizers.items() if tokenizer.isAvailable()]
+
+
+def createTokenizer(name, listener):
+    if name is None:
+        name = next(name for name in defaultTokenizerNames if tokenizers[name].isAvailable())
+    if not name in tokenizers:
+        raise ValueError('Unknown tokenizer {}, choose one of {}.'.format(
+            name, ', '.join(tokenizers.keys())))
+    if not tokenizers[name].isAvailable():
+        raise ValueError('Tokenizer {} is not available.'.format(name))
+    return tokenizers[name](listener)
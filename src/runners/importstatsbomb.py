@@ -1,4 +1,6 @@
 import logging
+import os
+import hashlib
 from multiprocessing import Pool
 from .runner import Runner
 import zipfile as zf
@@ -6,24 +8,40 @@ import re
 import json
 import ramda as R
 import itertools
+from contextlib import nullcontext
 
 from contrib.p4thpymisc.src.consoleui import select
 
 from jsonparser_v2.parser import Parser
 from jsonparser_v2.persister import Persister
+from jsonparser_v2.parsecache import ParseCache
+from jsonparser_v2.session import ParseSession
+from jsonparser_v2.stringpool import stringPool
 
 
-def run1(cmdArgs):
-    cmdArgs = cmdArgs
-    retVal = cmdArgs[1]
-    cmdArgs = cmdArgs[0]
+def parse1(args):
+    # Parses the files of a match in a worker process and returns the
+    # results, which the parent process adds to one session.
+    cmdArgs, competitionId, seasonId, matchId = args
     _self = ImportStatsBombRunner(cmdArgs)
-    _self.execute()
-    return retVal
+    return [
+        {
+            'table': parseree['table'],
+            'result': parseree['parser'].getResult(),
+        } for parseree in _self.parseMatch(_self.zipfile, competitionId, seasonId, matchId)
+    ]
 
 
 class ImportStatsBombRunner(Runner):
 
+    # Columns that identify the records of each file. Three-sixty frames
+    # share the uuids of their events, and row ids are unique across all
+    # tables, so frames keep their hashes.
+    naturalKeys = {
+        'matches': 'match_id',
+        'events': 'id',
+    }
+
     def __init__(self, cmdArgs, *args, **kwargs):
         super().__init__(cmdArgs)
 
@@ -113,31 +131,37 @@ class ImportStatsBombRunner(Runner):
                 state['selectedMatches'] = select(
                     'Select matches:', matchMenuItems(state['matches']), countLimit=None)
                 continue
-            elif 'parserees' not in state:
-                res = self.parseMatches(
+            elif 'sessions' not in state:
+                state['sessions'] = self.parseMatches(
                     state['selectedCompetition']['competition_id'], state['selectedMatches'])
-                if res is None:
-                    return
-                state['parserees'] = res
-                continue
-            elif 'confirmed' not in state:
-                if 'confirmed' in state and state['confirmed'] is None:
-                    return
-                state['confirmed'] = self.reportTables(
-                    state['parserees'], quiet=self.quiet)
                 continue
-            self.persistTables(state['confirmed'])
-            break
+            # Each session of matches is reported and persisted before the
+            # next one is parsed.
+            parserees = next(state['sessions'], None)
+            if parserees is None:
+                break
+            confirmed = self.reportTables(parserees, quiet=self.quiet)
+            if len(confirmed) == 0:
+                break
+            self.persistTables(confirmed)
         print('')
 
     def persistTables(self, parserees):
         # overwrite = InputTools.createOverwriter()
         persiterees = {}
+        cacheDir = self.cmdArgs.get('cachedir', None)
         if self.sqlitefile:
             persiterees[self.sqlitefile] = Persister.sqliteCreate(
                 self.sqlitefile)
+            if not cacheDir is None:
+                persiterees[self.sqlitefile]['hashFilterPath'] = os.path.join(
+                    cacheDir, 'sqlite-{}.rowhashes'.format(hashlib.sha1(
+                        os.path.abspath(self.sqlitefile).encode('utf-8')).hexdigest()))
         if self.pgurl:
             persiterees[self.pgurl] = Persister.pgsqlCreate(self.pgurl)
+            if not cacheDir is None:
+                persiterees[self.pgurl]['hashFilterPath'] = os.path.join(
+                    cacheDir, 'pgsql-{}.rowhashes'.format(hashlib.sha1(self.pgurl.encode('utf-8')).hexdigest()))
 
         for index, parseree in enumerate(parserees):
             for type, persister in persiterees.items():
@@ -158,6 +182,8 @@ class ImportStatsBombRunner(Runner):
                 print('Summary for {}:\n'.format(table))
                 print('\n'.join(parser.report()))
             res.append(parser)
+        if not quiet:
+            print('\n'.join(stringPool.report()))
         persist = quiet or select('Persist data?', {
             'Yes': True,
             'No': False,
@@ -167,19 +193,50 @@ class ImportStatsBombRunner(Runner):
         return res
 
     def parseMatches(self, competitionId, selectedMatches):
-
-        res = []
-        if len(selectedMatches) < 2:
-            # overwrite = InputTools.createOverwriter()
-            for index, match in enumerate(selectedMatches):
+        # Yields the parsed files of the selected matches in sessions of
+        # at most sessionsize matches. A session is parsed when the one
+        # before it is persisted, so memory is bounded by a session rather
+        # than by all selected matches.
+        sessionSize = max(1, self.cmdArgs.get('sessionsize', None) or 10)
+        rowBudget = self.cmdArgs.get('rowbudget', None)
+        with (Pool(processes=5) if len(selectedMatches) > 1 else nullcontext()) as pool:
+            for start in range(0, len(selectedMatches), sessionSize):
+                matches = selectedMatches[start:start + sessionSize]
+
+                # Shared rows (teams, players, positions, ...) are persisted
+                # once for all files of the matches instead of once per file.
+                session = ParseSession({
+                    'config': {
+                        'fileName': ', '.join([str(m['match_id']) for m in matches]),
+                        **({} if rowBudget is None else {
+                            'rowStore': 'spill',
+                            'rowStoreBudget': rowBudget,
+                        }),
+                    }
+                })
+                tables = []
+                for parserees in self.parseMatchFiles(pool, competitionId, matches):
+                    for parseree in parserees:
+                        tables.append(parseree['table'])
+                        session.add(parseree['parser'])
+                session.compact()
+                yield [{
+                    'table': ', '.join(tables),
+                    'parser': session,
+                }]
+
+    def parseMatchFiles(self, pool, competitionId, matches):
+        # Yields the parsed files of each match, in order. With a pool, the
+        # matches are parsed in worker processes and their results are taken
+        # one at a time.
+        if pool is None:
+            for index, match in enumerate(matches):
                 prefix = 'Parsing Match {}/{}/{}. File {}/{}: '\
                     .format(competitionId, match['season']['season_id'], match['match_id'], index+1,
-                            len(selectedMatches))
-                res = res + self.parseMatch(self.zipfile, competitionId,  match['season']['season_id'],  match['match_id'],
-                                            statusPrefix=prefix  # ,
-                                            # overwrite=overwrite
-                                            )
-            return res
+                            len(matches))
+                yield self.parseMatch(self.zipfile, competitionId, match['season']['season_id'], match['match_id'],
+                                      statusPrefix=prefix)
+            return
 
         def matchPath(cid, m):
             return '{}/{}/{}'.format(competitionId, m['season']['season_id'],  m['match_id'])
@@ -189,34 +246,67 @@ class ImportStatsBombRunner(Runner):
                 **R.omit('statusBar')(self.cmdArgs),
                 **{
                     'quiet': True,
-                    'matchpath': matchPath(competitionId, m)
                 }
             },
-            self.showStatus('Processing match {} ({}) in child process.'.format(
-                self.formatMatch(m, skipProps=True), matchPath(competitionId, m)))
+            competitionId, m['season']['season_id'], m['match_id']
         )
-            for m in selectedMatches
+            for m in matches
         ]
-
-        with Pool(processes=5) as p:
-            statusIds = p.map(run1, args)
+        statusIds = [
+            self.showStatus('Parsing match {} ({}) in child process.'.format(
+                self.formatMatch(m, skipProps=True), matchPath(competitionId, m)))
+            for m in matches
+        ]
+        try:
+            for statusId, results in zip(statusIds, pool.imap(parse1, args)):
+                self.hideStatus(statusId)
+                yield [
+                    {
+                        'table': parseree['table'],
+                        'parser': Parser.fromResult(parseree['result']),
+                    } for parseree in results
+                ]
+        finally:
             for statusId in statusIds:
                 self.hideStatus(statusId)
-        return None
 
     def parseMatch(self, zipPath, competitionId, seasonId, matchId, statusPrefix=''
                    # , overwrite=None
                    ):
 
-        def parseFile(table, f):
-            parser = Parser({
+        cacheDir = self.cmdArgs.get('cachedir', None)
+        cache = None if cacheDir is None else ParseCache(
+            os.path.join(cacheDir, 'parsed'),
+            maxBytes=self.cmdArgs.get('cachesize', 1024) * 1024 * 1024)
+
+        rowBudget = self.cmdArgs.get('rowbudget', None)
+        eventTypes = self.cmdArgs.get('eventtype', None) or None
+        eventIds = None
+
+        def createParser(table, elementFilter=None):
+            return Parser({
                 'config': {
                     'rootTableName': table,
-                    'encoding': 'utf-8'
+                    'encoding': 'utf-8',
+                    'engine': 'threesixty' if table == 'threesixty' else 'tree',
+                    'schemaPlanDir': None if cacheDir is None else os.path.join(cacheDir, 'plans'),
+                    'flattenArrayLength': self.cmdArgs.get('flattenarrays', 0),
+                    'rowEncoding': self.cmdArgs.get('rowencoding', 'json'),
+                    'includeKeyPaths': self.cmdArgs.get('include', None) or None,
+                    'excludeKeyPaths': self.cmdArgs.get('exclude', None) or None,
+                    'elementFilter': elementFilter,
+                    'referenceColumns': ('id', 'name') if self.cmdArgs.get('references', False) else None,
+                    'naturalKeys': self.naturalKeys if self.cmdArgs.get('naturalkeys', False) else None,
+                    'workers': self.cmdArgs.get('parseworkers', 1),
+                    # Parsed files are kept until all selected matches are
+                    # persisted, so they are kept compacted.
+                    'storage': 'columnar',
+                    **({} if rowBudget is None else {
+                        'rowStore': 'spill',
+                        'rowStoreBudget': rowBudget,
+                    }),
                 }
             })
-            parser.parse(f)
-            return parser
 
         filePaths = {
             'matches': 'open-data-master/data/matches/{}/{}.json'.format(competitionId, seasonId),
@@ -231,19 +321,61 @@ class ImportStatsBombRunner(Runner):
         res = []
         with zf.ZipFile(zipPath, 'r') as files:
             for table, filePath in filePaths.items():
+                # With event types, only those events and their frames are
+                # parsed.
+                elementFilter = None
+                if not eventTypes is None and table == 'events':
+                    elementFilter = {'type.name': set(eventTypes)}
+                elif not eventIds is None and table == 'threesixty':
+                    elementFilter = {'event_uuid': eventIds}
+                parser = createParser(table, elementFilter)
+
+                cacheKey = None
+                if not cache is None:
+                    info = files.getinfo(filePath)
+                    cacheKey = cache.getKey(table, info.CRC, info.file_size, options={
+                        'flattenArrayLength': parser.configee['flattenArrayLength'],
+                        'engine': parser.configee['engine'],
+                        'rowEncoding': parser.configee['rowEncoding'],
+                        'includeKeyPaths': parser.configee['includeKeyPaths'],
+                        'excludeKeyPaths': parser.configee['excludeKeyPaths'],
+                        'eventTypes': None if eventTypes is None else sorted(eventTypes),
+                        'referenceColumns': parser.configee['referenceColumns'],
+                        'naturalKeys': parser.configee['naturalKeys'],
+                    })
+                    if cache.load(cacheKey, parser):
+                        parser.configee['fileName'] = filePath
+                        res.append({
+                            'table': table,
+                            'parser': parser,
+                        })
+                        if table == 'events' and not eventTypes is None:
+                            eventIds = self.getEventIds(parser)
+                        continue
 
                 with files.open(filePath, 'r') as f:
                     statusId = self.showStatus('{statusPrefix}Parsing {filePath}'.format(
                         statusPrefix=statusPrefix, filePath=filePath))
                     try:
+                        parser.parse(f)
                         res.append({
                             'table': table,
-                            'parser': parseFile(table, f),
+                            'parser': parser,
                         })
                     finally:
                         self.hideStatus(statusId)
+
+                if table == 'events' and not eventTypes is None:
+                    eventIds = self.getEventIds(parser)
+                if not cacheKey is None:
+                    cache.store(cacheKey, parser)
         return res
 
+    def getEventIds(self, parser):
+        return set([
+            parser['rowMap'][rowId]['id'] for rowId in parser['tableMap']['events']['rows']
+        ])
+
     def extractCompetitions(self, zipPath):
         with zf.ZipFile(zipPath, 'r') as files:
             with files.open('open-data-master/data/competitions.json') as cs:
@@ -0,0 +1,31 @@
+import ujson
+
+from src.jsonparser_v2.parser import Parser
+
+import unittest
+
+
+class ParserTestCase(unittest.TestCase):
+
+    # Parses the data of a test class, or other data, with the config of
+    # the class updated by the config of the call. Lists and dicts are
+    # dumped to JSON first, other data is parsed as it is. Tests of both
+    # engines run each of them as a subtest.
+    rootTableName = 'events'
+    config = {}
+    engines = ('stream', 'tree')
+
+    def createParser(self, **config):
+        return Parser({
+            'config': {
+                'rootTableName': self.rootTableName,
+                **self.config,
+                **config,
+            }
+        })
+
+    def parse(self, data=None, **config):
+        data = self.data if data is None else data
+        parser = self.createParser(**config)
+        parser.parse(ujson.dumps(data) if isinstance(data, (list, dict)) else data)
+        return parser
@@ -0,0 +1,83 @@
+from src.jsonparser_v2.columnar import ColumnarColumn
+from src.jsonparser_v2.columnar import ColumnarIndexees
+from test.jsonparser_v2.parsertestcase import ParserTestCase
+
+import unittest
+
+
+class TestColumnar(ParserTestCase):
+
+    rootTableName = 'parents'
+    data = [
+        {
+            'id': 1,
+            'name': 'Kalle',
+            'height': 1.85,
+            'children': ['Albert', 'Herbert'],
+        },
+        {
+            'id': 2,
+            'name': 'Karin',
+            'active': True,
+            'children': ['Maja']
+        },
+        {
+            'id': 3,
+            'name': None,
+            'height': 1.65,
+            'children': []
+        },
+    ]
+
+    def testColumns(self):
+        column = ColumnarColumn.create([1, 2, 3])
+        self.assertEqual('int', column.kind)
+        column = ColumnarColumn.create([1.5, 2.0])
+        self.assertEqual('float', column.kind)
+        column = ColumnarColumn.create([1, 2.0])
+        self.assertEqual('dict', column.kind)
+        self.assertEqual(1, column.get(0))
+        self.assertIs(int, type(column.get(0)))
+        self.assertIs(float, type(column.get(1)))
+        column = ColumnarColumn.create(['a', True, 'a', None])
+        self.assertEqual('dict', column.kind)
+        self.assertEqual(3, len(column.dictionary))
+        self.assertEqual(['a', True, 'a', None],
+                         [column.get(i) for i in range(4)])
+
+    def testChildIds(self):
+        relations = [{'a': 1, 'b': 2}, {'a': 3, 'b': 5}, {'a': 1, 'b': 4}]
+        indexees = ColumnarIndexees(('a', 'b'), relations)
+        self.assertListEqual([2, 4], indexees.getChildIds(1))
+        self.assertListEqual([], indexees.getChildIds('x'))
+        # Natural ids among hashes.
+        indexees = ColumnarIndexees(('a', 'b'), relations + [{'a': 'x', 'b': 6}])
+        self.assertListEqual([2, 4], indexees.getChildIds(1))
+        self.assertListEqual([6], indexees.getChildIds('x'))
+
+    def testEqualOutput(self):
+        dictParser = self.parse(storage='dict')
+        parser = self.parse(storage='columnar')
+
+        self.assertEqual(len(dictParser['rowMap']), len(parser['rowMap']))
+        for rowId, row in dictParser['rowMap'].items():
+            self.assertEqual(row, parser['rowMap'][rowId])
+
+        self.assertEqual(set(dictParser['tableMap'].keys()),
+                         set(parser['tableMap'].keys()))
+        for name, table in dictParser['tableMap'].items():
+            self.assertSetEqual(table['rows'],
+                                set(parser['tableMap'][name]['rows']))
+            self.assertSetEqual(table['columns'],
+                                parser['tableMap'][name]['columns'])
+
+        self.assertEqual(set(dictParser['indexed'].keys()),
+                         set(parser['indexed'].keys()))
+        for pair, indexees in dictParser['indexed'].items():
+            self.assertEqual(list(indexees), list(parser['indexed'][pair]))
+
+        self.assertEqual(dictParser.report(), parser.report())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,66 @@
+import os
+import tempfile
+
+from src.jsonparser_v2.hashfilter import RowHashFilter
+
+import unittest
+
+
+class TestRowHashFilter(unittest.TestCase):
+
+    def testContains(self):
+        hashFilter = RowHashFilter.create(capacity=1000, errorRate=1e-4)
+        ids = [2 ** 64 - 1 - i * 7919 for i in range(500)] + ['a', 'b']
+        hashFilter.add(ids, tableName='events')
+        self.assertTrue(hashFilter.contains(ids).all())
+        self.assertEqual(502, len(hashFilter))
+
+        others = list(range(10000)) + ['c']
+        self.assertLess(hashFilter.contains(others).sum(), 10)
+
+    def testSave(self):
+        hashFilter = RowHashFilter.create(capacity=100)
+        hashFilter.add([1, 2, 3], tableName='events')
+        with tempfile.TemporaryDirectory() as dirPath:
+            path = os.path.join(dirPath, 'db.rowhashes')
+            hashFilter.save(path)
+            loaded = RowHashFilter.load(path)
+        self.assertEqual(['events'], loaded.tableNames)
+        self.assertEqual(3, len(loaded))
+        self.assertEqual([True, True, True],
+                         loaded.contains([1, 2, 3]).tolist())
+        self.assertTrue((hashFilter.bits == loaded.bits).all())
+
+    def testSaveMerged(self):
+        # Filters loaded before either is saved, as by parallel importers.
+        first = RowHashFilter.create(capacity=1000)
+        second = RowHashFilter.create(capacity=1000)
+        first.add(list(range(100)), tableName='events')
+        second.add(list(range(50, 150)), tableName='lineups')
+        with tempfile.TemporaryDirectory() as dirPath:
+            path = os.path.join(dirPath, 'db.rowhashes')
+            first.saveMerged(path)
+            second.saveMerged(path)
+            loaded = RowHashFilter.load(path)
+
+            self.assertTrue(loaded.contains(list(range(150))).all())
+            self.assertEqual(['lineups', 'events'], loaded.tableNames)
+            self.assertLess(abs(len(loaded) - 150), 5)
+
+            # A filter of another size adds its ids to the stored one.
+            other = RowHashFilter.create(capacity=10)
+            other.add([1000], tableName='matches')
+            saved = other.saveMerged(path)
+            loaded = RowHashFilter.load(path)
+            self.assertTrue(loaded.isCompatible(first))
+            self.assertTrue(saved.isCompatible(first))
+            self.assertTrue(loaded.contains(list(range(150)) + [1000]).all())
+            self.assertEqual(['lineups', 'events', 'matches'], loaded.tableNames)
+
+    def testCapacity(self):
+        hashFilter = RowHashFilter.create()
+        self.assertLess(hashFilter.bitCount // 8, 3 * 1000 * 1000)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,60 @@
+from src.jsonparser_v2.parser import Parser
+from src.jsonparser_v2.parallel import ParallelEngine
+from test.jsonparser_v2.parsertestcase import ParserTestCase
+
+import unittest
+
+
+class TestParallelEngine(ParserTestCase):
+
+    data = [
+        {'id': i, 'name': 'Player "{}" ]}}'.format(i % 3), 'location': [i, 1.5],
+         'team': {'id': i % 2, 'name': 'Team \\{}'.format(i % 2)},
+         'tags': ['a', 'b'] if i % 4 == 0 else []}
+        for i in range(40)
+    ]
+
+    def setUp(self):
+        self.minRangeSize = ParallelEngine.minRangeSize
+        ParallelEngine.minRangeSize = 64
+
+    def tearDown(self):
+        ParallelEngine.minRangeSize = self.minRangeSize
+
+    def getRelations(self, parser):
+        return {
+            pair: list(indexees) for pair, indexees in parser['indexed'].items()
+        }
+
+    def assertSameParse(self, data, **config):
+        parser = self.parse(data, workers=1, **config)
+        parallelParser = self.parse(data, workers=3, **config)
+        self.assertDictEqual(parser['rowMap'], parallelParser['rowMap'])
+        self.assertDictEqual(parser['tableMap'], parallelParser['tableMap'])
+        self.assertDictEqual(self.getRelations(parser), self.getRelations(parallelParser))
+
+    def testFindElements(self):
+        engine = ParallelEngine(Parser({'config': {'workers': 3}}))
+        text = ' [{"a": "]\\\\"}, [1, {"b": "\\"["}] ,{}]\n'
+        elements = engine.findElements(text.encode('utf-8'))
+        self.assertListEqual(['{"a": "]\\\\"}', '[1, {"b": "\\"["}]', '{}'],
+                             [text[start:end] for start, end in elements])
+        self.assertIsNone(engine.findElements(b'[{"a": 1}, 2]'))
+        self.assertIsNone(engine.findElements(b'{"a": [{"b": 1}]}'))
+        self.assertIsNone(engine.findElements(b'[{"a": 1}'))
+
+    def testSameAsSequential(self):
+        self.assertSameParse(self.data)
+        self.assertSameParse(self.data, engine='tree', flattenArrayLength=2)
+        self.assertSameParse(self.data, engine='tree', referenceColumns=('id', 'name'),
+                             naturalKeys={'events': 'id'})
+
+    def testRowsAcrossElements(self):
+        # Elements that do not open with a key of the element before are
+        # rows of their own only within a range, so the parser falls back.
+        data = [{'a': i} if i % 2 == 0 else {'b': i} for i in range(40)]
+        self.assertSameParse(data)
+
+
+if __name__ == '__main__':
+    unittest.main()
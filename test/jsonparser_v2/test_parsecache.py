@@ -0,0 +1,82 @@
+import os
+import tempfile
+
+from src.jsonparser_v2.parsecache import ParseCache
+from test.jsonparser_v2.parsertestcase import ParserTestCase
+
+import unittest
+
+
+class TestParseCache(ParserTestCase):
+
+    rootTableName = 'parents'
+    data = [
+        {
+            'id': 1,
+            'name': 'Kalle',
+            'height': 1.85,
+            'weight': 0.1 + 0.2,
+            'children': ['Albert', 'Herbert'],
+            'position': {'id': 3, 'name': 'Left Back'},
+        },
+        {
+            'id': 2,
+            'name': 'Karin',
+            'active': True,
+            'children': ['Maja'],
+            'position': {'id': 3, 'name': 'Left Back'},
+        },
+    ]
+
+    def testRoundTrip(self):
+        self.assertRoundTrip({})
+
+    def testNaturalIds(self):
+        self.assertRoundTrip({
+            'naturalKeys': {'parents': 'id'},
+            'referenceColumns': ('id', 'name'),
+        })
+
+    def assertRoundTrip(self, config):
+        with tempfile.TemporaryDirectory() as cacheDir:
+            cache = ParseCache(cacheDir)
+            key = cache.getKey('parents', 0x1234abcd, 100)
+            self.assertFalse(cache.load(key, self.createParser(**config)))
+
+            dictParser = self.parse(**config)
+            self.assertTrue(cache.store(key, dictParser))
+            parser = self.createParser(**config)
+            self.assertTrue(cache.load(key, parser))
+
+            self.assertEqual(len(dictParser['rowMap']), len(parser['rowMap']))
+            for rowId, row in dictParser['rowMap'].items():
+                self.assertEqual(row, parser['rowMap'][rowId])
+            for name, table in dictParser['tableMap'].items():
+                self.assertSetEqual(table['rows'],
+                                    set(parser['tableMap'][name]['rows']))
+                self.assertSetEqual(table['columns'],
+                                    parser['tableMap'][name]['columns'])
+                self.assertEqual(table['parent'],
+                                 parser['tableMap'][name]['parent'])
+            for pair, indexees in dictParser['indexed'].items():
+                self.assertEqual(list(indexees), list(parser['indexed'][pair]))
+
+    def testEvict(self):
+        with tempfile.TemporaryDirectory() as cacheDir:
+            cache = ParseCache(cacheDir)
+            parser = self.parse()
+            keys = [cache.getKey('parents', crc, 100) for crc in range(3)]
+            for i, key in enumerate(keys):
+                cache.store(key, parser)
+                os.utime(cache.getPath(key), (i, i))
+            cache.load(keys[0], self.createParser())
+
+            cache.maxBytes = 2 * os.path.getsize(cache.getPath(keys[0]))
+            cache.evict()
+            self.assertTrue(os.path.exists(cache.getPath(keys[0])))
+            self.assertFalse(os.path.exists(cache.getPath(keys[1])))
+            self.assertTrue(os.path.exists(cache.getPath(keys[2])))
+
+
+if __name__ == '__main__':
+    unittest.main()
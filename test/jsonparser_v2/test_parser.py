@@ -1,19 +1,33 @@
 import logging
+import tempfile
 from uuid import uuid4
 import ujson
 import ramda as R
 import testing.postgresql
 
 from src.jsonparser_v2.parser import Parser
+from src.jsonparser_v2.parser import Indexees
 from src.jsonparser_v2.persister import Persister
 
 from contrib.p4thpydb.db.pgsql.db import DB as PGSQLDB
+from test.jsonparser_v2.parsertestcase import ParserTestCase
 
 import unittest
 
 
 class TestParser(unittest.TestCase):
 
+    engine = 'stream'
+
+    def createParser(self, row):
+        return Parser({
+            **row,
+            'config': {
+                **row['config'],
+                'engine': self.engine,
+            }
+        })
+
     def setUp(self):
         self.pgSchema = str(uuid4())
         self.postgresql = testing.postgresql.Postgresql()
@@ -42,7 +56,7 @@ class TestParser(unittest.TestCase):
             },
         ]
 
-        parseree = Parser({
+        parseree = self.createParser({
             'config': {
                 'rootTableName': 'parents',
                 'encoding': 'utf-8',
@@ -106,7 +120,7 @@ class TestParser(unittest.TestCase):
         ]
 
         # logging.getLogger().setLevel(logging.DEBUG)
-        parser = Parser({
+        parser = self.createParser({
             'config': {
                 'rootTableName': 'parents',
                 'encoding': 'utf-8'
@@ -260,7 +274,7 @@ class TestParser(unittest.TestCase):
             },
         ]
 
-        parser = Parser({
+        parser = self.createParser({
             'config': {
                 'rootTableName': 'event',
                 'encoding': 'utf-8'
@@ -320,7 +334,7 @@ class TestParser(unittest.TestCase):
         ]
 
         # logging.getLogger().setLevel(logging.DEBUG)
-        parser = Parser({
+        parser = self.createParser({
             'config': {
                 'rootTableName': 'objects',
                 'encoding': 'utf-8'
@@ -419,7 +433,7 @@ class TestParser(unittest.TestCase):
             },
         ]
         # logging.getLogger().setLevel(logging.DEBUG)
-        parser = Parser({'config': {
+        parser = self.createParser({'config': {
             'rootTableName': 'parents',
             'encoding': 'utf-8'
         }})
@@ -554,7 +568,7 @@ class TestParser(unittest.TestCase):
                 ],
             },
         ]
-        parser = Parser({
+        parser = self.createParser({
             'config': {
                 'rootTableName': 'parents',
                 'encoding': 'utf-8'
@@ -610,7 +624,7 @@ class TestParser(unittest.TestCase):
             },
         ]
 
-        parser = Parser({
+        parser = self.createParser({
             'config': {
                 'rootTableName': 'parents',
                 'encoding': 'utf-8'
@@ -777,6 +791,436 @@ class TestParser(unittest.TestCase):
             self.assertEqual(1, row['car_index'])
 
 
+class TestParserTreeEngine(TestParser):
+
+    engine = 'tree'
+
+
+class TestParserInput(ParserTestCase):
+
+    rootTableName = 'parents'
+    config = {'encoding': 'utf-8'}
+    data = [
+        {'id': 1, 'name': 'Kålle'},
+        {'id': 2, 'name': 'Kärin'},
+    ]
+
+    def assertParsed(self, parser):
+        self.assertEqual(2, len(parser['tableMap']['parents']['rows']))
+        self.assertSetEqual(set(['Kålle', 'Kärin']), set([
+            row['name'] for row in parser['rowMap'].values()
+        ]))
+
+    def testByteChunks(self):
+        data = ujson.dumps(self.data, ensure_ascii=False).encode('utf-8')
+        # Chunks of 3 bytes split the two byte characters.
+        chunks = [data[i:i + 3] for i in range(0, len(data), 3)]
+        self.assertParsed(self.parse(iter(chunks)))
+
+    def testTreeEngine(self):
+        data = ujson.dumps(self.data, ensure_ascii=False).encode('utf-8')
+        chunks = [data[i:i + 3] for i in range(0, len(data), 3)]
+        self.assertParsed(self.parse(iter(chunks), engine='tree'))
+
+    def testFile(self):
+        data = ujson.dumps(self.data, ensure_ascii=False).encode('utf-8')
+        with tempfile.NamedTemporaryFile(suffix='.json') as f:
+            f.write(data)
+            f.flush()
+            with open(f.name, 'rb') as f2:
+                parser = self.parse(f2, bufferSize=5)
+            self.assertEqual(f.name, parser.configee['fileName'])
+        self.assertParsed(parser)
+
+    def testNdjson(self):
+        data = '\n'.join([ujson.dumps(element, ensure_ascii=False) for element in self.data])
+        data = ('\n' + data + '\n\n').encode('utf-8')
+        chunks = [data[i:i + 3] for i in range(0, len(data), 3)]
+        parser = self.parse(iter(chunks), input='ndjson')
+        self.assertParsed(parser)
+        self.assertSetEqual(set(self.parse(ujson.dumps(self.data))['rowMap'].keys()),
+                            set(parser['rowMap'].keys()))
+
+        emitted = []
+        self.parse(data, input='ndjson', sink=lambda parser: emitted.append(
+            len(parser['tableMap']['parents']['rows'])))
+        self.assertListEqual([1, 1], emitted)
+
+
+class TestParserReduce(ParserTestCase):
+
+    data = [
+        {'id': 1, 'outer': {'inner': {'a': 1}}},
+        {'id': 2, 'outer': {'inner': {'a': 1}}},
+    ]
+
+    def testReduce(self):
+        for engine in self.engines:
+            with self.subTest(engine=engine):
+                parser = self.parse(engine=engine)
+                self.assertSetEqual(set(['events', 'outer']), set(parser['tableMap'].keys()))
+                self.assertEqual(1, len(parser['tableMap']['outer']['rows']))
+
+                parser = self.parse(engine=engine, reduce='tables')
+                self.assertSetEqual(set(['events', 'outer']), set(parser['tableMap'].keys()))
+                self.assertEqual(2, len(parser['tableMap']['outer']['rows']))
+
+                parser = self.parse(engine=engine, reduce=None)
+                self.assertSetEqual(set(['events', 'outer', 'inner']),
+                                    set(parser['tableMap'].keys()))
+                self.assertEqual(6, len(parser['rowMap']))
+
+
+class TestParserStreaming(ParserTestCase):
+
+    rootTableName = 'parents'
+    data = [
+        {'id': 1, 'name': 'Kalle', 'children': ['Albert', 'Herbert']},
+        {'id': 2, 'name': 'Karin', 'children': ['Maja']},
+        {'id': 3, 'name': 'Kasper', 'children': []},
+    ]
+
+    def testSink(self):
+        for engine in self.engines:
+            with self.subTest(engine=engine):
+                emitted = []
+
+                def sink(parser):
+                    emitted.append({
+                        name: {rowId: parser['rowMap'][rowId] for rowId in table['rows']}
+                        for name, table in parser['tableMap'].items()
+                    })
+
+                parser = self.parse(self.data, engine=engine, sink=sink)
+                self.assertEqual(0, len(parser['rowMap']))
+                self.assertEqual(3, len(emitted))
+                self.assertEqual(
+                    ['Kalle', 'Karin', 'Kasper'],
+                    [list(e['parents'].values())[0]['name'] for e in emitted])
+
+                # Each element is reduced on its own, as if it was parsed alone.
+                for element, rows in zip(self.data, emitted):
+                    single = self.parse([element], engine=engine)
+                    self.assertEqual(set(single['rowMap'].keys()), set().union(
+                        *[tableRows.keys() for tableRows in rows.values()]))
+
+    def testObject(self):
+        emitted = []
+        self.parse(self.data[0], sink=lambda parser: emitted.append(
+            len(parser['rowMap'])))
+        self.assertEqual([3], emitted)
+
+    def testCollapsed(self):
+        # Collapses are decided by the schema plan of an earlier parse.
+        data = [
+            {'id': 1, 'outer': {'inner': {'a': 1}}},
+            {'id': 2, 'outer': {'inner': {'a': 1}}},
+        ]
+        with tempfile.TemporaryDirectory() as planDir:
+            for engine in self.engines:
+                with self.subTest(engine=engine):
+                    rowIds = set()
+                    sink = lambda parser: rowIds.update(parser['rowMap'].keys())
+                    with self.assertRaises(ValueError):
+                        self.parse(data, engine=engine, sink=sink)
+
+                    parser = self.parse(data, engine=engine, schemaPlanDir=planDir)
+                    rowIds.clear()
+                    self.parse(data, engine=engine, schemaPlanDir=planDir, sink=sink)
+                    self.assertSetEqual(set(parser['rowMap'].keys()), rowIds)
+
+
+class TestParserFlatten(ParserTestCase):
+
+    config = {'flattenArrayLength': 3}
+    data = [
+        {'id': 1, 'location': [10.5, 20], 'shot': {'end_location': [1, 2, 3.5]}},
+        {'id': 2, 'location': [1.5, -2.5], 'coords': [[1, 2], [3, 4]]},
+        {'id': 3, 'location': [1.5, 'x'], 'ids': [1, 2, 3, 4]},
+    ]
+
+    def testFlatten(self):
+        for engine in self.engines:
+            with self.subTest(engine=engine):
+                parser = self.parse(engine=engine)
+                rows = sorted([parser['rowMap'][rowId] for rowId in parser['tableMap']['events']['rows']],
+                              key=lambda row: row['id'])
+                self.assertEqual((10.5, 20), (rows[0]['location_0'], rows[0]['location_1']))
+                self.assertEqual((1.5, -2.5), (rows[1]['location_0'], rows[1]['location_1']))
+                self.assertFalse('location_0' in rows[2])
+
+                shot = parser['rowMap'][list(parser['tableMap']['shot']['rows'])[0]]
+                self.assertEqual([1, 2, 3.5], [shot['end_location_{}'.format(i)] for i in range(3)])
+                self.assertFalse('end_location' in parser['tableMap'])
+
+                # Mixed, nested and long arrays are kept as child tables.
+                self.assertEqual(2, len(parser['tableMap']['location']['rows']))
+                self.assertTrue('coords' in parser['tableMap'])
+                self.assertEqual(4, len(parser['tableMap']['ids']['rows']))
+
+
+class TestParserKeyPaths(ParserTestCase):
+
+    data = [
+        {
+            'id': 1,
+            'type': {'id': 35, 'name': 'Starting XI'},
+            'tactics': {
+                'formation': 442,
+                'lineup': [
+                    {'player': {'id': 7, 'name': 'Kalle'}, 'jersey_number': 9},
+                    {'player': {'id': 8, 'name': 'Karin'}, 'jersey_number': 10},
+                ],
+            },
+        },
+        {'id': 2, 'type': {'id': 30, 'name': 'Pass'}, 'location': [1, 2]},
+    ]
+
+    def testExclude(self):
+        for engine in self.engines:
+            with self.subTest(engine=engine):
+                parser = self.parse(engine=engine, excludeKeyPaths=['events.tactics.lineup', 'events.location'])
+                self.assertSetEqual(set(['events', 'type', 'tactics']), set(parser['tableMap'].keys()))
+                tactics = parser['rowMap'][list(parser['tableMap']['tactics']['rows'])[0]]
+                self.assertEqual(442, tactics['formation'])
+                self.assertEqual(2, len(parser['tableMap']['events']['rows']))
+
+    def testInclude(self):
+        for engine in self.engines:
+            with self.subTest(engine=engine):
+                parser = self.parse(engine=engine, includeKeyPaths=['events.id', 'events.tactics.line*.jersey_*'])
+                self.assertSetEqual(set(['events', 'tactics', 'lineup']),
+                                    set(parser['tableMap'].keys()))
+                self.assertSetEqual(set(['__id', 'id']), parser['tableMap']['events']['columns'])
+                self.assertSetEqual(set(['__id']), parser['tableMap']['tactics']['columns'])
+                self.assertSetEqual(set(['__id', 'jersey_number']),
+                                    parser['tableMap']['lineup']['columns'])
+
+    def testOtherRoot(self):
+        parser = self.parse(includeKeyPaths=['matches.id'])
+        self.assertTrue('tactics' in parser['tableMap'])
+
+
+class TestParserElementFilter(ParserTestCase):
+
+    data = [
+        {'id': 1, 'type': {'id': 35, 'name': 'Starting XI'},
+         'tactics': {'formation': 442, 'lineup': [{'jersey_number': 9}, {'jersey_number': 10}]}},
+        {'id': 2, 'location': [1, -2], 'type': {'id': 30, 'name': 'Pass'},
+         'pass': {'end_location': [3, 4]}},
+        {'id': 3, 'type': {'id': 16, 'name': 'Shot'}, 'shot': {'statsbomb_xg': 0.1}},
+        {'id': 4, 'location': [5, 6], 'type': {'id': 42, 'name': 'Ball Receipt*'}},
+        {'id': 5, 'period': 2},
+    ]
+
+    def assertSameParse(self, parser, expectedParser):
+        self.assertSetEqual(set(expectedParser['tableMap'].keys()), set(parser['tableMap'].keys()))
+        self.assertSetEqual(set(expectedParser['rowMap'].keys()), set(parser['rowMap'].keys()))
+        self.assertSetEqual(set(expectedParser['indexed'].keys()), set(parser['indexed'].keys()))
+
+    def testFilter(self):
+        for engine in self.engines:
+            with self.subTest(engine=engine):
+                parser = self.parse(engine=engine, elementFilter={'type.name': {'Pass', 'Shot'}})
+                self.assertSameParse(parser, self.parse(self.data[1:3], engine=engine))
+                self.assertFalse('tactics' in parser['tableMap'])
+
+    def testPredicate(self):
+        for engine in self.engines:
+            with self.subTest(engine=engine):
+                parser = self.parse(engine=engine, elementFilter={
+                    'id': lambda id: id > 1,
+                    'type.id': lambda id: id is None or id > 20,
+                })
+                self.assertSameParse(parser, self.parse(self.data[1:2] + self.data[3:], engine=engine))
+                # Arrays are not values.
+                parser = self.parse(engine=engine, elementFilter={'location': lambda val: val is None})
+                self.assertEqual(5, len(parser['tableMap']['events']['rows']))
+
+    def testArrays(self):
+        # Items without the field, or with None, are passed over by both
+        # engines.
+        data = [
+            {'id': 1, 'lineup': [{'jersey_number': None}, {'number': 7}, {'jersey_number': 9}]},
+            {'id': 2, 'lineup': [{'jersey_number': 10}, {'jersey_number': 9}]},
+            {'id': 3, 'lineup': [{'jersey_number': None}]},
+        ]
+        for accepted, ids in (({9}, [1]), ({None}, [3])):
+            for engine in self.engines:
+                with self.subTest(engine=engine, accepted=accepted):
+                    parser = self.parse(data, engine=engine,
+                                        elementFilter={'lineup.jersey_number': accepted})
+                    self.assertListEqual(ids, sorted([
+                        row['id'] for row in parser['rowMap'].values() if 'id' in row
+                    ]))
+
+
+class TestParserReferences(ParserTestCase):
+
+    config = {'referenceColumns': ('id', 'name')}
+    data = [
+        {'id': 1, 'type': {'id': 4, 'name': 'Duel'}, 'team': {'id': 7, 'name': 'Hammarby'},
+         'duel': {'type': {'id': 10, 'name': 'Aerial Lost'}}},
+        {'id': 2, 'type': {'id': 10, 'name': 'Interception'}, 'team': {'id': 7, 'name': 'Hammarby'},
+         'player': {'id': 3, 'name': 'Kalle', 'country': {'id': 1, 'name': 'Sweden'}}},
+        {'id': 3, 'type': {'id': 4, 'name': 'Duel'}, 'team': {'id': 8, 'name': 'AIK'},
+         'tactics': {'lineup': [{'id': 3, 'name': 'Kalle'}]}},
+    ]
+
+    def testReferences(self):
+        for engine in self.engines:
+            with self.subTest(engine=engine):
+                parser = self.parse(engine=engine)
+                rowMap = parser['rowMap']
+                self.assertSetEqual(set(['events.type:4', 'events.type:10', 'duel.type:10']),
+                                    parser['tableMap']['type']['rows'])
+                self.assertSetEqual(set(['events.team:7', 'events.team:8']),
+                                    parser['tableMap']['team']['rows'])
+                self.assertEqual('Aerial Lost', rowMap['duel.type:10']['name'])
+                self.assertEqual('Interception', rowMap['events.type:10']['name'])
+                events = sorted([rowMap[rowId] for rowId in parser['tableMap']['events']['rows']],
+                                key=lambda row: row['id'])
+                self.assertListEqual(['events.type:4', 'events.type:10', 'events.type:4'],
+                                     [row['type__id'] for row in events])
+                self.assertEqual(
+                    'duel.type:10', rowMap[next(iter(parser['tableMap']['duel']['rows']))]['type__id'])
+                # Objects with other keys and arrays keep their relations.
+                self.assertSetEqual(set([
+                    ('events', 'duel'), ('events', 'player'), ('events', 'tactics'), ('tactics', 'lineup')
+                ]), set(parser['indexed'].keys()))
+                self.assertEqual('player.country:1', rowMap[next(iter(
+                    parser['tableMap']['player']['rows']))]['country__id'])
+                self.assertFalse(parser.isContentHashed('type'))
+
+    def testColumnar(self):
+        # Natural ids are mixed with the hashes of the other rows.
+        parser = self.parse(engine='tree')
+        columnarParser = self.parse(engine='tree', storage='columnar')
+        self.assertEqual(len(parser['rowMap']), len(columnarParser['rowMap']))
+        for rowId, row in parser['rowMap'].items():
+            self.assertDictEqual(row, columnarParser['rowMap'][rowId])
+
+
+class TestParserNaturalKeys(ParserTestCase):
+
+    rootTableName = 'matches'
+    data = {
+        'match_id': 7,
+        'events': [
+            {'id': 'a', 'location': [1, 2], 'pass': {'length': 3.5}},
+            {'id': 'b', 'location': [1, 2]},
+            {'id': 'a', 'location': [1, 2], 'pass': {'length': 3.5}},
+            {'id': None, 'location': [3, 4]},
+        ],
+    }
+
+    def testNaturalKeys(self):
+        for engine in self.engines:
+            with self.subTest(engine=engine):
+                parser = self.parse(engine=engine, naturalKeys={'matches': 'match_id', 'events': 'id'})
+                hashParser = self.parse(engine=engine)
+                rowMap = parser['rowMap']
+                self.assertSetEqual(set([7]), parser['tableMap']['matches']['rows'])
+                self.assertEqual(parser.createNaturalRowHash('match_id', 7), rowMap[7]['__hash'])
+                # Rows without their natural key are hashed as before.
+                events = parser['tableMap']['events']['rows']
+                self.assertEqual(3, len(events))
+                self.assertTrue(set(['a', 'b']).issubset(events))
+                self.assertEqual(1, len(events.intersection(hashParser['tableMap']['events']['rows'])))
+                self.assertEqual('a', rowMap['a']['__id'])
+                self.assertSetEqual(hashParser['tableMap']['location']['rows'],
+                                    parser['tableMap']['location']['rows'])
+                self.assertListEqual([7, 7, 7, 7], [
+                    relation['matches'] for relation in parser['indexed'][('matches', 'events')]
+                ])
+                self.assertListEqual(['a', 'b'], [
+                    relation['events'] for relation in parser['indexed'][('matches', 'events')]
+                ][:2])
+                self.assertListEqual(['a'], [
+                    relation['events'] for relation in parser['indexed'][('events', 'pass')]
+                ])
+                self.assertFalse(parser.isContentHashed('events'))
+                self.assertTrue(parser.isContentHashed('location'))
+                self.assertTrue(hashParser.isContentHashed('events'))
+
+
+class TestParserMerge(ParserTestCase):
+
+    data = [
+        {'id': i % 5, 'team': {'id': i % 2, 'name': 'Team {}'.format(i % 2)},
+         'location': [i % 3, 1.5], 'tactics': {'lineup': [{'id': j} for j in range(i % 4)]}}
+        for i in range(12)
+    ]
+
+    def testMergeAll(self):
+        parser = self.parse()
+        parts = [self.parse(self.data[i:i + 4]) for i in range(0, len(self.data), 4)]
+        merged = self.createParser().mergeAll(parts)
+        # Merging a part again changes nothing.
+        merged.merge(parts[0])
+
+        self.assertDictEqual(parser['rowMap'], merged['rowMap'])
+        self.assertSetEqual(set(parser['tableMap'].keys()), set(merged['tableMap'].keys()))
+        for name, table in parser['tableMap'].items():
+            self.assertSetEqual(table['rows'], merged['tableMap'][name]['rows'])
+            self.assertSetEqual(table['columns'], merged['tableMap'][name]['columns'])
+            self.assertEqual(table['parent'], merged['tableMap'][name]['parent'])
+        self.assertSetEqual(set(parser['indexed'].keys()), set(merged['indexed'].keys()))
+        for pair, indexees in parser['indexed'].items():
+            self.assertEqual(len(indexees), len(merged['indexed'][pair]))
+            for relation in indexees:
+                parentId = relation[pair[0]]
+                self.assertListEqual(indexees.getChildIds(parentId),
+                                     merged['indexed'][pair].getChildIds(parentId))
+
+    def testNaturalKeys(self):
+        # Events with natural ids get the children of every part they are in.
+        data = [
+            {'id': 'a', 'pass': {'length': 3.5}},
+            {'id': 'a', 'shot': {'xg': 0.1}, 'tags': ['x']},
+            {'id': 'a', 'pass': {'length': 3.5}, 'tags': ['x', 'y']},
+        ]
+        parts = [self.parse([element], naturalKeys={'events': 'id'}) for element in data]
+        merged = self.createParser().mergeAll(parts)
+        self.assertSetEqual(set(['a']), merged['tableMap']['events']['rows'])
+        for childName, count in (('pass', 1), ('shot', 1), ('tags', 2)):
+            self.assertEqual(count, len(merged['indexed'][('events', childName)].getChildIds('a')))
+
+    def testCompacted(self):
+        parser = self.parse(storage='columnar')
+        with self.assertRaises(ValueError):
+            parser.merge(self.parse())
+
+
+class TestIndexees(unittest.TestCase):
+
+    def testChildIds(self):
+        indexees = Indexees(('parents', 'children'))
+        indexees.index((1, 'a'))
+        indexees.index((2, 'b'))
+        indexees.index((1, 'c'))
+
+        self.assertEqual(3, len(indexees))
+        self.assertEqual(['a', 'c'], indexees.getChildIds(1))
+        self.assertEqual(['b'], indexees.getChildIds(2))
+        self.assertEqual([], indexees.getChildIds(3))
+
+    def testRemove(self):
+        indexees = Indexees(('parents', 'children'))
+        indexees.index((1, 'a'))
+        indexees.index((2, 'b'))
+        indexees.index((1, 'c'))
+
+        relation = [r for r in indexees if r['children'] == 'a'][0]
+        indexees.remove(relation)
+        self.assertEqual(2, len(indexees))
+        self.assertEqual(['c'], indexees.getChildIds(1))
+        self.assertEqual([
+            {'parents': 2, 'children': 'b'},
+            {'parents': 1, 'children': 'c'},
+        ], list(indexees))
+
+
 if __name__ == '__main__':
 
     import sys
@@ -0,0 +1,65 @@
+from src.jsonparser_v2.rowhash import RowEncoder
+from test.jsonparser_v2.parsertestcase import ParserTestCase
+
+import unittest
+
+
+class TestRowEncoder(unittest.TestCase):
+
+    row = {'name': 'Kalle', 'height': 1.85, 'age': 42, 'active': True, 'team': None}
+
+    def testStable(self):
+        encoder = RowEncoder()
+        self.assertEqual(
+            b'\x05\x00\x00\x00'
+            b'\x06\x00\x00\x00activeT\x03\x00\x00\x00agei\x06\x00\x00\x00heightd'
+            b'\x04\x00\x00\x00names\x04\x00\x00\x00teamN'
+            b'\x01*\x00\x00\x00\x00\x00\x00\x00\x9a\x99\x99\x99\x99\x99\xfd?\x05\x00\x00\x00'
+            b'Kalle'
+            b'\x01\x00\x00\x00\x08\x00\x00\x00children\x05\x00\x00\x00\x00\x00\x00\x00',
+            encoder.encode(self.row, [('children', 2 ** 64 + 5)]))
+        self.assertEqual(1134786476392163887,
+                         encoder.hash(self.row, [('children', 2 ** 64 + 5)]))
+
+    def testTypes(self):
+        encoder = RowEncoder()
+        values = [1, 1.0, True, '1', None, 2 ** 70, str(2 ** 70), -2 ** 63]
+        hashes = set([encoder.hash({'a': val}) for val in values])
+        self.assertEqual(len(values), len(hashes))
+        self.assertEqual(encoder.hash({'a': 1, 'b': 2}),
+                         encoder.hash({'b': 2, 'a': 1}))
+        self.assertEqual(encoder.hash({'a': 1}),
+                         encoder.hash({'a': 1, '__id': 7}, skipCols=('__id',)))
+
+    def testBatch(self):
+        encoder = RowEncoder()
+        rows = [self.row, {'a': 2 ** 70}, {'a': 'x'}, self.row]
+        childSums = [[i, 2 * i] for i in range(len(rows))]
+        self.assertListEqual([
+            encoder.hash(row, [('b', sums[0]), ('c', sums[1])])
+            for row, sums in zip(rows, childSums)
+        ], encoder.hashBatch(rows, ('b', 'c'), childSums))
+
+
+class TestParserRowEncoding(ParserTestCase):
+
+    data = [
+        {'id': i, 'name': 'Player {}'.format(i % 3), 'location': [i, 1.5],
+         'team': {'id': i % 2, 'name': 'Team {}'.format(i % 2)}}
+        for i in range(6)
+    ]
+
+    def testBinary(self):
+        parser = self.parse(rowEncoding='json')
+        binaryParser = self.parse(rowEncoding='binary')
+        self.assertEqual(len(parser['rowMap']), len(binaryParser['rowMap']))
+        for name, table in parser['tableMap'].items():
+            self.assertEqual(len(table['rows']),
+                             len(binaryParser['tableMap'][name]['rows']))
+        self.assertTrue(set(parser['rowMap'].keys()).isdisjoint(binaryParser['rowMap'].keys()))
+        self.assertSetEqual(binaryParser['tableMap']['events']['rows'],
+                            self.parse(rowEncoding='binary')['tableMap']['events']['rows'])
+
+
+if __name__ == '__main__':
+    unittest.main()
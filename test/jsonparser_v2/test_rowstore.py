@@ -0,0 +1,67 @@
+from src.jsonparser_v2.rowstore import SpillStore
+from test.jsonparser_v2.parsertestcase import ParserTestCase
+
+import unittest
+
+
+class TestRowStore(ParserTestCase):
+
+    data = [
+        {
+            'id': i,
+            'name': 'Player {}'.format(i % 7),
+            'team': {'id': i % 2, 'name': 'Team {}'.format(i % 2)},
+            'location': [i * 1.5, 80.0],
+        } for i in range(50)
+    ]
+
+    def testRowMap(self):
+        store = SpillStore(3)
+        rowMap = store.createRowMap()
+        for i in range(10):
+            rowMap[i] = {'i': i}
+        rowMap[2 ** 64 - 1] = {'i': -1}
+        self.assertEqual(11, len(rowMap))
+        self.assertTrue(rowMap.spilledCount > 0)
+        self.assertEqual({'i': 0}, rowMap[0])
+        self.assertEqual({'i': -1}, rowMap[2 ** 64 - 1])
+        del rowMap[1]
+        self.assertFalse(1 in rowMap)
+        self.assertEqual(sorted([0] + list(range(2, 10)) + [2 ** 64 - 1]),
+                         sorted(rowMap))
+        with self.assertRaises(KeyError):
+            rowMap[1]
+        store.close()
+
+    def testIndexees(self):
+        store = SpillStore(4)
+        indexees = store.createIndexees(('a', 'b'))
+        for i in range(10):
+            indexees.index((i % 3, i))
+        self.assertEqual(10, len(indexees))
+        self.assertTrue(indexees.spilledCount > 0)
+        self.assertEqual([0, 3, 6, 9], indexees.getChildIds(0))
+        for relation in list(indexees):
+            if relation['b'] in (3, 9):
+                indexees.remove(relation)
+        self.assertEqual([0, 6], indexees.getChildIds(0))
+        self.assertEqual([0, 1, 2, 4, 5, 6, 7, 8],
+                         [relation['b'] for relation in indexees])
+        store.close()
+
+    def testEqualOutput(self):
+        parser = self.parse()
+        spillParser = self.parse(rowStore='spill', rowStoreBudget=10)
+
+        self.assertEqual(len(parser['rowMap']), len(spillParser['rowMap']))
+        for rowId, row in parser['rowMap'].items():
+            self.assertEqual(row, spillParser['rowMap'][rowId])
+        for name, table in parser['tableMap'].items():
+            self.assertSetEqual(table['rows'],
+                                set(spillParser['tableMap'][name]['rows']))
+        for pair, indexees in parser['indexed'].items():
+            self.assertEqual(list(indexees), list(spillParser['indexed'][pair]))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,102 @@
+import os
+import tempfile
+
+from src.jsonparser_v2.schemaplan import SchemaPlan
+from test.jsonparser_v2.parsertestcase import ParserTestCase
+
+import unittest
+
+
+class TestSchemaPlan(ParserTestCase):
+
+    def testPlan(self):
+        with tempfile.TemporaryDirectory() as planDir:
+            data = [
+                {'id': 1, 'type': {'id': 30, 'name': 'Pass'}},
+                {'id': 2, 'type': {'id': 42, 'name': 'Ball Receipt'}},
+            ]
+            parser = self.parse(data, schemaPlanDir=planDir)
+            plan = SchemaPlan.load(planDir, 'events')
+            self.assertEqual(plan.toJSON(), parser['schemaPlan'].toJSON())
+            self.assertEqual(['type'], plan.tables['events']['children'])
+            self.assertEqual('events', plan.tables['type']['parent'])
+            self.assertEqual(['__id', 'id', 'name'],
+                             plan.tables['type']['columns'])
+
+            data[1]['pass'] = {'length': 12.5}
+            self.parse(data, schemaPlanDir=planDir)
+            plan = SchemaPlan.load(planDir, 'events')
+            self.assertEqual(['type', 'pass'], plan.tables['events']['children'])
+            self.assertEqual(['__id', 'length'], plan.tables['pass']['columns'])
+
+    def testLoaded(self):
+        with tempfile.TemporaryDirectory() as planDir:
+            data = [{'id': 1, 'type': {'id': 30, 'name': 'Pass'}}]
+            self.parse(data, schemaPlanDir=planDir)
+            parser = self.createParser(schemaPlanDir=planDir)
+            self.assertSetEqual(set(['events', 'type']), set(parser['schemaPlan'].tables))
+
+            # A file without anything new leaves the plan as it is.
+            path = SchemaPlan.getPath(planDir, 'events')
+            os.utime(path, (0, 0))
+            parser.parse('[{"id": 2, "type": {"id": 42}}]')
+            self.assertEqual(0, os.path.getmtime(path))
+
+    def testCollapsed(self):
+        # Tables of the plan are collapsed as in the first file, even where
+        # the rows of another file would decide otherwise.
+        same = [
+            {'id': 1, 'outer': {'inner': {'a': 1}}},
+            {'id': 2, 'outer': {'inner': {'a': 1}}},
+        ]
+        other = [
+            {'id': 1, 'outer': {'inner': {'a': 1}}},
+            {'id': 2, 'outer': {'inner': {'a': 2}}},
+        ]
+        self.assertIn('inner', self.parse(other)['tableMap'])
+        with tempfile.TemporaryDirectory() as planDir:
+            for engine in self.engines:
+                with self.subTest(engine=engine):
+                    self.parse(same, schemaPlanDir=planDir, engine=engine)
+                    plan = SchemaPlan.load(planDir, 'events')
+                    self.assertEqual({'inner': 'outer'}, plan.collapsed)
+
+                    parser = self.parse(other, schemaPlanDir=planDir, engine=engine)
+                    self.assertNotIn('inner', parser['tableMap'])
+                    self.assertSetEqual(set([1, 2]), set([
+                        row['a'] for row in parser['rowMap'].values() if 'a' in row
+                    ]))
+                    self.assertEqual(2, len(parser['tableMap']['outer']['rows']))
+
+    def testMerged(self):
+        # Parsers that start from the same plan, as parallel workers do,
+        # add to the plan on disk instead of replacing each other's tables.
+        with tempfile.TemporaryDirectory() as planDir:
+            self.parse([{'id': 1}], schemaPlanDir=planDir)
+            parsers = [self.createParser(schemaPlanDir=planDir) for _ in range(2)]
+            parsers[0].parse('[{"id": 1, "pass": {"length": 12.5}}]')
+            parsers[1].parse('[{"id": 1, "shot": {"xg": 0.1}}]')
+            plan = SchemaPlan.load(planDir, 'events')
+            self.assertEqual(['pass', 'shot'], plan.tables['events']['children'])
+            self.assertEqual(plan.toJSON(), parsers[1]['schemaPlan'].toJSON())
+
+    def testUpdate(self):
+        plan = SchemaPlan('events', {
+            'events': {'parent': None, 'children': ['type'], 'columns': ['__id']},
+        })
+        self.assertFalse(plan.update(SchemaPlan('events', plan.tables)))
+        self.assertTrue(plan.update(SchemaPlan('events', {
+            'events': {'parent': None, 'children': ['type'], 'columns': ['__id', 'id']},
+        }, {'outcome': 'pass'})))
+        self.assertEqual(['__id', 'id'], plan.tables['events']['columns'])
+        self.assertEqual({'outcome': 'pass'}, plan.collapsed)
+        self.assertTrue(plan.covers(SchemaPlan('events', {
+            'events': {'parent': None, 'children': [], 'columns': ['id']},
+        })))
+        self.assertFalse(plan.covers(SchemaPlan('events', {
+            'type': {'parent': 'events', 'children': [], 'columns': ['__id']},
+        })))
+
+
+if __name__ == '__main__':
+    unittest.main()
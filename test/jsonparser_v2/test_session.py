@@ -0,0 +1,125 @@
+import pickle
+import ujson
+
+from src.jsonparser_v2.parser import Parser
+from src.jsonparser_v2.columnar import ColumnarRowMap
+from src.jsonparser_v2.session import ParseSession
+from test.jsonparser_v2.parsertestcase import ParserTestCase
+
+import unittest
+
+
+class TestParseSession(ParserTestCase):
+
+    files = {
+        'first.json': [
+            {'id': 1, 'team': {'id': 10, 'name': 'Arsenal'},
+             'location': [10.5, 20.5]},
+            {'id': 2, 'team': {'id': 11, 'name': 'Chelsea'},
+             'location': [1.5, 2.5]},
+        ],
+        'second.json': [
+            {'id': 3, 'team': {'id': 10, 'name': 'Arsenal'},
+             'location': [10.5, 20.5]},
+            {'id': 1, 'team': {'id': 10, 'name': 'Arsenal'},
+             'location': [10.5, 20.5]},
+        ],
+    }
+
+    def parseFile(self, fileName):
+        return self.parse(self.files[fileName], fileName=fileName)
+
+    def testAdd(self):
+        parsers = [self.parseFile(fileName) for fileName in self.files.keys()]
+        session = ParseSession()
+        for parser in parsers:
+            session.add(parser)
+
+        rowIds = set()
+        for parser in parsers:
+            rowIds.update(parser['rowMap'].keys())
+            for rowId, row in parser['rowMap'].items():
+                self.assertEqual(row, session['rowMap'][rowId])
+        self.assertEqual(rowIds, set(session['rowMap'].keys()))
+        self.assertLess(len(session['rowMap']),
+                        sum([len(parser['rowMap']) for parser in parsers]))
+
+        first = parsers[0]
+        team = list(first['tableMap']['team']['rows'])
+        arsenal = [rowId for rowId in team
+                   if session['rowMap'][rowId]['name'] == 'Arsenal'][0]
+        chelsea = [rowId for rowId in team
+                   if session['rowMap'][rowId]['name'] == 'Chelsea'][0]
+        self.assertEqual(['first.json', 'second.json'],
+                         session['provenance'][arsenal])
+        self.assertEqual(['first.json'], session['provenance'][chelsea])
+        self.assertEqual('first.json', session.getRowFileName(arsenal))
+        self.assertEqual(['first.json', 'second.json'], session['fileNames'])
+
+        for parser in parsers:
+            for pair, indexees in parser['indexed'].items():
+                sessionIndexees = session['indexed'][pair]
+                for relation in indexees:
+                    parentId = relation[pair[0]]
+                    self.assertEqual(indexees.getChildIds(parentId),
+                                     sessionIndexees.getChildIds(parentId))
+
+        self.assertEqual(set(first['tableMap'].keys()),
+                         set(session['tableMap'].keys()))
+        self.assertTrue(len(session.report()) > 0)
+
+    def testResult(self):
+        # Results of worker processes give the session of their parsers.
+        parsers = [self.parseFile(fileName) for fileName in self.files.keys()]
+        session = ParseSession()
+        resultSession = ParseSession()
+        for parser in parsers:
+            session.add(parser)
+            resultSession.add(Parser.fromResult(pickle.loads(pickle.dumps(parser.getResult()))))
+        self.assertDictEqual(session['rowMap'], resultSession['rowMap'])
+        self.assertDictEqual(session['provenance'], resultSession['provenance'])
+        for pair, indexees in session['indexed'].items():
+            self.assertListEqual(list(indexees), list(resultSession['indexed'][pair]))
+
+    def testCompactedResult(self):
+        # Compacted results stay compacted on their way to the session.
+        session = ParseSession()
+        resultSession = ParseSession()
+        for fileName in self.files.keys():
+            session.add(self.parseFile(fileName))
+            parser = self.parse(self.files[fileName], fileName=fileName, storage='columnar')
+            result = Parser.fromResult(pickle.loads(pickle.dumps(parser.getResult())))
+            self.assertIsInstance(result['rowMap'], ColumnarRowMap)
+            resultSession.add(result)
+        resultSession.compact()
+        self.assertDictEqual(session['rowMap'], dict(resultSession['rowMap']))
+        self.assertDictEqual(session['provenance'], resultSession['provenance'])
+        for pair, indexees in session['indexed'].items():
+            for relation in indexees:
+                parentId = relation[pair[0]]
+                self.assertEqual(indexees.getChildIds(parentId),
+                                 resultSession['indexed'][pair].getChildIds(parentId))
+
+    def testContentHashed(self):
+        session = ParseSession()
+        session.add(self.parse(self.files['first.json'], naturalKeys={'events': 'id'}))
+        session.add(self.parseFile('second.json'))
+        self.assertFalse(session.isContentHashed('events'))
+        self.assertTrue(session.isContentHashed('team'))
+
+    def testParse(self):
+        session = ParseSession({
+            'config': {
+                'rootTableName': 'events',
+            }
+        })
+        session.parse(ujson.dumps(self.files['first.json']))
+        session.parse(ujson.dumps(self.files['second.json']))
+        self.assertEqual(
+            set(self.parseFile('first.json')['rowMap'].keys())
+            .union(self.parseFile('second.json')['rowMap'].keys()),
+            set(session['rowMap'].keys()))
+
+
+if __name__ == '__main__':
+    unittest.main()
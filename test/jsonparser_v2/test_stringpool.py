@@ -0,0 +1,59 @@
+from src.jsonparser_v2.stringpool import StringPool
+from test.jsonparser_v2.parsertestcase import ParserTestCase
+
+import unittest
+
+
+class TestStringPool(unittest.TestCase):
+
+    def copy(self, val):
+        return ''.join(list(val))
+
+    def testIntern(self):
+        pool = StringPool(maxLength=8, maxCount=2)
+        a = pool.intern(self.copy('Regular Play'[:7]))
+        self.assertIs(a, pool.intern(self.copy(a)))
+        long = self.copy('Regular Play')
+        self.assertIs(long, pool.intern(long))
+        b = pool.intern(self.copy('Pass'))
+        c = pool.intern(self.copy('Shot'))
+        self.assertIsNot(c, pool.intern(self.copy(c)))
+        self.assertIs(b, pool.intern(self.copy(b)))
+        stats = pool.getStats()
+        self.assertEqual(2, stats['strings'])
+        self.assertEqual(6, stats['lookups'])
+        self.assertEqual(2, stats['hits'])
+        self.assertGreater(stats['savedBytes'], 0)
+        pool.clear()
+        self.assertEqual(0, len(pool))
+        self.assertEqual(0, pool.getStats()['lookups'])
+
+
+class TestParserStringPool(ParserTestCase):
+
+    data = [
+        {'id': i, 'type': {'id': 30, 'name': 'Pass'}, 'play_pattern': 'Regular Play'}
+        for i in range(3)
+    ]
+
+    def getValues(self, parser, col):
+        return [
+            row[col] for row in parser['rowMap'].values() if col in row
+        ]
+
+    def testShared(self):
+        pool = StringPool()
+        values = self.getValues(self.parse(stringPool=pool), 'play_pattern') \
+            + self.getValues(self.parse(stringPool=pool), 'play_pattern')
+        self.assertEqual(6, len(values))
+        for val in values:
+            self.assertIs(values[0], val)
+        self.assertGreater(pool.getStats()['hits'], 0)
+
+    def testDisabled(self):
+        parser = self.parse(stringPool=None)
+        self.assertListEqual(['Regular Play'] * 3, self.getValues(parser, 'play_pattern'))
+
+
+if __name__ == '__main__':
+    unittest.main()
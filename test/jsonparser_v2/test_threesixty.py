@@ -0,0 +1,72 @@
+from src.jsonparser_v2.threesixty import unpackArray
+from test.jsonparser_v2.parsertestcase import ParserTestCase
+
+import unittest
+
+
+class TestThreeSixty(ParserTestCase):
+
+    rootTableName = 'threesixty'
+    data = [
+        {
+            'event_uuid': 'a',
+            'visible_area': [0, 0, 120, 0, 120, 80.5, -1, 80.5],
+            'freeze_frame': [
+                {'teammate': True, 'actor': True, 'keeper': False, 'location': [60.5, 40]},
+                {'teammate': False, 'actor': False, 'keeper': True, 'location': [118, -0.0]},
+            ],
+        },
+        {
+            'event_uuid': 'b',
+            'visible_area': [],
+            'freeze_frame': [
+                {'teammate': True, 'actor': False, 'location': [-2, 3.25]},
+            ],
+        },
+        {
+            'event_uuid': 'c',
+            'visible_area': [1.5, 2.5],
+            'freeze_frame': [],
+        },
+    ]
+
+    def testIds(self):
+        for flattenArrayLength in (0, 2, 8):
+            parser = self.parse(engine='tree', flattenArrayLength=flattenArrayLength)
+            threeSixtyParser = self.parse(engine='threesixty', flattenArrayLength=flattenArrayLength)
+            self.assertSetEqual(parser['tableMap']['threesixty']['rows'],
+                                threeSixtyParser['tableMap']['threesixty']['rows'])
+            self.assertListEqual(['threesixty'], list(threeSixtyParser['tableMap'].keys()))
+            self.assertEqual(0, len(threeSixtyParser['indexed']))
+
+    def testNaturalKeys(self):
+        naturalKeys = {'threesixty': 'event_uuid'}
+        parser = self.parse(engine='tree', naturalKeys=naturalKeys)
+        threeSixtyParser = self.parse(engine='threesixty', naturalKeys=naturalKeys)
+        self.assertSetEqual(set(['a', 'b', 'c']), threeSixtyParser['tableMap']['threesixty']['rows'])
+        for rowId in ('a', 'b', 'c'):
+            self.assertEqual(parser['rowMap'][rowId]['__hash'],
+                             threeSixtyParser['rowMap'][rowId]['__hash'])
+
+    def testPacked(self):
+        parser = self.parse(engine='threesixty')
+        rows = {row['event_uuid']: row for row in parser['rowMap'].values()}
+        self.assertListEqual([0, 0, 120, 0, 120, 80.5, -1, 80.5],
+                             list(unpackArray(rows['a']['visible_area'])))
+        self.assertListEqual([60.5, 118], list(unpackArray(rows['a']['freeze_frame_x'])))
+        self.assertListEqual([40, 0], list(unpackArray(rows['a']['freeze_frame_y'])))
+        self.assertListEqual([2], list(unpackArray(rows['b']['freeze_frame_keeper'], '<u1')))
+        self.assertEqual(0, len(unpackArray(rows['c']['freeze_frame_x'])))
+
+    def testFallback(self):
+        data = [{'event_uuid': 'a', 'freeze_frame': [{'location': [1, 2], 'actor': True}]}]
+        parser = self.parse(data, engine='tree')
+        threeSixtyParser = self.parse(data, engine='threesixty')
+        self.assertSetEqual(set(parser['tableMap'].keys()),
+                            set(threeSixtyParser['tableMap'].keys()))
+        self.assertSetEqual(set(parser['rowMap'].keys()),
+                            set(threeSixtyParser['rowMap'].keys()))
+
+
+if __name__ == '__main__':
+    unittest.main()
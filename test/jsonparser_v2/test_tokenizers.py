@@ -0,0 +1,84 @@
+import ujson
+
+from src.jsonparser_v2.tokenizers import Tokenizer
+from src.jsonparser_v2.tokenizers import JsonStreamerTokenizer
+from src.jsonparser_v2.tokenizers import PythonTokenizer
+from src.jsonparser_v2.tokenizers import createTokenizer
+from src.jsonparser_v2.tokenizers import getAvailableTokenizers
+from test.jsonparser_v2.parsertestcase import ParserTestCase
+
+import unittest
+
+
+class EventRecorder:
+
+    def __init__(self):
+        self.events = []
+
+    def __getattr__(self, name):
+        if not name.startswith('_on_'):
+            raise AttributeError(name)
+        return lambda *args: self.events.append((name[4:],) + args)
+
+
+class TestTokenizers(ParserTestCase):
+
+    rootTableName = 'players'
+
+    text = ' [{"id": 1, "name": "Kalle \\"K\\" \\u00e5", "height": 1.85, "x": -3, ' \
+        '"e": 1e2, "active": true, "team": null, "tags": ["a", [], {}, false], ' \
+        '"nested": {"a": {"b": [1, -2.5]}}}, {"id": 1234567890123}]\n'
+
+    def tokenize(self, name, chunkSize):
+        recorder = EventRecorder()
+        tokenizer = createTokenizer(name, recorder)
+        for i in range(0, len(self.text), chunkSize):
+            tokenizer.consume(self.text[i:i + chunkSize])
+        tokenizer.close()
+        return recorder.events
+
+    def testEvents(self):
+        names = getAvailableTokenizers()
+        self.assertIn('python', names)
+        events = self.tokenize('python', len(self.text))
+        self.assertListEqual([
+            ('doc_start',), ('array_start',), ('object_start',), ('key', 'id'), ('value', 1),
+            ('key', 'name'), ('value', 'Kalle "K" å'), ('key', 'height'), ('value', 1.85),
+        ], events[:9])
+        self.assertIn(('value', -3.0), events)
+        self.assertIs(float, type(events[events.index(('value', -3.0))][1]))
+        for name in names:
+            for chunkSize in (1, 2, 7, 64):
+                self.assertListEqual(events, self.tokenize(name, chunkSize))
+
+    def testDefault(self):
+        # ijson is only used when configured.
+        tokenizer = createTokenizer(None, EventRecorder())
+        self.assertIs(JsonStreamerTokenizer if JsonStreamerTokenizer.isAvailable()
+                      else PythonTokenizer, type(tokenizer))
+        parser = self.parse('[{"d": 10000000000000000000}]')
+        self.assertListEqual([10 ** 19], [row['d'] for row in parser['rowMap'].values()])
+
+    def testInvalid(self):
+        for text in ('[{"a": tru}]', '[{"a": 1}', '[{"a": @}]', '[1 2]', '{"a" 1}',
+                     '{"a":1,}', '[1,]', '[1}', '{"a":1]', '{1:2}', '[1]]', '[1][2]', ''):
+            tokenizer = createTokenizer('python', EventRecorder())
+            with self.assertRaises(ValueError):
+                tokenizer.consume(text)
+                tokenizer.close()
+        with self.assertRaises(ValueError):
+            createTokenizer('yaml', EventRecorder())
+        with self.assertRaises(TypeError):
+            Tokenizer(EventRecorder())
+
+    def testParser(self):
+        data = ujson.loads(self.text)
+        rowMaps = []
+        for name in getAvailableTokenizers():
+            rowMaps.append(self.parse(data, tokenizer=name, bufferSize=16)['rowMap'])
+        for rowMap in rowMaps:
+            self.assertDictEqual(rowMaps[0], rowMap)
+
+
+if __name__ == '__main__':
+    unittest.main()